@@ -0,0 +1,52 @@
+"""discount_usage_counters: счётчики применений правил скидок клиентами
+
+Revision ID: 0000_discount_usage_counters
+Revises:
+Create Date: 2026-10-18 11:00:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0000_discount_usage_counters'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    bind = op.get_bind()
+    inspector = sa.inspect(bind)
+
+    # Таблица могла быть уже создана (пустой) через Base.metadata.create_all при старте приложения
+    if not inspector.has_table("discount_usage_counters"):
+        _create_table()
+
+    # Заполнение из истории применений, если счётчиков ещё нет
+    # (то же делает scripts/backfill_discount_usage.py)
+    if bind.execute(sa.text("SELECT 1 FROM discount_usage_counters LIMIT 1")).first() is not None:
+        return
+    op.execute(
+        "INSERT INTO discount_usage_counters (customer_id, discount_rule_id, uses_count, last_used_at) "
+        "SELECT customer_id, discount_rule_id, COUNT(id), MAX(applied_at) FROM discount_applications "
+        "GROUP BY customer_id, discount_rule_id"
+    )
+
+
+def _create_table():
+    op.create_table(
+        "discount_usage_counters",
+        sa.Column("customer_id", sa.Integer(), nullable=False),
+        sa.Column("discount_rule_id", sa.Integer(), nullable=False),
+        sa.Column("uses_count", sa.Integer(), nullable=False),
+        sa.Column("last_used_at", sa.DateTime(), server_default=sa.func.now(), nullable=True),
+        sa.ForeignKeyConstraint(["customer_id"], ["customers.id"]),
+        sa.ForeignKeyConstraint(["discount_rule_id"], ["discount_rules.id"]),
+        sa.PrimaryKeyConstraint("customer_id", "discount_rule_id"),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table("discount_usage_counters")
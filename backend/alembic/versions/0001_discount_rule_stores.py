@@ -0,0 +1,66 @@
+"""discount_rule_stores: нормализованная привязка правил скидок к магазинам
+
+Revision ID: 0001_discount_rule_stores
+Revises: 0000_discount_usage_counters
+Create Date: 2026-10-18 12:00:00
+
+"""
+import json
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0001_discount_rule_stores'
+down_revision = '0000_discount_usage_counters'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    bind = op.get_bind()
+    inspector = sa.inspect(bind)
+
+    # Таблица могла быть уже создана через Base.metadata.create_all при старте приложения
+    if not inspector.has_table("discount_rule_stores"):
+        op.create_table(
+            "discount_rule_stores",
+            sa.Column("discount_rule_id", sa.Integer(), nullable=False),
+            sa.Column("store_id", sa.Integer(), nullable=False),
+            sa.ForeignKeyConstraint(["discount_rule_id"], ["discount_rules.id"], ondelete="CASCADE"),
+            sa.PrimaryKeyConstraint("discount_rule_id", "store_id"),
+        )
+        op.create_index(
+            "ix_discount_rule_stores_store_rule",
+            "discount_rule_stores",
+            ["store_id", "discount_rule_id"],
+        )
+
+    # Заполнение из JSON-поля applicable_stores
+    rules = sa.table("discount_rules", sa.column("id", sa.Integer), sa.column("applicable_stores", sa.Text))
+    links = sa.table(
+        "discount_rule_stores",
+        sa.column("discount_rule_id", sa.Integer),
+        sa.column("store_id", sa.Integer),
+    )
+
+    existing_links = {
+        (row.discount_rule_id, row.store_id)
+        for row in bind.execute(sa.select(links.c.discount_rule_id, links.c.store_id))
+    }
+
+    rows = []
+    for rule_id, raw in bind.execute(sa.select(rules.c.id, sa.cast(rules.c.applicable_stores, sa.Text))):
+        # JSON хранится строкой; None в JSON-колонке может быть записан как 'null'
+        store_ids = json.loads(raw) if raw else None
+        for store_id in set(store_ids or []):
+            if (rule_id, store_id) not in existing_links:
+                rows.append({"discount_rule_id": rule_id, "store_id": store_id})
+
+    if rows:
+        op.bulk_insert(links, rows)
+
+
+def downgrade() -> None:
+    op.drop_index("ix_discount_rule_stores_store_rule", table_name="discount_rule_stores")
+    op.drop_table("discount_rule_stores")
@@ -0,0 +1,57 @@
+"""purchase_history: уникальный номер чека в пределах магазина
+
+Revision ID: 0002_purchase_receipt_unique
+Revises: 0001_discount_rule_stores
+Create Date: 2026-10-18 13:00:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0002_purchase_receipt_unique'
+down_revision = '0001_discount_rule_stores'
+branch_labels = None
+depends_on = None
+
+INDEX_NAME = "ux_purchase_history_store_receipt"
+
+
+def upgrade() -> None:
+    bind = op.get_bind()
+    inspector = sa.inspect(bind)
+    if INDEX_NAME in {index["name"] for index in inspector.get_indexes("purchase_history")}:
+        return
+
+    purchases = sa.table(
+        "purchase_history",
+        sa.column("id", sa.Integer),
+        sa.column("store_id", sa.Integer),
+        sa.column("receipt_number", sa.String),
+    )
+
+    # Дубликаты: первая покупка сохраняет номер чека, остальные получают суффикс -<id>
+    duplicates = sa.select(purchases.c.store_id, purchases.c.receipt_number).where(
+        purchases.c.receipt_number.isnot(None)
+    ).group_by(purchases.c.store_id, purchases.c.receipt_number).having(sa.func.count() > 1)
+
+    for store_id, receipt_number in bind.execute(duplicates).all():
+        ids = bind.execute(
+            sa.select(purchases.c.id).where(
+                purchases.c.store_id == store_id,
+                purchases.c.receipt_number == receipt_number
+            ).order_by(purchases.c.id)
+        ).scalars().all()
+        for purchase_id in ids[1:]:
+            bind.execute(
+                purchases.update().where(purchases.c.id == purchase_id).values(
+                    receipt_number=f"{receipt_number}-{purchase_id}"
+                )
+            )
+
+    op.create_index(INDEX_NAME, "purchase_history", ["store_id", "receipt_number"], unique=True)
+
+
+def downgrade() -> None:
+    op.drop_index(INDEX_NAME, table_name="purchase_history")
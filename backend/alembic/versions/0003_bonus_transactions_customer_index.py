@@ -0,0 +1,30 @@
+"""bonus_transactions: индекс (customer_id, transaction_type, transaction_date)
+
+Revision ID: 0003_bonus_tx_customer_index
+Revises: 0002_purchase_receipt_unique
+Create Date: 2026-10-18 14:00:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0003_bonus_tx_customer_index'
+down_revision = '0002_purchase_receipt_unique'
+branch_labels = None
+depends_on = None
+
+INDEX_NAME = "ix_bonus_transactions_customer_type_date"
+
+
+def upgrade() -> None:
+    inspector = sa.inspect(op.get_bind())
+    if INDEX_NAME not in {index["name"] for index in inspector.get_indexes("bonus_transactions")}:
+        op.create_index(
+            INDEX_NAME, "bonus_transactions", ["customer_id", "transaction_type", "transaction_date"]
+        )
+
+
+def downgrade() -> None:
+    op.drop_index(INDEX_NAME, table_name="bonus_transactions")
@@ -0,0 +1,32 @@
+"""bonus_transactions: индекс (customer_id, transaction_date DESC, id DESC) для keyset-пагинации
+
+Revision ID: 0004_bonus_tx_keyset_index
+Revises: 0003_bonus_tx_customer_index
+Create Date: 2026-10-18 15:00:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0004_bonus_tx_keyset_index'
+down_revision = '0003_bonus_tx_customer_index'
+branch_labels = None
+depends_on = None
+
+INDEX_NAME = "ix_bonus_transactions_customer_date_id"
+
+
+def upgrade() -> None:
+    inspector = sa.inspect(op.get_bind())
+    if INDEX_NAME not in {index["name"] for index in inspector.get_indexes("bonus_transactions")}:
+        op.create_index(
+            INDEX_NAME,
+            "bonus_transactions",
+            ["customer_id", sa.text("transaction_date DESC"), sa.text("id DESC")]
+        )
+
+
+def downgrade() -> None:
+    op.drop_index(INDEX_NAME, table_name="bonus_transactions")
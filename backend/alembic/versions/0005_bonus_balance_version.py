@@ -0,0 +1,30 @@
+"""bonus_balances: столбец version для кэша балансов
+
+Revision ID: 0005_bonus_balance_version
+Revises: 0004_bonus_tx_keyset_index
+Create Date: 2026-10-18 16:00:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0005_bonus_balance_version'
+down_revision = '0004_bonus_tx_keyset_index'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    inspector = sa.inspect(op.get_bind())
+    if "version" not in {column["name"] for column in inspector.get_columns("bonus_balances")}:
+        op.add_column(
+            "bonus_balances",
+            sa.Column("version", sa.Integer(), nullable=False, server_default="0")
+        )
+
+
+def downgrade() -> None:
+    with op.batch_alter_table("bonus_balances") as batch_op:
+        batch_op.drop_column("version")
@@ -0,0 +1,107 @@
+"""customer_search_terms: поисковый индекс клиентов
+
+Revision ID: 0006_customer_search_terms
+Revises: 0005_bonus_balance_version
+Create Date: 2026-10-18 17:00:00
+
+Термы существующих клиентов заполняются здесь же пачками; перестроить индекс
+целиком можно скриптом: python -m scripts.build_search_index
+"""
+import re
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0006_customer_search_terms'
+down_revision = '0005_bonus_balance_version'
+branch_labels = None
+depends_on = None
+
+BATCH_SIZE = 5000
+
+# Копия правил построения термов на момент миграции (app/services/customer_search.py):
+# данные миграции не должны меняться вместе с кодом приложения
+_WORD = re.compile(r"\w+")
+
+
+def _normalize(value: str) -> str:
+    return value.strip().lower().replace("ё", "е")
+
+
+def _terms_for(row):
+    terms = set()
+    digits = "".join(char for char in row.phone or "" if char.isdigit())
+    if digits:
+        terms.add(("phone", digits[::-1]))
+    for value in (row.first_name, row.last_name):
+        for word in _WORD.findall(_normalize(value or "")):
+            terms.add(("name", word))
+    if row.email:
+        terms.add(("email", _normalize(row.email)))
+    return terms
+
+customers = sa.table(
+    "customers",
+    sa.column("id", sa.Integer),
+    sa.column("phone", sa.String),
+    sa.column("first_name", sa.String),
+    sa.column("last_name", sa.String),
+    sa.column("email", sa.String),
+)
+search_terms = sa.table(
+    "customer_search_terms",
+    sa.column("kind", sa.String),
+    sa.column("term", sa.String),
+    sa.column("customer_id", sa.Integer),
+)
+
+
+def upgrade() -> None:
+    bind = op.get_bind()
+    inspector = sa.inspect(bind)
+    if "customer_search_terms" not in inspector.get_table_names():
+        _create_table()
+
+    # Таблица могла быть создана create_all при старте приложения — заполняем, если пуста
+    if bind.execute(sa.select(search_terms.c.customer_id).limit(1)).first() is not None:
+        return
+    last_id = 0
+    while True:
+        rows = bind.execute(
+            sa.select(customers).where(customers.c.id > last_id).order_by(customers.c.id).limit(BATCH_SIZE)
+        ).all()
+        if not rows:
+            break
+        last_id = rows[-1].id
+        terms = [
+            {"kind": kind, "term": term, "customer_id": row.id}
+            for row in rows
+            for kind, term in _terms_for(row)
+        ]
+        if terms:
+            bind.execute(search_terms.insert(), terms)
+
+
+def _create_table():
+    op.create_table(
+        "customer_search_terms",
+        sa.Column("kind", sa.String(10), nullable=False),
+        sa.Column(
+            "term",
+            sa.String(255).with_variant(sa.String(255, collation="C"), "postgresql"),
+            nullable=False
+        ),
+        sa.Column(
+            "customer_id", sa.Integer(), sa.ForeignKey("customers.id", ondelete="CASCADE"), nullable=False
+        ),
+        sa.PrimaryKeyConstraint("kind", "term", "customer_id"),
+    )
+    op.create_index(
+        "ix_customer_search_terms_customer", "customer_search_terms", ["customer_id", "kind", "term"]
+    )
+
+
+def downgrade() -> None:
+    op.drop_index("ix_customer_search_terms_customer", table_name="customer_search_terms")
+    op.drop_table("customer_search_terms")
@@ -0,0 +1,48 @@
+"""customer_stores: клиенты магазина (заполняется из purchase_history)
+
+Revision ID: 0007_customer_stores
+Revises: 0006_customer_search_terms
+Create Date: 2026-10-18 18:00:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0007_customer_stores'
+down_revision = '0006_customer_search_terms'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    inspector = sa.inspect(op.get_bind())
+    if "customer_stores" not in inspector.get_table_names():
+        op.create_table(
+            "customer_stores",
+            sa.Column("store_id", sa.Integer(), sa.ForeignKey("stores.id"), nullable=False),
+            sa.Column(
+                "customer_id", sa.Integer(), sa.ForeignKey("customers.id", ondelete="CASCADE"), nullable=False
+            ),
+            sa.Column("first_purchase_date", sa.DateTime(), server_default=sa.func.now()),
+            sa.PrimaryKeyConstraint("store_id", "customer_id"),
+        )
+    
+    # Пары, которых ещё нет (таблица могла быть создана приложением через create_all)
+    op.execute(
+        """
+        INSERT INTO customer_stores (store_id, customer_id, first_purchase_date)
+        SELECT p.store_id, p.customer_id, MIN(p.purchase_date)
+        FROM purchase_history p
+        WHERE NOT EXISTS (
+            SELECT 1 FROM customer_stores cs
+            WHERE cs.store_id = p.store_id AND cs.customer_id = p.customer_id
+        )
+        GROUP BY p.store_id, p.customer_id
+        """
+    )
+
+
+def downgrade() -> None:
+    op.drop_table("customer_stores")
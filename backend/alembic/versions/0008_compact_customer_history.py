@@ -0,0 +1,143 @@
+"""customer_history: одна запись на изменение + customer_history_fields
+
+Revision ID: 0008_compact_customer_history
+Revises: 0007_customer_stores
+Create Date: 2026-10-18 19:00:00
+
+Старый формат писал строку на каждое изменённое поле, и у каждой была копия
+общего JSON changes. Строки одного изменения (клиент, кассир, время, changes)
+сворачиваются в первую из них, остальные удаляются.
+"""
+import json
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0008_compact_customer_history'
+down_revision = '0007_customer_stores'
+branch_labels = None
+depends_on = None
+
+BATCH_SIZE = 5000
+
+history = sa.table(
+    "customer_history",
+    sa.column("id", sa.Integer),
+    sa.column("customer_id", sa.Integer),
+    sa.column("changed_by", sa.Integer),
+    sa.column("change_type", sa.String),
+    sa.column("field_name", sa.String),
+    sa.column("old_value", sa.Text),
+    sa.column("new_value", sa.Text),
+    sa.column("changes", sa.JSON),
+    sa.column("changed_at", sa.DateTime),
+)
+history_fields = sa.table(
+    "customer_history_fields",
+    sa.column("history_id", sa.Integer),
+    sa.column("field_name", sa.String),
+    sa.column("customer_id", sa.Integer),
+)
+
+
+def upgrade() -> None:
+    bind = op.get_bind()
+    inspector = sa.inspect(bind)
+    if "customer_history_fields" not in inspector.get_table_names():
+        op.create_table(
+            "customer_history_fields",
+            sa.Column(
+                "history_id", sa.Integer(), sa.ForeignKey("customer_history.id", ondelete="CASCADE"),
+                nullable=False
+            ),
+            sa.Column("field_name", sa.String(100), nullable=False),
+            sa.Column("customer_id", sa.Integer(), nullable=False),
+            sa.PrimaryKeyConstraint("history_id", "field_name"),
+        )
+        op.create_index(
+            "ix_customer_history_fields_customer_field", "customer_history_fields",
+            ["customer_id", "field_name", "history_id"]
+        )
+
+    # Строки старого формата (field_name заполнен) по id: строки одного изменения
+    # вставлялись одним flush и идут подряд
+    last_id = 0
+    group = []
+    while True:
+        rows = bind.execute(
+            sa.select(history).where(history.c.field_name.isnot(None), history.c.id > last_id)
+            .order_by(history.c.id).limit(BATCH_SIZE)
+        ).all()
+        if not rows:
+            break
+        last_id = rows[-1].id
+        # Незавершённая группа переносится в следующую пачку
+        for row in rows:
+            if group and _group_key(group[0]) != _group_key(row):
+                _compact(bind, group)
+                group = []
+            group.append(row)
+    if group:
+        _compact(bind, group)
+
+
+def _group_key(row):
+    changes = json.dumps(row.changes, sort_keys=True) if row.changes is not None else None
+    return row.customer_id, row.changed_by, row.change_type, row.changed_at, changes
+
+
+def _compact(bind, group):
+    keep = group[0]
+    changes = dict(keep.changes or {})
+    for row in group:
+        changes.setdefault(row.field_name, {"old": row.old_value, "new": row.new_value})
+
+    bind.execute(
+        history.update().where(history.c.id == keep.id).values(
+            field_name=None, old_value=None, new_value=None, changes=changes
+        )
+    )
+    bind.execute(history_fields.insert(), [
+        {"history_id": keep.id, "field_name": field_name, "customer_id": keep.customer_id}
+        for field_name in changes
+    ])
+    extra_ids = [row.id for row in group[1:]]
+    if extra_ids:
+        bind.execute(history.delete().where(history.c.id.in_(extra_ids)))
+
+
+def downgrade() -> None:
+    # Разворачиваем записи обратно: строка на каждое поле с копией changes
+    bind = op.get_bind()
+    records = bind.execute(
+        sa.select(history).where(history.c.field_name.is_(None), history.c.changes.isnot(None))
+    ).all()
+    for record in records:
+        changes = record.changes or {}
+        fields = list(changes)
+        if not fields:
+            continue
+        first = fields[0]
+        bind.execute(
+            history.update().where(history.c.id == record.id).values(
+                field_name=first, old_value=changes[first].get("old"), new_value=changes[first].get("new")
+            )
+        )
+        if fields[1:]:
+            bind.execute(history.insert(), [
+                {
+                    "customer_id": record.customer_id,
+                    "changed_by": record.changed_by,
+                    "change_type": record.change_type,
+                    "field_name": field_name,
+                    "old_value": changes[field_name].get("old"),
+                    "new_value": changes[field_name].get("new"),
+                    "changes": changes,
+                    "changed_at": record.changed_at,
+                }
+                for field_name in fields[1:]
+            ])
+
+    op.drop_index("ix_customer_history_fields_customer_field", table_name="customer_history_fields")
+    op.drop_table("customer_history_fields")
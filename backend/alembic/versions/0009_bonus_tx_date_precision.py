@@ -0,0 +1,33 @@
+"""bonus_transactions: transaction_date в SQLite в одном формате с микросекундами
+
+Revision ID: 0009_bonus_tx_date_precision
+Revises: 0008_compact_customer_history
+Create Date: 2026-10-18 20:00:00
+
+server_default (CURRENT_TIMESTAMP) в SQLite писал 'YYYY-MM-DD HH:MM:SS', а
+значения из Python хранятся как 'YYYY-MM-DD HH:MM:SS.ffffff'. Даты сравниваются
+как строки, поэтому курсор keyset-пагинации внутри одной секунды сравнивался
+неверно. В PostgreSQL тип timestamp, там миграция ничего не делает.
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '0009_bonus_tx_date_precision'
+down_revision = '0008_compact_customer_history'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    if op.get_bind().dialect.name != "sqlite":
+        return
+    op.execute(
+        "UPDATE bonus_transactions SET transaction_date = transaction_date || '.000000' "
+        "WHERE length(transaction_date) = 19"
+    )
+
+
+def downgrade() -> None:
+    # Формат с микросекундами читается и старым кодом
+    pass
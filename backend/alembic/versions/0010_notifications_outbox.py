@@ -0,0 +1,49 @@
+"""notifications: признак outbox для фоновой отправки
+
+Revision ID: 0010_notifications_outbox
+Revises: 0009_bonus_tx_date_precision
+Create Date: 2026-10-18 21:00:00
+
+Черновики из POST /api/notifications/ тоже имеют статус PENDING и ждут /send;
+фоновый отправитель берёт только записи с outbox=True. Ожидающие уведомления
+о начислении бонусов (их пишет только outbox) помечаются, остальные остаются
+черновиками.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0010_notifications_outbox'
+down_revision = '0009_bonus_tx_date_precision'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    inspector = sa.inspect(op.get_bind())
+    if "outbox" not in {column["name"] for column in inspector.get_columns("notifications")}:
+        op.add_column(
+            "notifications",
+            sa.Column("outbox", sa.Boolean(), nullable=False, server_default=sa.false())
+        )
+    if "ix_notifications_outbox_status" not in {index["name"] for index in inspector.get_indexes("notifications")}:
+        op.create_index("ix_notifications_outbox_status", "notifications", ["outbox", "status", "id"])
+
+    notifications = sa.table(
+        "notifications",
+        sa.column("status", sa.String),
+        sa.column("subject", sa.String),
+        sa.column("outbox", sa.Boolean),
+    )
+    op.execute(
+        notifications.update()
+        .where(notifications.c.status == "PENDING", notifications.c.subject == "Начислены бонусы")
+        .values(outbox=True)
+    )
+
+
+def downgrade() -> None:
+    op.drop_index("ix_notifications_outbox_status", table_name="notifications")
+    with op.batch_alter_table("notifications") as batch_op:
+        batch_op.drop_column("outbox")
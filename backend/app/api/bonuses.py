@@ -1,17 +1,22 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Response
 from sqlalchemy.orm import Session
 from typing import List
 from decimal import Decimal
 from app.core.database import get_db
-from app.schemas.bonus import BonusBalanceResponse, BonusTransactionResponse, BonusTransactionCreate
+from app.core.dependencies import get_current_active_cashier
+from app.schemas.bonus import (
+    BonusBalanceResponse, BonusTransactionResponse, BonusTransactionCreate,
+    BonusBulkAccrualRequest, BonusBulkAccrualResponse
+)
 from app.services.bonus_service import BonusService
+from app.models.cashier import Cashier
 
 router = APIRouter()
 
 
 @router.get("/{customer_id}/balance", response_model=BonusBalanceResponse)
 def get_balance(customer_id: int, db: Session = Depends(get_db)):
-    balance = BonusService.get_balance(db, customer_id)
+    balance = BonusService.get_cached_balance(db, customer_id)
     if not balance:
         raise HTTPException(status_code=404, detail="Баланс не найден")
     return balance
@@ -44,7 +49,45 @@ def spend_bonuses(
         raise HTTPException(status_code=400, detail=str(e))
 
 
+@router.post("/bulk-earn", response_model=BonusBulkAccrualResponse)
+def bulk_earn_bonuses(
+    request: BonusBulkAccrualRequest,
+    db: Session = Depends(get_db),
+    current_cashier: Cashier = Depends(get_current_active_cashier)
+):
+    """Массовое начисление баллов списку клиентов или сегменту (только для супер-админа)"""
+    if not current_cashier.is_superuser:
+        raise HTTPException(
+            status_code=403,
+            detail="Only super-admin can grant bonuses in bulk"
+        )
+    
+    return BonusService.bulk_add_bonuses(
+        db,
+        request.amount,
+        customer_ids=request.customer_ids,
+        segment_name=request.segment_name,
+        description=request.description
+    )
+
+
 @router.get("/{customer_id}/transactions", response_model=List[BonusTransactionResponse])
-def get_transactions(customer_id: int, skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
-    return BonusService.get_transactions(db, customer_id, skip, limit)
+def get_transactions(
+    customer_id: int,
+    response: Response,
+    skip: int = 0,
+    limit: int = 100,
+    cursor: str = None,
+    db: Session = Depends(get_db)
+):
+    """История операций; курсор следующей страницы — в заголовке X-Next-Cursor"""
+    try:
+        transactions = BonusService.get_transactions(db, customer_id, skip, limit, cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    next_cursor = BonusService.next_cursor(transactions, limit)
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return transactions
 
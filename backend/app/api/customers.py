@@ -1,10 +1,13 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query
 from sqlalchemy.orm import Session
 from typing import List, Optional
 from app.core.database import get_db
 from app.core.dependencies import get_current_active_cashier
+from app.core.pagination import encode_cursor, decode_cursor
 from app.schemas.customer import CustomerCreate, CustomerUpdate, CustomerResponse, PurchaseCreate, PurchaseResponse
 from app.services.customer_service import CustomerService
+from app.services.customer_search import CustomerSearchService
+from app.services.name_directory import store_names, cashier_names
 from app.models.cashier import Cashier
 
 router = APIRouter()
@@ -24,51 +27,45 @@ def create_customer(customer: CustomerCreate, db: Session = Depends(get_db)):
 def list_customers(
     skip: int = 0,
     limit: int = 100,
+    cursor: Optional[str] = None,
     db: Session = Depends(get_db),
     current_cashier: Cashier = Depends(get_current_active_cashier)
 ):
-    """Список клиентов с пагинацией (для супер-админа - все клиенты, для кассира - только клиенты его магазина)"""
-    from app.models.customer import PurchaseHistory, Customer
-    from sqlalchemy import func
+    """
+    Список клиентов с пагинацией (для супер-админа - все клиенты, для кассира - только клиенты его магазина).
+    cursor из next_cursor предыдущей страницы — keyset-пагинация вместо skip.
+    """
+    # Для обычного кассира - клиенты магазина из customer_stores
+    store_id = None if current_cashier.is_superuser else current_cashier.store_id
     
-    # Если супер-админ - показываем всех клиентов
-    if current_cashier.is_superuser:
-        total = db.query(func.count(Customer.id)).scalar()
-        customers = CustomerService.list_customers(db, skip, limit)
-        return {
-            "items": customers,
-            "total": total,
-            "skip": skip,
-            "limit": limit
-        }
-    
-    # Для обычного кассира - фильтруем по магазину
-    store_customer_ids = db.query(PurchaseHistory.customer_id).filter(
-        PurchaseHistory.store_id == current_cashier.store_id
-    ).distinct().all()
-    store_customer_ids = [cid[0] for cid in store_customer_ids]
-    
-    # Получаем общее количество клиентов магазина
-    total = db.query(func.count(Customer.id)).filter(
-        Customer.id.in_(store_customer_ids)
-    ).scalar() if store_customer_ids else 0
-    
-    # Получаем клиентов с пагинацией
-    if store_customer_ids:
-        customers = db.query(Customer).filter(
-            Customer.id.in_(store_customer_ids)
-        ).offset(skip).limit(limit).all()
-    else:
-        customers = []
+    after_id = None
+    if cursor:
+        position = decode_cursor(cursor)
+        if position is None:
+            raise HTTPException(status_code=400, detail="Некорректный курсор")
+        after_id = position[1]
     
+    customers = CustomerService.list_customers(db, skip, limit, store_id=store_id, after_id=after_id)
     return {
         "items": customers,
-        "total": total,
+        "total": CustomerService.count_customers(db, store_id),
         "skip": skip,
-        "limit": limit
+        "limit": limit,
+        "next_cursor": encode_cursor(None, customers[-1].id) if len(customers) == limit else None
     }
 
 
+@router.get("/search", response_model=List[CustomerResponse])
+def search_customers(
+    q: str = Query(..., min_length=1, max_length=100),
+    limit: int = Query(20, ge=1, le=100),
+    db: Session = Depends(get_db),
+    current_cashier: Cashier = Depends(get_current_active_cashier)
+):
+    """Поиск клиента по последним цифрам телефона, началу имени/фамилии или email"""
+    return CustomerSearchService.search(db, q, limit)
+
+
 @router.get("/{customer_id}", response_model=CustomerResponse)
 def get_customer(customer_id: int, db: Session = Depends(get_db)):
     customer = CustomerService.get_customer(db, customer_id)
@@ -104,38 +101,35 @@ def get_customer_history(
     customer_id: int,
     skip: int = 0,
     limit: int = 100,
+    field: Optional[str] = None,
     db: Session = Depends(get_db),
     current_cashier: Cashier = Depends(get_current_active_cashier)
 ):
-    """Получение истории изменений клиента с пагинацией"""
-    from app.models.customer_history import CustomerHistory
-    from app.models.cashier import Cashier
-    from sqlalchemy import func
-    
-    # Получаем общее количество записей истории
-    total = db.query(func.count(CustomerHistory.id)).filter(
-        CustomerHistory.customer_id == customer_id
-    ).scalar()
+    """Получение истории изменений клиента с пагинацией (строка на каждое изменённое поле)"""
+    total, rows = CustomerService.get_history(db, customer_id, skip, limit, field)
     
-    history = db.query(CustomerHistory).filter(
-        CustomerHistory.customer_id == customer_id
-    ).order_by(CustomerHistory.changed_at.desc()).offset(skip).limit(limit).all()
+    # Имена кассиров — из процессного справочника, без запроса на каждую строку
+    names = cashier_names.get_many(db, {h.changed_by for h, _ in rows if h.changed_by})
     
     result = []
-    for h in history:
-        cashier_name = None
-        if h.changed_by:
-            cashier = db.query(Cashier).filter(Cashier.id == h.changed_by).first()
-            cashier_name = cashier.full_name if cashier else None
+    for h, field_name in rows:
+        if field_name is not None:
+            change = (h.changes or {}).get(field_name, {})
+            old_value, new_value = change.get("old"), change.get("new")
+        else:
+            # Запись старого формата или без полей
+            field_name, old_value, new_value = h.field_name, h.old_value, h.new_value
         
         result.append({
-            "id": h.id,
+            # Одна запись истории даёт строку на каждое поле: id строки уникален, id записи — в history_id
+            "id": f"{h.id}:{field_name}",
+            "history_id": h.id,
             "changed_at": h.changed_at.isoformat(),
-            "changed_by": cashier_name,
+            "changed_by": names.get(h.changed_by),
             "change_type": h.change_type,
-            "field_name": h.field_name,
-            "old_value": h.old_value,
-            "new_value": h.new_value,
+            "field_name": field_name,
+            "old_value": old_value,
+            "new_value": new_value,
             "changes": h.changes,
             "notes": h.notes
         })
@@ -156,18 +150,17 @@ def create_purchase(purchase: PurchaseCreate, db: Session = Depends(get_db)):
 @router.get("/{customer_id}/purchases")
 def get_purchase_history(customer_id: int, skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
     """Получение истории покупок с информацией о магазине"""
-    from app.models.store import Store
-    
     purchases = CustomerService.get_purchase_history(db, customer_id, skip, limit)
+    # Названия магазинов — из процессного справочника, без запроса на каждую покупку
+    names = store_names.get_many(db, {purchase.store_id for purchase in purchases})
     
     result = []
     for purchase in purchases:
-        store = db.query(Store).filter(Store.id == purchase.store_id).first()
         purchase_dict = {
             "id": purchase.id,
             "customer_id": purchase.customer_id,
             "store_id": purchase.store_id,
-            "store_name": store.name if store else f"Магазин #{purchase.store_id}",
+            "store_name": names.get(purchase.store_id, f"Магазин #{purchase.store_id}"),
             "purchase_date": purchase.purchase_date.isoformat(),
             "amount": float(purchase.amount),
             "items_count": purchase.items_count,
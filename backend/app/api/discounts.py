@@ -2,13 +2,19 @@ from fastapi import APIRouter, Depends, HTTPException
 from sqlalchemy.orm import Session
 from typing import List
 from app.core.database import get_db
+from app.core.dependencies import get_current_active_cashier
 from app.schemas.discount import (
     DiscountRuleCreate, DiscountRuleUpdate, DiscountRuleResponse,
     DiscountCalculationRequest, DiscountCalculationResponse,
+    DiscountBatchCalculationRequest, DiscountBatchCalculationResponse,
+    DiscountSimulationRequest, DiscountSimulationResponse,
     DiscountApplicationResponse
 )
 from app.services.discount_service import DiscountService
+from app.services.simulation_service import SimulationService
 from app.models.discount import DiscountRule
+from app.models.cashier import Cashier
+from datetime import datetime, timedelta
 
 router = APIRouter()
 
@@ -29,10 +35,7 @@ def list_discount_rules(
     
     query = db.query(DiscountRule)
     if store_id:
-        query = query.filter(
-            (DiscountRule.applicable_stores.contains([store_id])) | 
-            (DiscountRule.applicable_stores == None)
-        )
+        query = query.filter(DiscountService.store_filter(store_id))
     
     total = query.count()
     rules = query.offset(skip).limit(limit).all()
@@ -55,16 +58,9 @@ def get_discount_rule(rule_id: int, db: Session = Depends(get_db)):
 
 @router.put("/rules/{rule_id}", response_model=DiscountRuleResponse)
 def update_discount_rule(rule_id: int, rule: DiscountRuleUpdate, db: Session = Depends(get_db)):
-    db_rule = db.query(DiscountRule).filter(DiscountRule.id == rule_id).first()
+    db_rule = DiscountService.update_rule(db, rule_id, rule.dict(exclude_unset=True))
     if not db_rule:
         raise HTTPException(status_code=404, detail="Правило скидки не найдено")
-    
-    update_data = rule.dict(exclude_unset=True)
-    for key, value in update_data.items():
-        setattr(db_rule, key, value)
-    
-    db.commit()
-    db.refresh(db_rule)
     return db_rule
 
 
@@ -76,6 +72,37 @@ def calculate_discounts(request: DiscountCalculationRequest, db: Session = Depen
         raise HTTPException(status_code=400, detail=str(e))
 
 
+@router.post("/calculate-batch", response_model=DiscountBatchCalculationResponse)
+def calculate_discounts_batch(request: DiscountBatchCalculationRequest, db: Session = Depends(get_db)):
+    """Пакетный расчёт скидок: результаты возвращаются в порядке котировок"""
+    return {"results": DiscountService.calculate_discounts_batch(db, request.quotes)}
+
+
+@router.post("/simulate", response_model=DiscountSimulationResponse)
+def simulate_discount_rules(
+    request: DiscountSimulationRequest,
+    db: Session = Depends(get_db),
+    current_cashier: Cashier = Depends(get_current_active_cashier)
+):
+    """Бэктест правил-кандидатов на истории покупок (без записи в БД, только для супер-админа)"""
+    if not current_cashier.is_superuser:
+        raise HTTPException(
+            status_code=403,
+            detail="Only super-admin can run discount simulations"
+        )
+    
+    end_date = request.end_date or datetime.now()
+    start_date = request.start_date or end_date - timedelta(days=request.days)
+    return SimulationService.run_backtest(
+        db,
+        [rule.dict() for rule in request.rules],
+        start_date,
+        end_date,
+        store_ids=request.store_ids,
+        workers=request.workers
+    )
+
+
 @router.get("/applications", response_model=List[DiscountApplicationResponse])
 def list_discount_applications(customer_id: int = None, skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
     from app.models.discount import DiscountApplication
@@ -1,18 +1,52 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session
+from sqlalchemy.exc import IntegrityError
 from decimal import Decimal
 from app.core.database import get_db
 from app.core.dependencies import get_current_active_cashier
-from app.schemas.customer import PurchaseCreate, PurchaseResponse
+from app.core.cache import TTLCache
+from app.core.config import settings
+from app.core.metrics import StageClock
+from app.schemas.customer import PurchaseCreate, PurchaseResponse, PurchaseIngestResponse
 from app.services.customer_service import CustomerService
 from app.services.discount_service import DiscountService
 from app.services.bonus_service import BonusService
 from app.services.notification_service import NotificationService
+from app.services.notification_dispatcher import notification_dispatcher
+from app.services.ingest_service import IngestService
+from app.services.discount_quota import rule_quota
+from app.services.name_directory import store_names
 from app.schemas.discount import DiscountCalculationRequest
 from app.models.cashier import Cashier
 
 router = APIRouter()
 
+# Ответы на уже проведённые чеки: (store_id, receipt_number) -> PurchaseResponse
+purchase_responses = TTLCache(
+    maxsize=settings.PURCHASE_IDEMPOTENCY_CACHE_SIZE,
+    ttl_seconds=settings.PURCHASE_IDEMPOTENCY_TTL
+)
+
+
+def _replayed_purchase(db: Session, customer_id: int, store_id: int, receipt_number: str) -> PurchaseResponse:
+    """Ответ на повтор уже проведённого чека; None — чек ещё не проводился"""
+    key = (store_id, receipt_number)
+    response = purchase_responses.get(key)
+    if response is None:
+        purchase = CustomerService.get_purchase_by_receipt(db, store_id, receipt_number)
+        if purchase is None:
+            return None
+        response = PurchaseResponse.model_validate(purchase)
+        purchase_responses.set(key, response)
+    
+    if response.customer_id != customer_id:
+        raise HTTPException(
+            status_code=409,
+            detail="Receipt number already used for another customer"
+        )
+    return response
+
 
 @router.post("/process-purchase", response_model=PurchaseResponse)
 def process_purchase(
@@ -23,6 +57,7 @@ def process_purchase(
     bonuses_to_use: Decimal = Decimal("0"),
     payment_method: str = None,
     receipt_number: str = None,
+    quote_token: str = None,
     db: Session = Depends(get_db),
     current_cashier: Cashier = Depends(get_current_active_cashier)
 ):
@@ -37,82 +72,207 @@ def process_purchase(
             detail="You can only process purchases for your store"
         )
     
+    # Метка store_id — только проверенный магазин (свой у кассира или уже известный
+    # справочнику), иначе число серий метрик не ограничено; в БД за этим не ходим
+    known_store = store_id == current_cashier.store_id or store_names.peek(store_id) is not None
+    clock = StageClock(store_id if known_store else "unknown")
+    try:
+        purchase = _process_purchase(
+            db, current_cashier, clock, customer_id, store_id, amount, items_count,
+            bonuses_to_use, payment_method, receipt_number, quote_token
+        )
+    except HTTPException:
+        clock.finish("rejected")
+        raise
+    except Exception:
+        clock.finish("error")
+        raise
+    clock.finish()
+    return purchase
+
+
+def _process_purchase(
+    db: Session,
+    current_cashier: Cashier,
+    clock: StageClock,
+    customer_id: int,
+    store_id: int,
+    amount: Decimal,
+    items_count: int,
+    bonuses_to_use: Decimal,
+    payment_method: str,
+    receipt_number: str,
+    quote_token: str
+):
+    # Повтор запроса с тем же чеком возвращает уже проведённую покупку
+    if receipt_number:
+        replayed = _replayed_purchase(db, customer_id, store_id, receipt_number)
+        if replayed is not None:
+            clock.outcome = "replayed"
+            return replayed
+    
     # 1. Рассчитываем скидки
+    clock.stage("discount_calc")
     discount_request = DiscountCalculationRequest(
         customer_id=customer_id,
         store_id=store_id,
         amount=amount
     )
-    discount_result = DiscountService.calculate_discounts(db, discount_request)
-    
-    # 2. Применяем бонусы (если указаны)
-    final_amount = discount_result.final_amount
-    bonuses_used = Decimal("0")
+    discount_result = None
+    if quote_token:
+        # Котировка из available-discounts, если с тех пор ничего не изменилось
+        discount_result = DiscountService.redeem_quote(db, quote_token, discount_request)
+    if discount_result is None:
+        discount_result = DiscountService.calculate_discounts(db, discount_request)
+    # Занимаем использования правил с общим лимитом до каких-либо записей
+    discount_result = DiscountService.reserve_discounts(db, discount_request, discount_result)
     
-    if bonuses_to_use > 0:
-        try:
-            BonusService.spend_bonuses(
-                db, customer_id, bonuses_to_use,
-                description=f"Использовано при покупке на сумму {amount}",
-                purchase_id=None  # будет обновлено после создания покупки
-            )
-            bonuses_used = bonuses_to_use
-            final_amount = max(Decimal("0"), final_amount - bonuses_to_use)
-        except ValueError as e:
-            # Если не хватает бонусов, продолжаем без них
-            pass
-    
-    # 3. Создаём запись о покупке (с оригинальной суммой для истории)
-    purchase_data = PurchaseCreate(
-        customer_id=customer_id,
-        store_id=store_id,
-        amount=amount,  # Оригинальная сумма
-        items_count=items_count,
-        payment_method=payment_method,
-        receipt_number=receipt_number
-    )
-    purchase = CustomerService.create_purchase(db, purchase_data)
-    
-    # 4. Обновляем поля скидок и бонусов в покупке
-    purchase.discount_applied = discount_result.total_discount
-    purchase.bonuses_used = bonuses_used
-    purchase.bonuses_earned = discount_result.bonuses_earned
-    # Обновляем итоговую сумму с учётом скидок и бонусов
-    purchase.amount = final_amount
-    # Сохраняем изменения в покупке
-    db.flush()  # Сохраняем изменения без commit (commit будет в конце)
-    
-    # 5. Применяем скидки (создаём записи DiscountApplication)
-    for discount_info in discount_result.applicable_discounts:
-        DiscountService.apply_discount(
-            db,
-            discount_info["rule_id"],
-            purchase.id,
-            customer_id,
-            amount,
-            Decimal(str(discount_info["discount_amount"]))
-        )
-    
-    # 6. Начисляем бонусы
-    if discount_result.bonuses_earned > 0:
-        BonusService.add_bonuses(
-            db, customer_id, discount_result.bonuses_earned,
-            description=f"Начислено за покупку #{purchase.id}",
-            purchase_id=purchase.id
+    # Дальше — единая транзакция: сервисы только делают flush, commit один в конце
+    try:
+        # 2. Применяем бонусы (если указаны)
+        clock.stage("bonus_spend")
+        final_amount = discount_result.final_amount
+        bonuses_used = Decimal("0")
+        spend_transaction = None
+        
+        if bonuses_to_use > 0:
+            try:
+                spend_transaction = BonusService.spend_bonuses(
+                    db, customer_id, bonuses_to_use,
+                    description=f"Использовано при покупке на сумму {amount}",
+                    commit=False
+                )
+                bonuses_used = bonuses_to_use
+                final_amount = max(Decimal("0"), final_amount - bonuses_to_use)
+            except ValueError as e:
+                # Если не хватает бонусов, продолжаем без них
+                pass
+        
+        # 3. Создаём запись о покупке (с оригинальной суммой для истории)
+        clock.stage("purchase_create")
+        purchase_data = PurchaseCreate(
+            customer_id=customer_id,
+            store_id=store_id,
+            amount=amount,  # Оригинальная сумма
+            items_count=items_count,
+            payment_method=payment_method,
+            receipt_number=receipt_number
         )
+        purchase = CustomerService.create_purchase(db, purchase_data)
+        
+        # 4. Обновляем поля скидок и бонусов в покупке
+        purchase.discount_applied = discount_result.total_discount
+        purchase.bonuses_used = bonuses_used
+        purchase.bonuses_earned = discount_result.bonuses_earned
+        # Обновляем итоговую сумму с учётом скидок и бонусов
+        purchase.amount = final_amount
+        if spend_transaction is not None:
+            spend_transaction.purchase_id = purchase.id
+        
+        # 5. Применяем скидки (создаём записи DiscountApplication)
+        clock.stage("apply_discounts")
+        for discount_info in discount_result.applicable_discounts:
+            DiscountService.apply_discount(
+                db,
+                discount_info["rule_id"],
+                purchase.id,
+                customer_id,
+                amount,
+                Decimal(str(discount_info["discount_amount"])),
+                reserved=True,
+                commit=False
+            )
+        
+        # 6. Начисляем бонусы
+        clock.stage("earn_bonuses")
+        notification = None
+        if discount_result.bonuses_earned > 0:
+            BonusService.add_bonuses(
+                db, customer_id, discount_result.bonuses_earned,
+                description=f"Начислено за покупку #{purchase.id}",
+                purchase_id=purchase.id,
+                commit=False
+            )
+            
+            # 7. Уведомление о начислении бонусов пишется в outbox в той же транзакции
+            clock.stage("notify")
+            notification = NotificationService.send_bonus_notification(
+                db, customer_id, float(discount_result.bonuses_earned), commit=False
+            )
+        
+        clock.stage("commit")
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        # Возвращаем занятые использования правил с общим лимитом
+        for discount_info in discount_result.applicable_discounts:
+            rule_quota.release(discount_info["rule_id"])
+        if isinstance(e, IntegrityError) and receipt_number:
+            # Параллельный повтор успел провести этот чек первым
+            replayed = _replayed_purchase(db, customer_id, store_id, receipt_number)
+            if replayed is not None:
+                clock.outcome = "replayed"
+                return replayed
+        raise
     
-    # 7. Отправляем уведомление о начислении бонусов
-    if discount_result.bonuses_earned > 0:
-        NotificationService.send_bonus_notification(
-            db, customer_id, float(discount_result.bonuses_earned)
-        )
+    # Отправка — в фоне и только после фиксации покупки
+    clock.stage("respond")
+    if notification is not None:
+        notification_dispatcher.enqueue(notification.id)
     
-    db.commit()
     db.refresh(purchase)
     
+    if receipt_number:
+        purchase_responses.set((store_id, receipt_number), PurchaseResponse.model_validate(purchase))
+    
     return purchase
 
 
+async def _ndjson_lines(request: Request):
+    """Строки тела запроса по мере поступления (без чтения всего тела в память)"""
+    buffer = b""
+    async for data in request.stream():
+        buffer += data
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            yield line
+    if buffer:
+        yield buffer
+
+
+@router.post("/ingest", response_model=PurchaseIngestResponse)
+async def ingest_purchases(
+    request: Request,
+    db: Session = Depends(get_db),
+    current_cashier: Cashier = Depends(get_current_active_cashier)
+):
+    """
+    Загрузка офлайн-смены: тело — NDJSON, по одному чеку на строку.
+    Чеки проводятся пакетами по PURCHASE_INGEST_CHUNK_SIZE; уже проведённые
+    (тот же магазин и номер чека) возвращаются со статусом duplicate.
+    """
+    results = []
+    chunk = []
+    line_number = 0
+    async for line in _ndjson_lines(request):
+        line_number += 1
+        if not line.strip():
+            continue
+        chunk.append((line_number, line))
+        if len(chunk) >= settings.PURCHASE_INGEST_CHUNK_SIZE:
+            results.extend(await run_in_threadpool(IngestService.ingest_chunk, db, chunk, current_cashier))
+            chunk = []
+    if chunk:
+        results.extend(await run_in_threadpool(IngestService.ingest_chunk, db, chunk, current_cashier))
+    
+    return PurchaseIngestResponse(
+        created=sum(1 for result in results if result.status == "created"),
+        duplicates=sum(1 for result in results if result.status == "duplicate"),
+        failed=sum(1 for result in results if result.status == "error"),
+        items=results
+    )
+
+
 @router.get("/customer/{customer_id}/available-discounts")
 def get_available_discounts(
     customer_id: int,
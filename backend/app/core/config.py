@@ -18,6 +18,46 @@ class Settings(BaseSettings):
     # Redis (для Celery)
     REDIS_URL: str = "redis://localhost:6379/0"
     
+    # Кэш правил скидок: через сколько секунд воркер перечитывает правила из БД
+    DISCOUNT_RULES_CACHE_TTL: int = 60
+    # Размер блока использований правила, резервируемого воркером за один UPDATE
+    DISCOUNT_QUOTA_BLOCK_SIZE: int = 20
+    # Индекс сегментов клиентов: через сколько секунд воркер перечитывает сегменты из БД
+    SEGMENT_INDEX_TTL: int = 300
+    # Справочники имён магазинов и кассиров: через сколько секунд воркер перечитывает их из БД
+    NAME_DIRECTORY_TTL: int = 300
+    # Не чаще чем раз в столько секунд справочник перечитывается из-за неизвестного id
+    NAME_DIRECTORY_MISS_RELOAD_INTERVAL: int = 10
+    # Идемпотентность POS: сколько секунд и сколько ответов на чеки хранить в памяти
+    PURCHASE_IDEMPOTENCY_TTL: int = 600
+    PURCHASE_IDEMPOTENCY_CACHE_SIZE: int = 10000
+    # Токены котировок скидок: срок жизни в секундах и сколько котировок хранить в памяти
+    QUOTE_TOKEN_TTL: int = 120
+    QUOTE_CACHE_SIZE: int = 10000
+    # Сгорание бонусов: срок жизни начисленных баллов в днях и размер отрезка customer_id
+    BONUS_LIFETIME_DAYS: int = 365
+    BONUS_EXPIRY_CHUNK_SIZE: int = 5000
+    # Кэш балансов: redis — общий для всех процессов API (REDIS_URL), local —
+    # в памяти процесса (только при одном процессе), none — выключен.
+    # TTL записей, размер локального кэша и сколько секунд баланс считается
+    # изменяемым (читается из БД), если запись не завершилась
+    BALANCE_CACHE_BACKEND: str = "local"
+    BALANCE_CACHE_TTL: int = 300
+    BALANCE_CACHE_SIZE: int = 100000
+    BALANCE_CACHE_PENDING_TTL: int = 30
+    # Массовое начисление баллов: клиентов в одной транзакции
+    BONUS_BULK_CHUNK_SIZE: int = 1000
+    # Загрузка офлайн-смен: сколько чеков обрабатывается в одной транзакции
+    PURCHASE_INGEST_CHUNK_SIZE: int = 500
+    # Сверка балансов с журналом операций: размер отрезка customer_id
+    BONUS_RECONCILE_CHUNK_SIZE: int = 5000
+    
+    # Отправка уведомлений из outbox: число фоновых потоков (0 — не запускать
+    # в процессе API), период опроса PENDING-записей в секундах и размер пачки
+    NOTIFICATION_WORKERS: int = 2
+    NOTIFICATION_POLL_INTERVAL: float = 5.0
+    NOTIFICATION_BATCH_SIZE: int = 100
+    
     # Email/SMS settings
     SMTP_HOST: str = "smtp.gmail.com"
     SMTP_PORT: int = 587
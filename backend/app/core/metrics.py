@@ -0,0 +1,141 @@
+import functools
+import threading
+from bisect import bisect_left
+from time import perf_counter
+from typing import Dict, List, Sequence, Tuple
+
+# Границы корзин по умолчанию (секунды): от 1 мс до 10 с
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram:
+    """
+    Гистограмма в памяти процесса (аналог Prometheus histogram).
+    Значения меток передаются позиционно в порядке label_names.
+    """
+
+    def __init__(self, name: str, documentation: str, label_names: Sequence[str], buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(sorted(buckets))
+        self._lock = threading.Lock()
+        # метки -> [счётчики по корзинам (+Inf последней), сумма]
+        self._series: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, value: float, *labels):
+        index = bisect_left(self.buckets, value)
+        key = tuple(str(label) for label in labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = [[0] * (len(self.buckets) + 1), 0.0]
+                self._series[key] = series
+            series[0][index] += 1
+            series[1] += value
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = [(key, list(counts), total) for key, (counts, total) in self._series.items()]
+        for key, counts, total in sorted(series):
+            labels = ",".join(f'{name}="{_escape(value)}"' for name, value in zip(self.label_names, key))
+            prefix = f"{labels}," if labels else ""
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{{{prefix}le="{bound}"}} {cumulative}')
+            cumulative += counts[-1]
+            lines.append(f'{self.name}_bucket{{{prefix}le="+Inf"}} {cumulative}')
+            suffix = f"{{{labels}}}" if labels else ""
+            lines.append(f"{self.name}_sum{suffix} {total}")
+            lines.append(f"{self.name}_count{suffix} {cumulative}")
+        return lines
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics: Dict[str, Histogram] = {}
+
+    def histogram(self, name: str, documentation: str, label_names: Sequence[str], buckets=DEFAULT_BUCKETS) -> Histogram:
+        metric = Histogram(name, documentation, label_names, buckets)
+        self._metrics[name] = metric
+        return metric
+
+    def render(self) -> str:
+        """Все метрики в текстовом формате Prometheus"""
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+pos_stage_seconds = registry.histogram(
+    "pos_stage_seconds", "Длительность этапов проведения покупки на кассе",
+    ("stage", "store_id", "outcome")
+)
+pos_purchase_seconds = registry.histogram(
+    "pos_purchase_seconds", "Полная длительность проведения покупки на кассе",
+    ("store_id", "outcome")
+)
+service_call_seconds = registry.histogram(
+    "service_call_seconds", "Длительность вызовов сервисов",
+    ("call", "outcome")
+)
+
+
+class StageClock:
+    """
+    Хронометраж этапов конвейера: stage() закрывает предыдущий этап и
+    начинает следующий, finish() закрывает последний этап и записывает
+    длительности всех этапов и общую с итоговым outcome.
+    """
+    __slots__ = ("store_id", "outcome", "_stage", "_started", "_stage_started", "_timings")
+
+    def __init__(self, store_id):
+        self.store_id = store_id
+        self.outcome = "success"
+        self._stage = None
+        self._started = self._stage_started = perf_counter()
+        self._timings = []
+
+    def stage(self, name: str):
+        now = perf_counter()
+        if self._stage is not None:
+            self._timings.append((self._stage, now - self._stage_started))
+        self._stage = name
+        self._stage_started = now
+
+    def finish(self, outcome: str = None):
+        outcome = outcome or self.outcome
+        now = perf_counter()
+        if self._stage is not None:
+            self._timings.append((self._stage, now - self._stage_started))
+            self._stage = None
+        for stage, seconds in self._timings:
+            pos_stage_seconds.observe(seconds, stage, self.store_id, outcome)
+        self._timings = []
+        pos_purchase_seconds.observe(now - self._started, self.store_id, outcome)
+
+
+def timed(call: str):
+    """Декоратор: длительность вызова в service_call_seconds (ставится под @staticmethod)"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            started = perf_counter()
+            outcome = "error"
+            try:
+                result = func(*args, **kwargs)
+                outcome = "success"
+                return result
+            finally:
+                service_call_seconds.observe(perf_counter() - started, call, outcome)
+        return wrapper
+    return decorator
@@ -0,0 +1,76 @@
+import logging
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, List, Optional, Tuple
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+logger = logging.getLogger(__name__)
+
+
+class RangesFailed(RuntimeError):
+    """Не все отрезки обработаны; last_completed — id, до которого все отрезки обработаны подряд"""
+
+    def __init__(self, last_completed: Optional[int]):
+        super().__init__(f"Не все отрезки обработаны, подряд обработаны id до {last_completed}")
+        self.last_completed = last_completed
+
+
+def id_ranges(db: Session, column, partitions: int, start: Optional[int] = None) -> List[Tuple[int, int]]:
+    """Разбиение диапазона значений column (не меньше start) на partitions отрезков [start, end]"""
+    query = db.query(func.min(column), func.max(column))
+    if start is not None:
+        query = query.filter(column >= start)
+    low, high = query.one()
+    if low is None:
+        return []
+    
+    partitions = max(1, min(partitions, high - low + 1))
+    step = (high - low + partitions) // partitions
+    return [
+        (start, min(start + step - 1, high))
+        for start in range(low, high + 1, step)
+    ]
+
+
+def default_workers(workers: Optional[int] = None) -> int:
+    """Число процессов: запрошенное, но не больше числа CPU"""
+    cpus = os.cpu_count() or 1
+    return min(workers or cpus, cpus)
+
+
+def process_pool(workers: int) -> ProcessPoolExecutor:
+    """
+    Пул процессов для тяжёлых пакетных задач.
+    Используется spawn: дочерние процессы создают собственный engine и не
+    наследуют соединения родителя.
+    """
+    return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+
+
+def map_ranges(workers: int, func: Callable, ranges: List[Tuple[int, int]], *args) -> list:
+    """
+    func(start, end, *args) по отрезкам в пуле процессов; результаты в порядке отрезков.
+    Упавший отрезок не прерывает остальные: после завершения всех поднимается
+    RangesFailed с концом последнего отрезка, до которого всё обработано подряд
+    (отрезки завершаются в любом порядке).
+    """
+    with process_pool(workers) as pool:
+        futures = [pool.submit(func, start, end, *args) for start, end in ranges]
+
+    results = []
+    last_completed = None
+    failed = False
+    for (start, end), future in zip(ranges, futures):
+        error = future.exception()
+        if error is not None:
+            logger.error("Отрезок %s-%s не обработан", start, end, exc_info=error)
+            failed = True
+            continue
+        results.append(future.result())
+        if not failed:
+            last_completed = end
+    if failed:
+        raise RangesFailed(last_completed)
+    return results
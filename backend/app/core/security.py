@@ -1,5 +1,8 @@
 from datetime import datetime, timedelta
 from typing import Optional
+import hashlib
+import hmac
+import time
 from jose import JWTError, jwt
 import bcrypt
 from app.core.config import settings
@@ -55,3 +58,24 @@ def decode_access_token(token: str) -> Optional[dict]:
     except JWTError:
         return None
 
+
+
+def create_signed_token(payload: str, expires_in: int) -> str:
+    """Короткоживущий подписанный токен (HMAC-SHA256): payload.expires.signature"""
+    message = f"{payload}.{int(time.time()) + expires_in}"
+    signature = hmac.new(SECRET_KEY.encode(), message.encode(), hashlib.sha256).hexdigest()
+    return f"{message}.{signature}"
+
+
+def verify_signed_token(token: str) -> Optional[str]:
+    """Проверка подписи и срока токена; возвращает payload или None"""
+    try:
+        message, signature = token.rsplit(".", 1)
+        payload, expires = message.rsplit(".", 1)
+        expires = int(expires)
+    except (ValueError, AttributeError):
+        return None
+    expected = hmac.new(SECRET_KEY.encode(), message.encode(), hashlib.sha256).hexdigest()
+    if not hmac.compare_digest(signature, expected) or expires < time.time():
+        return None
+    return payload
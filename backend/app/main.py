@@ -1,6 +1,12 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse
 from app.core.config import settings
+from app.core.database import SessionLocal
+from app.core.metrics import registry
+from app.services.discount_quota import rule_quota
+from app.services.notification_dispatcher import notification_dispatcher
+from app.services.segment_index import segment_index
 from app.api import customers, bonuses, discounts, pos, analytics, notifications, stores, auth
 
 app = FastAPI(
@@ -18,6 +24,24 @@ async def startup_event():
     except Exception as e:
         print(f"Warning: Could not create database tables: {e}")
         # Продолжаем работу даже если таблицы уже существуют
+    
+    # Индекс сегментов загружается до первых покупок: касса не читает его в запросе
+    db = SessionLocal()
+    try:
+        segment_index.refresh(db)
+    except Exception as e:
+        print(f"Warning: Could not load segment index: {e}")
+    finally:
+        db.close()
+    
+    # Фоновая отправка уведомлений из outbox
+    notification_dispatcher.start()
+
+@app.on_event("shutdown")
+def shutdown_event():
+    # Возвращаем неиспользованные блоки лимитов скидок и дописываем счётчики
+    rule_quota.release_all()
+    notification_dispatcher.stop()
 
 # CORS middleware
 app.add_middleware(
@@ -26,6 +50,8 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # Курсор следующей страницы для keyset-пагинации
+    expose_headers=["X-Next-Cursor"],
 )
 
 # Подключение роутеров
@@ -48,3 +74,9 @@ async def root():
 async def health_check():
     return {"status": "ok"}
 
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics():
+    """Метрики процесса в текстовом формате Prometheus"""
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
@@ -1,7 +1,7 @@
-from app.models.customer import Customer, PurchaseHistory
-from app.models.customer_history import CustomerHistory
+from app.models.customer import Customer, PurchaseHistory, CustomerSearchTerm, CustomerStore
+from app.models.customer_history import CustomerHistory, CustomerHistoryField
 from app.models.bonus import BonusBalance, BonusTransaction
-from app.models.discount import DiscountRule, DiscountApplication
+from app.models.discount import DiscountRule, DiscountApplication, DiscountUsageCounter, DiscountRuleStore
 from app.models.store import Store
 from app.models.analytics import CustomerSegment, Campaign
 from app.models.cashier import Cashier
@@ -9,11 +9,16 @@ from app.models.cashier import Cashier
 __all__ = [
     "Customer",
     "PurchaseHistory",
+    "CustomerSearchTerm",
+    "CustomerStore",
     "CustomerHistory",
+    "CustomerHistoryField",
     "BonusBalance",
     "BonusTransaction",
     "DiscountRule",
     "DiscountApplication",
+    "DiscountUsageCounter",
+    "DiscountRuleStore",
     "Store",
     "CustomerSegment",
     "Campaign",
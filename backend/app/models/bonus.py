@@ -1,7 +1,8 @@
-from sqlalchemy import Column, Integer, Numeric, DateTime, String, ForeignKey, Enum, Text
+from sqlalchemy import Column, Integer, Numeric, DateTime, String, ForeignKey, Enum, Text, Index
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 import enum
+from datetime import datetime
 from app.core.database import Base
 
 
@@ -21,6 +22,8 @@ class BonusBalance(Base):
     total_earned = Column(Numeric(10, 2), default=0)
     total_spent = Column(Numeric(10, 2), default=0)
     last_updated = Column(DateTime, server_default=func.now(), onupdate=func.now())
+    # Растёт при каждом изменении баланса: по ней кэш отличает новое значение от старого
+    version = Column(Integer, nullable=False, default=0, server_default="0")
     
     # Relationships
     customer = relationship("Customer", back_populates="bonus_balance")
@@ -29,6 +32,10 @@ class BonusBalance(Base):
 
 class BonusTransaction(Base):
     __tablename__ = "bonus_transactions"
+    __table_args__ = (
+        # Агрегаты по клиенту и типу операции (сгорание баллов)
+        Index("ix_bonus_transactions_customer_type_date", "customer_id", "transaction_type", "transaction_date"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     balance_id = Column(Integer, ForeignKey("bonus_balances.id"), nullable=False)
@@ -37,10 +44,21 @@ class BonusTransaction(Base):
     amount = Column(Numeric(10, 2), nullable=False)
     balance_before = Column(Numeric(10, 2), nullable=False)
     balance_after = Column(Numeric(10, 2), nullable=False)
-    transaction_date = Column(DateTime, server_default=func.now())
+    # Время задаётся в Python с микросекундами: server_default в SQLite пишет строку
+    # без них, и сравнение с курсором по (transaction_date, id) ломается в пределах секунды
+    transaction_date = Column(DateTime, default=datetime.now, server_default=func.now())
     purchase_id = Column(Integer, ForeignKey("purchase_history.id"), nullable=True)
     description = Column(Text, nullable=True)
     
     # Relationships
     balance = relationship("BonusBalance", back_populates="transactions")
 
+
+
+# Keyset-пагинация истории клиента: ORDER BY transaction_date DESC, id DESC
+Index(
+    "ix_bonus_transactions_customer_date_id",
+    BonusTransaction.customer_id,
+    BonusTransaction.transaction_date.desc(),
+    BonusTransaction.id.desc()
+)
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, DateTime, Numeric, ForeignKey, Text, Enum
+from sqlalchemy import Column, Integer, String, DateTime, Numeric, ForeignKey, Text, Enum, Index
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 import enum
@@ -34,8 +34,45 @@ class Customer(Base):
     history = relationship("CustomerHistory", back_populates="customer", order_by="desc(CustomerHistory.changed_at)")
 
 
+# На Postgres термы сравниваются побайтно (COLLATE "C"): поиск по префиксу — диапазон индекса
+SEARCH_TERM_TYPE = String(255).with_variant(String(255, collation="C"), "postgresql")
+
+
+class CustomerSearchTerm(Base):
+    """
+    Поисковые термы клиента: цифры телефона в обратном порядке (поиск по
+    последним цифрам), слова имени и фамилии, email. Поиск — префиксный
+    диапазон по первичному ключу (kind, term, customer_id).
+    """
+    __tablename__ = "customer_search_terms"
+    __table_args__ = (
+        Index("ix_customer_search_terms_customer", "customer_id", "kind", "term"),
+    )
+
+    kind = Column(String(10), primary_key=True)
+    term = Column(SEARCH_TERM_TYPE, primary_key=True)
+    customer_id = Column(Integer, ForeignKey("customers.id", ondelete="CASCADE"), primary_key=True)
+
+
+class CustomerStore(Base):
+    """
+    Клиенты магазина: пара появляется при первой покупке клиента в магазине.
+    Первичный ключ (store_id, customer_id) — список клиентов магазина с
+    keyset-пагинацией по customer_id.
+    """
+    __tablename__ = "customer_stores"
+
+    store_id = Column(Integer, ForeignKey("stores.id"), primary_key=True)
+    customer_id = Column(Integer, ForeignKey("customers.id", ondelete="CASCADE"), primary_key=True)
+    first_purchase_date = Column(DateTime, server_default=func.now())
+
+
 class PurchaseHistory(Base):
     __tablename__ = "purchase_history"
+    __table_args__ = (
+        # Номер чека уникален в пределах магазина (идемпотентность POS)
+        Index("ux_purchase_history_store_receipt", "store_id", "receipt_number", unique=True),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     customer_id = Column(Integer, ForeignKey("customers.id"), nullable=False)
@@ -1,11 +1,15 @@
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Text, JSON
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Text, JSON, Index
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from app.core.database import Base
 
 
 class CustomerHistory(Base):
-    """История изменений данных клиента"""
+    """
+    История изменений данных клиента: одна запись на изменение.
+    changes — изменённые поля {"поле": {"old": ..., "new": ...}};
+    field_name/old_value/new_value заполнены только у записей старого формата.
+    """
     __tablename__ = "customer_history"
 
     id = Column(Integer, primary_key=True, index=True)
@@ -22,4 +26,16 @@ class CustomerHistory(Base):
     # Relationships
     customer = relationship("Customer", back_populates="history")
     changed_by_cashier = relationship("Cashier", foreign_keys=[changed_by])
+    fields = relationship("CustomerHistoryField", cascade="all, delete-orphan", passive_deletes=True)
 
+
+class CustomerHistoryField(Base):
+    """Поля, изменённые в записи истории: выборка истории по полю без разбора JSON"""
+    __tablename__ = "customer_history_fields"
+    __table_args__ = (
+        Index("ix_customer_history_fields_customer_field", "customer_id", "field_name", "history_id"),
+    )
+
+    history_id = Column(Integer, ForeignKey("customer_history.id", ondelete="CASCADE"), primary_key=True)
+    field_name = Column(String(100), primary_key=True)
+    customer_id = Column(Integer, nullable=False)
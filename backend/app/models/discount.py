@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, Numeric, DateTime, String, ForeignKey, Boolean, Text, Enum, JSON
+from sqlalchemy import Column, Integer, Numeric, DateTime, String, ForeignKey, Boolean, Text, Enum, JSON, Index
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 import enum
@@ -70,3 +70,24 @@ class DiscountApplication(Base):
     rule = relationship("DiscountRule", back_populates="applications")
     purchase = relationship("PurchaseHistory", back_populates="discount_applications")
 
+
+
+class DiscountUsageCounter(Base):
+    """Счётчик применений правила скидки клиентом (вместо COUNT по discount_applications)"""
+    __tablename__ = "discount_usage_counters"
+
+    customer_id = Column(Integer, ForeignKey("customers.id"), primary_key=True)
+    discount_rule_id = Column(Integer, ForeignKey("discount_rules.id"), primary_key=True)
+    uses_count = Column(Integer, nullable=False, default=0)
+    last_used_at = Column(DateTime, server_default=func.now(), onupdate=func.now())
+
+
+class DiscountRuleStore(Base):
+    """Магазины правила скидки (нормализованная копия applicable_stores для индексного поиска)"""
+    __tablename__ = "discount_rule_stores"
+    __table_args__ = (
+        Index("ix_discount_rule_stores_store_rule", "store_id", "discount_rule_id"),
+    )
+
+    discount_rule_id = Column(Integer, ForeignKey("discount_rules.id", ondelete="CASCADE"), primary_key=True)
+    store_id = Column(Integer, primary_key=True)  # без FK: как и в JSON, допускаются ещё не созданные магазины
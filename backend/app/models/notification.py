@@ -1,6 +1,6 @@
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Text, Enum, Boolean
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Text, Enum, Boolean, Index
 from sqlalchemy.orm import relationship
-from sqlalchemy.sql import func
+from sqlalchemy.sql import func, false
 import enum
 from app.core.database import Base
 
@@ -19,6 +19,10 @@ class NotificationStatus(str, enum.Enum):
 
 class Notification(Base):
     __tablename__ = "notifications"
+    __table_args__ = (
+        # Выборка outbox фоновым отправителем
+        Index("ix_notifications_outbox_status", "outbox", "status", "id"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     customer_id = Column(Integer, ForeignKey("customers.id"), nullable=True)
@@ -30,4 +34,6 @@ class Notification(Base):
     created_at = Column(DateTime, server_default=func.now())
     error_message = Column(Text, nullable=True)
     extra_data = Column(Text, nullable=True)  # JSON для дополнительных данных
+    # Записано в outbox и отправляется notification_dispatcher; черновики ждут /send
+    outbox = Column(Boolean, nullable=False, default=False, server_default=false())
 
@@ -1,7 +1,7 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field, model_validator
 from datetime import datetime
 from decimal import Decimal
-from typing import Optional
+from typing import Optional, List
 
 
 class BonusBalanceResponse(BaseModel):
@@ -39,3 +39,23 @@ class BonusTransactionResponse(BaseModel):
     class Config:
         from_attributes = True
 
+
+
+class BonusBulkAccrualRequest(BaseModel):
+    """Начисление баллов группе клиентов: список customer_ids или сегмент"""
+    amount: Decimal = Field(..., gt=0)
+    customer_ids: Optional[List[int]] = None
+    segment_name: Optional[str] = None
+    description: Optional[str] = None
+
+    @model_validator(mode="after")
+    def check_target(self):
+        if (self.customer_ids is None) == (self.segment_name is None):
+            raise ValueError("Укажите либо customer_ids, либо segment_name")
+        return self
+
+
+class BonusBulkAccrualResponse(BaseModel):
+    customers: int  # скольким клиентам начислено
+    skipped: int  # id из списка, для которых клиент не найден
+    total_amount: Decimal
@@ -1,6 +1,6 @@
 from pydantic import BaseModel, EmailStr
 from datetime import datetime
-from typing import Optional
+from typing import Optional, List
 from decimal import Decimal
 
 
@@ -63,3 +63,30 @@ class PurchaseResponse(BaseModel):
     class Config:
         from_attributes = True
 
+
+
+class PurchaseIngestItem(BaseModel):
+    """Чек из офлайн-смены кассы (одна строка NDJSON)"""
+    customer_id: int
+    store_id: int
+    amount: Decimal
+    items_count: int = 0
+    bonuses_to_use: Decimal = Decimal("0")
+    payment_method: Optional[str] = None
+    receipt_number: Optional[str] = None
+    purchase_date: Optional[datetime] = None  # время пробития чека на кассе
+
+
+class PurchaseIngestResult(BaseModel):
+    line: int  # номер строки в потоке, начиная с 1
+    receipt_number: Optional[str] = None
+    status: str  # created, duplicate, error
+    purchase_id: Optional[int] = None
+    error: Optional[str] = None
+
+
+class PurchaseIngestResponse(BaseModel):
+    created: int
+    duplicates: int
+    failed: int
+    items: List[PurchaseIngestResult]
@@ -1,4 +1,4 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from datetime import datetime
 from decimal import Decimal
 from typing import Optional, List, Dict, Any
@@ -69,11 +69,18 @@ class DiscountApplicationResponse(BaseModel):
         from_attributes = True
 
 
+class DiscountLineItem(BaseModel):
+    sku: Optional[str] = None
+    category: Optional[str] = None
+    price: Decimal
+    quantity: int = 1
+
+
 class DiscountCalculationRequest(BaseModel):
     customer_id: int
     store_id: int
     amount: Decimal
-    items: Optional[List[Dict[str, Any]]] = None  # список товаров с категориями
+    items: Optional[List[DiscountLineItem]] = None  # список товаров с категориями
 
 
 class DiscountCalculationResponse(BaseModel):
@@ -81,4 +88,45 @@ class DiscountCalculationResponse(BaseModel):
     total_discount: Decimal
     final_amount: Decimal
     bonuses_earned: Decimal
+    line_discounts: Optional[List[Decimal]] = None  # скидка по каждой позиции items
+    quote_token: Optional[str] = None  # передаётся в process-purchase, чтобы не пересчитывать скидки
+
+
+
+class DiscountBatchCalculationRequest(BaseModel):
+    quotes: List[DiscountCalculationRequest] = Field(..., max_length=10000)
+
+
+class DiscountBatchQuoteResult(BaseModel):
+    index: int  # позиция котировки в запросе
+    result: Optional[DiscountCalculationResponse] = None
+    error: Optional[str] = None
+
+
+class DiscountBatchCalculationResponse(BaseModel):
+    results: List[DiscountBatchQuoteResult]
 
+
+class DiscountSimulationRequest(BaseModel):
+    rules: List[DiscountRuleCreate]
+    start_date: Optional[datetime] = None  # по умолчанию — days дней назад
+    end_date: Optional[datetime] = None  # по умолчанию — сейчас
+    days: int = 90
+    store_ids: Optional[List[int]] = None
+    workers: Optional[int] = Field(None, ge=1, le=32)  # сверх числа CPU всё равно урезается
+
+
+class DiscountSimulationRuleCost(BaseModel):
+    rule_index: int  # позиция правила в запросе
+    name: str
+    applications: int
+    total_discount: Decimal
+    affected_customers: int
+
+
+class DiscountSimulationResponse(BaseModel):
+    purchases_replayed: int
+    total_revenue: Decimal
+    total_discount: Decimal
+    affected_customers: int
+    rules: List[DiscountSimulationRuleCost]
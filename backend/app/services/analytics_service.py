@@ -8,6 +8,7 @@ from app.models.bonus import BonusTransaction, BonusTransactionType
 from app.models.discount import DiscountApplication
 from app.models.analytics import CustomerSegment
 from app.schemas.analytics import AnalyticsRequest, AnalyticsResponse
+from app.services.segment_index import segment_index
 
 
 class AnalyticsService:
@@ -15,6 +16,7 @@ class AnalyticsService:
     def segment_customers(db: Session):
         """Автоматическая сегментация клиентов"""
         customers = db.query(Customer).all()
+        memberships = {}
         
         for customer in customers:
             # Удаляем старые сегменты
@@ -33,8 +35,11 @@ class AnalyticsService:
                 }
             )
             db.add(segment)
+            memberships[customer.id] = {segment_name}
         
         db.commit()
+        # Индекс сегментов для расчёта скидок обновляем без повторного чтения из БД
+        segment_index.replace(memberships)
 
     @staticmethod
     def _determine_segment(customer: Customer) -> str:
@@ -0,0 +1,196 @@
+import json
+import logging
+import threading
+from typing import Iterable, Optional
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from app.core.cache import TTLCache
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = "bonus_balance:"
+# Значения, ожидающие commit (session.info): записываются в кэш после фиксации
+STAGED_KEY = "balance_cache_staged"
+# Метка «баланс изменяется»: пока она стоит, чтение идёт в БД и кэш не заполняется
+PENDING = {"pending": True}
+
+# Заменить значение, если оно не новее записываемого (метка «изменяется» заменяется всегда)
+_STORE_SCRIPT = """
+local current = redis.call('GET', KEYS[1])
+if current then
+    local data = cjson.decode(current)
+    if not data.pending and tonumber(data.version) >= tonumber(ARGV[2]) then
+        return 0
+    end
+end
+redis.call('SET', KEYS[1], ARGV[1], 'EX', ARGV[3])
+return 1
+"""
+
+
+def _encode(row) -> dict:
+    return {
+        "id": row.id,
+        "customer_id": row.customer_id,
+        "current_balance": str(row.current_balance),
+        "total_earned": str(row.total_earned),
+        "total_spent": str(row.total_spent),
+        "last_updated": row.last_updated.isoformat() if row.last_updated else None,
+        "version": row.version or 0,
+    }
+
+
+class LocalBalanceStore:
+    """Заместитель Redis в памяти процесса: годится только при одном процессе API"""
+
+    def __init__(self, maxsize: int, ttl_seconds: int, pending_ttl: int):
+        self._cache = TTLCache(maxsize, ttl_seconds)
+        self._pending_ttl = pending_ttl
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[dict]:
+        return self._cache.get(key)
+
+    def mark_pending(self, keys: Iterable[str]):
+        with self._lock:
+            for key in keys:
+                self._cache.set(key, PENDING, self._pending_ttl)
+
+    def fill(self, key: str, value: dict):
+        with self._lock:
+            if self._cache.get(key) is None:
+                self._cache.set(key, value)
+
+    def store(self, key: str, value: dict):
+        with self._lock:
+            current = self._cache.get(key)
+            if current is None or current.get("pending") or current["version"] < value["version"]:
+                self._cache.set(key, value)
+
+
+class RedisBalanceStore:
+    """Общий для всех процессов кэш в Redis (settings.REDIS_URL)"""
+
+    def __init__(self, url: str, ttl_seconds: int, pending_ttl: int):
+        import redis
+
+        self._client = redis.Redis.from_url(url, socket_timeout=0.5, socket_connect_timeout=0.5)
+        self._store_script = self._client.register_script(_STORE_SCRIPT)
+        self._ttl_seconds = ttl_seconds
+        self._pending_ttl = pending_ttl
+
+    def get(self, key: str) -> Optional[dict]:
+        raw = self._client.get(key)
+        return json.loads(raw) if raw is not None else None
+
+    def mark_pending(self, keys: Iterable[str]):
+        pipeline = self._client.pipeline(transaction=False)
+        for key in keys:
+            pipeline.set(key, json.dumps(PENDING), ex=self._pending_ttl)
+        pipeline.execute()
+
+    def fill(self, key: str, value: dict):
+        self._client.set(key, json.dumps(value), ex=self._ttl_seconds, nx=True)
+
+    def store(self, key: str, value: dict):
+        self._store_script(keys=[key], args=[json.dumps(value), value["version"], self._ttl_seconds])
+
+
+class BalanceCache:
+    """
+    Кэш бонусных балансов с записью при изменении (write-through).
+
+    Протокол, при котором кэш не отдаёт баланс старее зафиксированного:
+    - запись: до UPDATE ключ помечается «изменяется» (mark_pending), после
+      commit в кэш кладётся значение из RETURNING или перечитанное в той же
+      транзакции после пакетного UPDATE (stage + after_commit);
+      запись из двух транзакций упорядочивается по BonusBalance.version;
+    - чтение: при промахе баланс читается из БД и кладётся в кэш, только если
+      ключа нет (fill) — прочитанное до commit значение не перезапишет ни
+      метку, ни новое значение.
+    Если commit не случился (откат, падение процесса), метка истекает через
+    BALANCE_CACHE_PENDING_TTL, до этого баланс читается из БД.
+    Ошибки хранилища не ломают запросы: чтение уходит в БД.
+    """
+
+    def __init__(self):
+        self._store = None
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return settings.BALANCE_CACHE_BACKEND != "none"
+
+    def _get_store(self):
+        if self._store is None:
+            with self._lock:
+                if self._store is None:
+                    if settings.BALANCE_CACHE_BACKEND == "redis":
+                        self._store = RedisBalanceStore(
+                            settings.REDIS_URL, settings.BALANCE_CACHE_TTL, settings.BALANCE_CACHE_PENDING_TTL
+                        )
+                    else:
+                        self._store = LocalBalanceStore(
+                            settings.BALANCE_CACHE_SIZE, settings.BALANCE_CACHE_TTL,
+                            settings.BALANCE_CACHE_PENDING_TTL
+                        )
+        return self._store
+
+    def get(self, customer_id: int) -> Optional[dict]:
+        """Баланс из кэша или None (промах или баланс изменяется)"""
+        if not self.enabled:
+            return None
+        try:
+            value = self._get_store().get(KEY_PREFIX + str(customer_id))
+        except Exception:
+            logger.warning("Кэш балансов недоступен, чтение из БД", exc_info=True)
+            return None
+        if value is None or value.get("pending"):
+            return None
+        return value
+
+    def fill(self, balance):
+        """Положить прочитанный из БД баланс, если ключа ещё нет"""
+        if not self.enabled:
+            return
+        try:
+            self._get_store().fill(KEY_PREFIX + str(balance.customer_id), _encode(balance))
+        except Exception:
+            logger.warning("Не удалось заполнить кэш балансов", exc_info=True)
+
+    def mark_pending(self, customer_ids: Iterable[int]):
+        """Вызывать до изменения балансов в БД"""
+        if not self.enabled:
+            return
+        try:
+            self._get_store().mark_pending([KEY_PREFIX + str(customer_id) for customer_id in customer_ids])
+        except Exception:
+            logger.warning("Не удалось пометить балансы в кэше как изменяемые", exc_info=True)
+
+    def stage(self, db: Session, rows: Iterable):
+        """Новые значения балансов (строки RETURNING) — в кэш после commit сессии db"""
+        if not self.enabled:
+            return
+        db.info.setdefault(STAGED_KEY, []).extend(_encode(row) for row in rows)
+
+    def store(self, value: dict):
+        try:
+            self._get_store().store(KEY_PREFIX + str(value["customer_id"]), value)
+        except Exception:
+            logger.warning("Не удалось обновить кэш балансов", exc_info=True)
+
+
+balance_cache = BalanceCache()
+
+
+@event.listens_for(Session, "after_commit")
+def _store_staged(session: Session):
+    for value in session.info.pop(STAGED_KEY, ()):
+        balance_cache.store(value)
+
+
+@event.listens_for(Session, "after_rollback")
+def _drop_staged(session: Session):
+    # Метки «изменяется» не снимаем: ключ мог пометить и параллельный запрос, метки истекут сами
+    session.info.pop(STAGED_KEY, None)
@@ -0,0 +1,66 @@
+from decimal import Decimal
+from typing import Dict, List, Tuple
+from app.schemas.discount import DiscountLineItem
+
+
+class BasketService:
+    """
+    Расчёт скидок по позициям корзины.
+
+    Вместо перебора «позиция × правило» корзина один раз сворачивается в
+    подытоги по категориям, правила сопоставляются категориям через заранее
+    построенную карту категория → правила, а скидка распределяется по
+    позициям одним проходом через итоговую ставку категории.
+    """
+
+    @staticmethod
+    def line_totals(items: List[DiscountLineItem]) -> Tuple[List[Decimal], Dict[str, Decimal]]:
+        """Суммы позиций и подытоги по категориям за один проход"""
+        totals = []
+        subtotals: Dict[str, Decimal] = {}
+        for item in items:
+            total = item.price * item.quantity
+            totals.append(total)
+            if item.category is not None:
+                subtotals[item.category] = subtotals.get(item.category, Decimal("0")) + total
+        return totals, subtotals
+
+    @staticmethod
+    def matched_subtotals(subtotals: Dict[str, Decimal], category_map: Dict[str, list]) -> Dict[int, Decimal]:
+        """Сумма подходящих позиций для каждого категорийного правила: {rule_id: сумма}"""
+        matched: Dict[int, Decimal] = {}
+        for category, subtotal in subtotals.items():
+            for rule in category_map.get(category, ()):
+                matched[rule.id] = matched.get(rule.id, Decimal("0")) + subtotal
+        return matched
+
+    @staticmethod
+    def allocate(
+        items: List[DiscountLineItem],
+        totals: List[Decimal],
+        category_map: Dict[str, list],
+        rule_discounts: Dict[int, Decimal],
+        matched: Dict[int, Decimal],
+        basket_discount: Decimal
+    ) -> List[Decimal]:
+        """
+        Распределение скидок по позициям.
+        basket_discount — сумма скидок по правилам без категорий, делится по всей корзине.
+        """
+        basket_total = sum(totals, Decimal("0"))
+        basket_rate = basket_discount / basket_total if basket_total else Decimal("0")
+
+        # Итоговая ставка категории: сумма долей всех сработавших правил этой категории
+        category_rates: Dict[str, Decimal] = {}
+        for category in {item.category for item in items if item.category is not None}:
+            rate = Decimal("0")
+            for rule in category_map.get(category, ()):
+                discount = rule_discounts.get(rule.id)
+                if discount:
+                    rate += discount / matched[rule.id]
+            category_rates[category] = rate
+
+        return [
+            min(total, total * (basket_rate + category_rates.get(item.category, Decimal("0")))).quantize(Decimal("0.01"))
+            for item, total in zip(items, totals)
+        ]
@@ -1,9 +1,31 @@
 from sqlalchemy.orm import Session
-from datetime import datetime
+from sqlalchemy import update, insert, select, func, case, and_, bindparam, tuple_, Numeric
+from sqlalchemy.exc import IntegrityError
+from datetime import datetime, timedelta
+from typing import Callable, Iterable, List, Optional
+import logging
 from app.models.bonus import BonusBalance, BonusTransaction, BonusTransactionType
 from app.models.customer import Customer
-from app.schemas.bonus import BonusTransactionCreate
+from app.models.analytics import CustomerSegment
+from app.schemas.bonus import BonusTransactionCreate, BonusBalanceResponse
 from decimal import Decimal
+from app.core.config import settings
+from app.core.database import SessionLocal
+from app.core.metrics import timed
+from app.core.pagination import encode_cursor, decode_cursor
+from app.core.parallel import id_ranges, default_workers, map_ranges
+from app.services.balance_cache import balance_cache
+
+logger = logging.getLogger(__name__)
+
+CENT = Decimal("0.01")
+# Сколько отрезков customer_id приходится на один процесс при сгорании баллов
+EXPIRY_PARTITIONS_PER_WORKER = 4
+# Столбцы баланса в RETURNING: по ним обновляется кэш балансов
+BALANCE_COLUMNS = (
+    BonusBalance.id, BonusBalance.customer_id, BonusBalance.current_balance, BonusBalance.total_earned,
+    BonusBalance.total_spent, BonusBalance.last_updated, BonusBalance.version
+)
 
 
 class BonusService:
@@ -12,69 +34,426 @@ class BonusService:
         return db.query(BonusBalance).filter(BonusBalance.customer_id == customer_id).first()
 
     @staticmethod
-    def add_bonuses(db: Session, customer_id: int, amount: Decimal, description: str = None, purchase_id: int = None) -> BonusTransaction:
-        balance = db.query(BonusBalance).filter(BonusBalance.customer_id == customer_id).first()
-        if not balance:
-            balance = BonusBalance(customer_id=customer_id)
-            db.add(balance)
-            db.flush()
+    def get_cached_balance(db: Session, customer_id: int) -> Optional[BonusBalanceResponse]:
+        """Баланс для частых опросов: из кэша, при промахе — из БД с заполнением кэша"""
+        cached = balance_cache.get(customer_id)
+        if cached is not None:
+            return BonusBalanceResponse(**cached)
         
-        balance_before = balance.current_balance
-        balance.current_balance += amount
-        balance.total_earned += amount
-        balance.last_updated = datetime.now()
+        balance = BonusService.get_balance(db, customer_id)
+        if balance is None:
+            return None
+        balance_cache.fill(balance)
+        return BonusBalanceResponse.model_validate(balance)
+
+    @staticmethod
+    def stage_cached_balances(db: Session, balance_ids: Iterable[int]):
+        """Балансы, изменённые пакетным UPDATE без RETURNING, — в кэш после commit (перечитываются в той же транзакции)"""
+        if not balance_cache.enabled:
+            return
+        rows = db.execute(select(*BALANCE_COLUMNS).where(BonusBalance.id.in_(list(balance_ids)))).all()
+        balance_cache.stage(db, rows)
+
+    @staticmethod
+    @timed("BonusService.add_bonuses")
+    def add_bonuses(
+        db: Session,
+        customer_id: int,
+        amount: Decimal,
+        description: str = None,
+        purchase_id: int = None,
+        commit: bool = True
+    ) -> BonusTransaction:
+        """commit=False — только flush, фиксирует транзакцию вызывающий код"""
+        row = BonusService._change_balance(db, customer_id, amount)
+        if row is None:
+            # Баланса ещё нет — создаём его и повторяем начисление
+            BonusService._create_balance(db, customer_id)
+            row = BonusService._change_balance(db, customer_id, amount)
         
-        transaction = BonusTransaction(
-            balance_id=balance.id,
-            customer_id=customer_id,
-            transaction_type=BonusTransactionType.EARNED,
-            amount=amount,
-            balance_before=balance_before,
-            balance_after=balance.current_balance,
-            purchase_id=purchase_id,
-            description=description or f"Начислено {amount} баллов"
+        return BonusService._record_transaction(
+            db, row, customer_id, BonusTransactionType.EARNED, amount,
+            row.current_balance - amount, purchase_id,
+            description or f"Начислено {amount} баллов", commit
         )
-        
-        db.add(transaction)
-        db.commit()
-        db.refresh(transaction)
-        return transaction
 
     @staticmethod
-    def spend_bonuses(db: Session, customer_id: int, amount: Decimal, description: str = None, purchase_id: int = None) -> BonusTransaction:
-        balance = db.query(BonusBalance).filter(BonusBalance.customer_id == customer_id).first()
-        if not balance or balance.current_balance < amount:
+    @timed("BonusService.spend_bonuses")
+    def spend_bonuses(
+        db: Session,
+        customer_id: int,
+        amount: Decimal,
+        description: str = None,
+        purchase_id: int = None,
+        commit: bool = True
+    ) -> BonusTransaction:
+        """commit=False — только flush, фиксирует транзакцию вызывающий код"""
+        # Списание условное: при нехватке баллов строка не обновляется
+        row = BonusService._change_balance(db, customer_id, -amount)
+        if row is None:
+            if commit:
+                # Не держим открытой транзакцию (и блокировку записи SQLite) после отказа
+                db.rollback()
             raise ValueError("Недостаточно баллов")
         
-        balance_before = balance.current_balance
-        balance.current_balance -= amount
-        balance.total_spent += amount
-        balance.last_updated = datetime.now()
+        return BonusService._record_transaction(
+            db, row, customer_id, BonusTransactionType.SPENT, amount,
+            row.current_balance + amount, purchase_id,
+            description or f"Списано {amount} баллов", commit
+        )
+
+    @staticmethod
+    @timed("BonusService.bulk_add_bonuses")
+    def bulk_add_bonuses(
+        db: Session,
+        amount: Decimal,
+        customer_ids: Iterable[int] = None,
+        segment_name: str = None,
+        description: str = None,
+        chunk_size: int = None,
+        progress: Callable[[int, int], None] = None
+    ) -> dict:
+        """
+        Начисление amount баллов списку клиентов или всему сегменту.
+
+        Клиенты обрабатываются пачками по chunk_size, каждая в своей транзакции:
+        недостающие балансы создаются одним INSERT, балансы увеличиваются одним
+        UPDATE ... RETURNING, транзакции EARNED вставляются пачкой.
+        progress(обработано, всего) вызывается после каждой пачки.
+        """
+        chunk_size = chunk_size or settings.BONUS_BULK_CHUNK_SIZE
+        description = description or f"Начислено {amount} баллов"
+        if segment_name is not None:
+            ids = [
+                customer_id for (customer_id,) in db.query(CustomerSegment.customer_id).filter(
+                    CustomerSegment.segment_name == segment_name
+                ).distinct()
+            ]
+        else:
+            ids = list(customer_ids)
+        # Порядок по id — одинаковый порядок блокировок у параллельных начислений
+        ids = sorted(set(ids))
+        
+        result = {"customers": 0, "skipped": 0, "total_amount": Decimal("0")}
+        for start in range(0, len(ids), chunk_size):
+            chunk = ids[start:start + chunk_size]
+            try:
+                credited = BonusService._bulk_add_chunk(db, chunk, amount, description, segment_name is None)
+                db.commit()
+            except Exception:
+                db.rollback()
+                logger.exception("Массовое начисление прервано, начислено клиентам: %s", result["customers"])
+                raise
+            result["customers"] += credited
+            result["skipped"] += len(chunk) - credited
+            result["total_amount"] += amount * credited
+            
+            done = min(start + chunk_size, len(ids))
+            logger.info("Массовое начисление: %s из %s клиентов", done, len(ids))
+            if progress:
+                progress(done, len(ids))
+        return result
+
+    @staticmethod
+    def _bulk_add_chunk(db: Session, customer_ids: List[int], amount: Decimal, description: str, check_customers: bool) -> int:
+        if check_customers:
+            customer_ids = [
+                customer_id for (customer_id,) in db.query(Customer.id).filter(Customer.id.in_(customer_ids))
+            ]
+            if not customer_ids:
+                return 0
+        
+        with_balance = {
+            customer_id for (customer_id,) in db.query(BonusBalance.customer_id).filter(
+                BonusBalance.customer_id.in_(customer_ids)
+            )
+        }
+        missing = [customer_id for customer_id in customer_ids if customer_id not in with_balance]
+        if missing:
+            db.execute(insert(BonusBalance), [
+                {"customer_id": customer_id, "current_balance": Decimal("0"),
+                 "total_earned": Decimal("0"), "total_spent": Decimal("0")}
+                for customer_id in missing
+            ])
+        
+        now = datetime.now()
+        balance_cache.mark_pending(customer_ids)
+        rows = db.execute(
+            update(BonusBalance)
+            .where(BonusBalance.customer_id.in_(customer_ids))
+            .values(
+                current_balance=BonusBalance.current_balance + amount,
+                total_earned=BonusBalance.total_earned + amount,
+                last_updated=now,
+                version=BonusBalance.version + 1
+            )
+            .returning(*BALANCE_COLUMNS)
+            .execution_options(synchronize_session=False)
+        ).all()
+        balance_cache.stage(db, rows)
         
+        db.execute(insert(BonusTransaction), [
+            {
+                "balance_id": row.id,
+                "customer_id": row.customer_id,
+                "transaction_type": BonusTransactionType.EARNED,
+                "amount": amount,
+                "balance_before": row.current_balance - amount,
+                "balance_after": row.current_balance,
+                "transaction_date": now,
+                "description": description,
+            }
+            for row in rows
+        ])
+        return len(rows)
+
+    @staticmethod
+    def _change_balance(db: Session, customer_id: int, delta: Decimal):
+        """
+        Изменить баланс одним UPDATE ... RETURNING: (id, current_balance) после
+        изменения или None, если баланса нет (или не хватает баллов для списания)
+        """
+        statement = update(BonusBalance).where(BonusBalance.customer_id == customer_id)
+        if delta < 0:
+            statement = statement.where(BonusBalance.current_balance >= -delta).values(
+                current_balance=BonusBalance.current_balance + delta,
+                total_spent=BonusBalance.total_spent - delta
+            )
+        else:
+            statement = statement.values(
+                current_balance=BonusBalance.current_balance + delta,
+                total_earned=BonusBalance.total_earned + delta
+            )
+        statement = statement.values(
+            last_updated=datetime.now(), version=BonusBalance.version + 1
+        ).returning(*BALANCE_COLUMNS).execution_options(synchronize_session="fetch")
+        
+        balance_cache.mark_pending([customer_id])
+        row = db.execute(statement).first()
+        if row is not None:
+            balance_cache.stage(db, [row])
+        return row
+
+    @staticmethod
+    def _create_balance(db: Session, customer_id: int):
+        try:
+            with db.begin_nested():
+                db.add(BonusBalance(
+                    customer_id=customer_id,
+                    current_balance=Decimal("0"),
+                    total_earned=Decimal("0"),
+                    total_spent=Decimal("0")
+                ))
+        except IntegrityError:
+            # Баланс успели создать параллельно
+            pass
+
+    @staticmethod
+    def _record_transaction(
+        db: Session,
+        row,
+        customer_id: int,
+        transaction_type: BonusTransactionType,
+        amount: Decimal,
+        balance_before: Decimal,
+        purchase_id: int,
+        description: str,
+        commit: bool
+    ) -> BonusTransaction:
         transaction = BonusTransaction(
-            balance_id=balance.id,
+            balance_id=row.id,
             customer_id=customer_id,
-            transaction_type=BonusTransactionType.SPENT,
+            transaction_type=transaction_type,
             amount=amount,
             balance_before=balance_before,
-            balance_after=balance.current_balance,
+            balance_after=row.current_balance,
             purchase_id=purchase_id,
-            description=description or f"Списано {amount} баллов"
+            description=description
         )
         
         db.add(transaction)
-        db.commit()
-        db.refresh(transaction)
+        if commit:
+            db.commit()
+            db.refresh(transaction)
+        else:
+            db.flush()
         return transaction
 
+    @staticmethod
+    def expire_bonuses(
+        db: Session,
+        as_of: datetime = None,
+        lifetime_days: int = None,
+        from_customer_id: int = None,
+        chunk_size: int = None,
+        workers: int = 1
+    ) -> dict:
+        """
+        Сгорание баллов, начисленных раньше as_of - lifetime_days.
+
+        Списания и прошлые сгорания погашают самые старые начисления (FIFO),
+        поэтому сгорает max(0, начислено до границы - списано - уже сгорело),
+        но не больше текущего баланса. Клиенты обрабатываются отрезками
+        customer_id по chunk_size, каждый в своей транзакции; повторный запуск
+        с тем же as_of ничего не списывает дважды, а from_customer_id позволяет
+        продолжить прерванный запуск.
+        """
+        as_of = as_of or datetime.now()
+        cutoff = as_of - timedelta(days=lifetime_days or settings.BONUS_LIFETIME_DAYS)
+        chunk_size = chunk_size or settings.BONUS_EXPIRY_CHUNK_SIZE
+        
+        workers = default_workers(workers)
+        # SQLite сериализует запись: параллельные процессы только мешали бы друг другу
+        parallel = workers > 1 and db.get_bind().dialect.name != "sqlite"
+        ranges = id_ranges(
+            db, BonusBalance.customer_id, workers * EXPIRY_PARTITIONS_PER_WORKER if parallel else 1,
+            start=from_customer_id
+        )
+        if not ranges:
+            return {"customers": 0, "expired": Decimal("0"), "last_customer_id": None}
+        if not parallel:
+            return _expire_range(ranges[0][0], ranges[-1][1], cutoff, as_of, chunk_size, db)
+        
+        partials = map_ranges(workers, _expire_range, ranges, cutoff, as_of, chunk_size)
+        return {
+            "customers": sum(partial["customers"] for partial in partials),
+            "expired": sum((partial["expired"] for partial in partials), Decimal("0")),
+            "last_customer_id": ranges[-1][1],
+        }
+
+    @staticmethod
+    def _expire_chunk(db: Session, customer_from: int, customer_to: int, cutoff: datetime, as_of: datetime):
+        """Сгорание для клиентов [customer_from, customer_to]: (клиентов, сумма)"""
+        earned_before_cutoff = func.sum(case(
+            (and_(
+                BonusTransaction.transaction_type == BonusTransactionType.EARNED,
+                BonusTransaction.transaction_date < cutoff
+            ), BonusTransaction.amount),
+            else_=0
+        ))
+        consumed = func.sum(case(
+            (BonusTransaction.transaction_type.in_([BonusTransactionType.SPENT, BonusTransactionType.EXPIRED]),
+             BonusTransaction.amount),
+            else_=0
+        ))
+        balances = db.query(BonusBalance.id, BonusBalance.customer_id, BonusBalance.current_balance).filter(
+            BonusBalance.customer_id.between(customer_from, customer_to)
+        ).order_by(BonusBalance.id).with_for_update().all()
+        if not balances:
+            return 0, Decimal("0")
+        # Журнал читается после блокировки: списания пишутся вместе с изменением
+        # баланса, поэтому зафиксированные уже видны, а новые ждут
+        expirable = dict(
+            db.query(BonusTransaction.customer_id, earned_before_cutoff - consumed).filter(
+                BonusTransaction.customer_id.between(customer_from, customer_to)
+            ).group_by(BonusTransaction.customer_id).having(earned_before_cutoff - consumed > 0).all()
+        )
+        if not expirable:
+            return 0, Decimal("0")
+        
+        description = f"Сгорание баллов, начисленных до {cutoff:%d.%m.%Y}"
+        transactions = []
+        changes = []
+        for balance_id, customer_id, current_balance in balances:
+            if customer_id not in expirable:
+                continue
+            amount = min(Decimal(str(expirable[customer_id])), current_balance or Decimal("0")).quantize(CENT)
+            if amount <= 0:
+                continue
+            transactions.append({
+                "balance_id": balance_id,
+                "customer_id": customer_id,
+                "transaction_type": BonusTransactionType.EXPIRED,
+                "amount": amount,
+                "balance_before": current_balance,
+                "balance_after": current_balance - amount,
+                "transaction_date": as_of,
+                "description": description,
+            })
+            changes.append({"b_id": balance_id, "b_amount": amount})
+        
+        if not transactions:
+            return 0, Decimal("0")
+        
+        db.execute(insert(BonusTransaction), transactions)
+        balance_cache.mark_pending(transaction["customer_id"] for transaction in transactions)
+        balances_table = BonusBalance.__table__
+        db.execute(
+            update(balances_table)
+            .where(balances_table.c.id == bindparam("b_id"))
+            .values(
+                current_balance=balances_table.c.current_balance - bindparam("b_amount", type_=Numeric(10, 2)),
+                last_updated=as_of,
+                version=balances_table.c.version + 1
+            ),
+            changes
+        )
+        BonusService.stage_cached_balances(db, (change["b_id"] for change in changes))
+        return len(transactions), sum((change["b_amount"] for change in changes), Decimal("0"))
+
     @staticmethod
     def calculate_bonuses(purchase_amount: Decimal, bonus_rate: Decimal = Decimal("0.01")) -> Decimal:
         """Расчёт бонусов: по умолчанию 1% от суммы покупки"""
         return (purchase_amount * bonus_rate).quantize(Decimal("0.01"))
 
     @staticmethod
-    def get_transactions(db: Session, customer_id: int, skip: int = 0, limit: int = 100):
-        return db.query(BonusTransaction).filter(
+    def get_transactions(db: Session, customer_id: int, skip: int = 0, limit: int = 100, cursor: str = None):
+        """
+        История операций клиента, новые первыми.
+        С cursor — keyset-пагинация по (transaction_date, id): глубокие страницы
+        стоят столько же, сколько первая; skip оставлен для совместимости.
+        """
+        query = db.query(BonusTransaction).filter(
             BonusTransaction.customer_id == customer_id
-        ).order_by(BonusTransaction.transaction_date.desc()).offset(skip).limit(limit).all()
+        ).order_by(BonusTransaction.transaction_date.desc(), BonusTransaction.id.desc())
+        if cursor:
+            position = decode_cursor(cursor)
+            if position is None:
+                raise ValueError("Некорректный курсор")
+            query = query.filter(
+                tuple_(BonusTransaction.transaction_date, BonusTransaction.id) < tuple_(*position)
+            )
+        else:
+            query = query.offset(skip)
+        return query.limit(limit).all()
+
+    @staticmethod
+    def next_cursor(transactions: List[BonusTransaction], limit: int) -> Optional[str]:
+        """Курсор следующей страницы; None — страница последняя"""
+        if len(transactions) < limit:
+            return None
+        last = transactions[-1]
+        return encode_cursor(last.transaction_date, last.id)
+
+
 
+def _expire_range(
+    customer_from: int,
+    customer_to: int,
+    cutoff: datetime,
+    as_of: datetime,
+    chunk_size: int,
+    db: Optional[Session] = None
+) -> dict:
+    """Сгорание баллов клиентов [customer_from, customer_to] отрезками по chunk_size (в т.ч. в отдельном процессе)"""
+    own_session = db is None
+    db = db or SessionLocal()
+    result = {"customers": 0, "expired": Decimal("0"), "last_customer_id": None}
+    try:
+        for chunk_from in range(customer_from, customer_to + 1, chunk_size):
+            chunk_to = min(chunk_from + chunk_size - 1, customer_to)
+            try:
+                customers, expired = BonusService._expire_chunk(db, chunk_from, chunk_to, cutoff, as_of)
+                db.commit()
+            except Exception:
+                db.rollback()
+                logger.exception("Сгорание баллов прервано на клиентах %s-%s", chunk_from, chunk_to)
+                raise
+            result["customers"] += customers
+            result["expired"] += expired
+            result["last_customer_id"] = chunk_to
+            logger.info("Сгорание баллов: клиенты до %s, сгорело %s у %s клиентов", chunk_to, expired, customers)
+    finally:
+        if own_session:
+            db.close()
+    return result
@@ -3,6 +3,7 @@ from datetime import datetime
 from app.models.cashier import Cashier
 from app.core.security import verify_password, get_password_hash
 from app.schemas.auth import CashierCreate
+from app.services.name_directory import cashier_names
 
 
 class CashierService:
@@ -42,6 +43,7 @@ class CashierService:
         db.add(cashier)
         db.commit()
         db.refresh(cashier)
+        cashier_names.invalidate()
         return cashier
 
     @staticmethod
@@ -0,0 +1,148 @@
+import re
+from typing import List, Set, Tuple
+from sqlalchemy import and_, delete, exists, insert
+from sqlalchemy.orm import Session, aliased
+from app.models.customer import Customer, CustomerSearchTerm
+
+PHONE = "phone"
+NAME = "name"
+EMAIL = "email"
+
+# Запросы короче не выполняются: префикс из одного символа совпадает с огромной долей клиентов
+MIN_QUERY_LENGTH = 2
+# Сколько термов одного клиента может совпасть с одним словом запроса (имя, фамилия, email)
+MATCHES_PER_CUSTOMER = 4
+REBUILD_CHUNK_SIZE = 5000
+
+_WORD = re.compile(r"\w+")
+_LETTER = re.compile(r"[^\W\d_]")
+
+
+def normalize(value: str) -> str:
+    return value.strip().lower().replace("ё", "е")
+
+
+def _digits(value: str) -> str:
+    return "".join(char for char in value if char.isdigit())
+
+
+def _upper_bound(prefix: str) -> str:
+    """Наименьшая строка больше всех строк с префиксом prefix"""
+    return prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+
+class CustomerSearchService:
+    """
+    Поиск клиентов по последним цифрам телефона, началу имени/фамилии и email.
+
+    Термы хранятся в customer_search_terms и обновляются при создании и
+    изменении клиента. Каждое слово запроса — префиксный диапазон по индексу;
+    самое длинное слово выбирает кандидатов в порядке терма (точное совпадение
+    раньше продолжений), остальные проверяются EXISTS по индексу клиента.
+    """
+
+    @staticmethod
+    def terms_for(customer) -> Set[Tuple[str, str]]:
+        """Термы клиента (объект Customer или строка с его полями)"""
+        terms = set()
+        digits = _digits(customer.phone or "")
+        if digits:
+            terms.add((PHONE, digits[::-1]))
+        for value in (customer.first_name, customer.last_name):
+            for word in _WORD.findall(normalize(value or "")):
+                terms.add((NAME, word))
+        if customer.email:
+            terms.add((EMAIL, normalize(customer.email)))
+        return terms
+
+    @staticmethod
+    def index_customer(db: Session, customer: Customer):
+        """Перестроить термы клиента (в транзакции вызывающего кода)"""
+        CustomerSearchService._write_terms(db, [customer])
+
+    @staticmethod
+    def rebuild(db: Session, chunk_size: int = REBUILD_CHUNK_SIZE) -> int:
+        """Перестроить индекс всех клиентов пачками по chunk_size; число клиентов"""
+        indexed = 0
+        last_id = 0
+        while True:
+            customers = db.query(
+                Customer.id, Customer.phone, Customer.first_name, Customer.last_name, Customer.email
+            ).filter(Customer.id > last_id).order_by(Customer.id).limit(chunk_size).all()
+            if not customers:
+                return indexed
+            CustomerSearchService._write_terms(db, customers)
+            db.commit()
+            indexed += len(customers)
+            last_id = customers[-1].id
+
+    @staticmethod
+    def _write_terms(db: Session, customers: list):
+        db.execute(delete(CustomerSearchTerm).where(
+            CustomerSearchTerm.customer_id.in_([customer.id for customer in customers])
+        ))
+        rows = [
+            {"kind": kind, "term": term, "customer_id": customer.id}
+            for customer in customers
+            for kind, term in CustomerSearchService.terms_for(customer)
+        ]
+        if rows:
+            db.execute(insert(CustomerSearchTerm), rows)
+
+    @staticmethod
+    def parse_query(query: str) -> List[Tuple[Tuple[str, ...], str]]:
+        """Условия поиска [(виды термов, префикс)]; пустой список — запрос слишком короткий"""
+        query = normalize(query)
+        if "@" in query:
+            conditions = [((EMAIL,), query)]
+        elif not _LETTER.search(query):
+            # Только цифры и разделители: «+7 (900) 123-45-67» или «4567» — конец номера
+            conditions = [((PHONE,), _digits(query)[::-1])]
+        else:
+            conditions = [
+                ((PHONE,), word[::-1]) if word.isdigit() else ((NAME, EMAIL), word)
+                for word in _WORD.findall(query)
+            ]
+        conditions = [condition for condition in conditions if condition[1]]
+        if sum(len(prefix) for _, prefix in conditions) < MIN_QUERY_LENGTH:
+            return []
+        return conditions
+
+    @staticmethod
+    def search(db: Session, query: str, limit: int = 20) -> List[Customer]:
+        conditions = CustomerSearchService.parse_query(query)
+        if not conditions:
+            return []
+        # Самое длинное слово обычно самое избирательное — по нему выбираем кандидатов
+        conditions.sort(key=lambda condition: len(condition[1]), reverse=True)
+        (kinds, prefix), rest = conditions[0], conditions[1:]
+
+        term = CustomerSearchTerm
+        rows = []
+        # По каждому виду термов отдельно: диапазон индекса читается уже упорядоченным
+        for kind in kinds:
+            candidates = db.query(term.term, term.customer_id).filter(_prefix_match(term, (kind,), prefix))
+            for other_kinds, other_prefix in rest:
+                other = aliased(CustomerSearchTerm)
+                candidates = candidates.filter(exists().where(
+                    other.customer_id == term.customer_id, _prefix_match(other, other_kinds, other_prefix)
+                ))
+            rows.extend(candidates.order_by(term.term, term.customer_id).limit(limit * MATCHES_PER_CUSTOMER).all())
+        rows.sort()
+
+        customer_ids = list(dict.fromkeys(customer_id for _, customer_id in rows))[:limit]
+        if not customer_ids:
+            return []
+        customers = {
+            customer.id: customer
+            for customer in db.query(Customer).filter(Customer.id.in_(customer_ids))
+        }
+        return [customers[customer_id] for customer_id in customer_ids if customer_id in customers]
+
+
+def _prefix_match(term, kinds: Tuple[str, ...], prefix: str):
+    return and_(
+        term.kind.in_(kinds) if len(kinds) > 1 else term.kind == kinds[0],
+        term.term >= prefix,
+        term.term < _upper_bound(prefix)
+    )
@@ -1,12 +1,16 @@
 from sqlalchemy.orm import Session
-from sqlalchemy import func
+from sqlalchemy import func, insert, tuple_
+from sqlalchemy.exc import IntegrityError
 from datetime import datetime
-from app.models.customer import Customer, PurchaseHistory, CustomerStatus
+from typing import Iterable, Tuple
+from app.models.customer import Customer, PurchaseHistory, CustomerStatus, CustomerStore
 from app.models.bonus import BonusBalance
-from app.models.customer_history import CustomerHistory
+from app.models.customer_history import CustomerHistory, CustomerHistoryField
 from app.schemas.customer import CustomerCreate, CustomerUpdate, PurchaseCreate
 from decimal import Decimal
 import json
+from app.core.metrics import timed
+from app.services.customer_search import CustomerSearchService
 
 
 class CustomerService:
@@ -19,6 +23,7 @@ class CustomerService:
         # Создаём бонусный баланс для нового клиента
         bonus_balance = BonusBalance(customer_id=customer.id)
         db.add(bonus_balance)
+        CustomerSearchService.index_customer(db, customer)
         db.commit()
         db.refresh(customer)
         return customer
@@ -39,9 +44,8 @@ class CustomerService:
         
         update_data = customer_data.dict(exclude_unset=True)
         changes = {}
-        history_entries = []
         
-        # Сохраняем старые значения и создаем записи истории
+        # Сохраняем старые значения изменённых полей
         for key, new_value in update_data.items():
             old_value = getattr(customer, key, None)
             
@@ -59,51 +63,121 @@ class CustomerService:
             # Если значение изменилось, сохраняем в историю
             if old_value_str != new_value_str:
                 changes[key] = {"old": old_value_str, "new": new_value_str}
-                
-                history_entry = CustomerHistory(
-                    customer_id=customer_id,
-                    changed_by=changed_by,
-                    change_type="update",
-                    field_name=key,
-                    old_value=old_value_str,
-                    new_value=new_value_str,
-                    changes=changes
-                )
-                history_entries.append(history_entry)
             
             # Обновляем значение
             setattr(customer, key, new_value)
         
-        # Сохраняем все записи истории
-        if history_entries:
-            for entry in history_entries:
-                entry.changes = changes  # Общие изменения для всех записей
-                db.add(entry)
+        # Одна запись истории на изменение; поля — в customer_history_fields для выборки по полю
+        if changes:
+            db.add(CustomerHistory(
+                customer_id=customer_id,
+                changed_by=changed_by,
+                change_type="update",
+                changes=changes,
+                fields=[
+                    CustomerHistoryField(field_name=key, customer_id=customer_id) for key in changes
+                ]
+            ))
         
+        if changes:
+            CustomerSearchService.index_customer(db, customer)
         db.commit()
         db.refresh(customer)
         return customer
 
     @staticmethod
-    def list_customers(db: Session, skip: int = 0, limit: int = 100):
-        return db.query(Customer).offset(skip).limit(limit).all()
+    def get_history(db: Session, customer_id: int, skip: int = 0, limit: int = 100, field_name: str = None):
+        """
+        История изменений клиента, развёрнутая по полям (как в старом формате
+        «одна строка на поле»): (всего строк, [(запись, поле или None)]).
+        field_name — только изменения этого поля (по индексу customer_history_fields).
+        """
+        query = db.query(CustomerHistory, CustomerHistoryField.field_name).filter(
+            CustomerHistory.customer_id == customer_id
+        )
+        if field_name is not None:
+            query = query.join(CustomerHistory.fields).filter(CustomerHistoryField.field_name == field_name)
+        else:
+            query = query.outerjoin(CustomerHistory.fields)
+        
+        total = query.with_entities(func.count()).scalar()
+        rows = query.order_by(
+            CustomerHistory.changed_at.desc(), CustomerHistory.id.desc(), CustomerHistoryField.field_name
+        ).offset(skip).limit(limit).all()
+        return total, rows
+
+    @staticmethod
+    def list_customers(db: Session, skip: int = 0, limit: int = 100, store_id: int = None, after_id: int = None):
+        """
+        Клиенты по возрастанию id; store_id — только клиенты магазина (join с customer_stores).
+        after_id — keyset-пагинация (id последнего клиента предыдущей страницы) вместо skip.
+        """
+        query = db.query(Customer)
+        if store_id is not None:
+            query = query.join(CustomerStore, CustomerStore.customer_id == Customer.id).filter(
+                CustomerStore.store_id == store_id
+            )
+            id_column = CustomerStore.customer_id
+        else:
+            id_column = Customer.id
+        query = query.order_by(id_column)
+        if after_id is not None:
+            query = query.filter(id_column > after_id)
+        else:
+            query = query.offset(skip)
+        return query.limit(limit).all()
+
+    @staticmethod
+    def count_customers(db: Session, store_id: int = None) -> int:
+        if store_id is None:
+            return db.query(func.count(Customer.id)).scalar()
+        return db.query(func.count()).select_from(CustomerStore).filter(CustomerStore.store_id == store_id).scalar()
 
     @staticmethod
+    def link_stores(db: Session, pairs: Iterable[Tuple[int, int]]):
+        """Создать недостающие связи клиент↔магазин для пар (store_id, customer_id)"""
+        pairs = set(pairs)
+        if not pairs:
+            return
+        existing = set(
+            db.query(CustomerStore.store_id, CustomerStore.customer_id).filter(
+                tuple_(CustomerStore.store_id, CustomerStore.customer_id).in_(pairs)
+            ).all()
+        )
+        for store_id, customer_id in sorted(pairs - existing):
+            try:
+                with db.begin_nested():
+                    db.execute(insert(CustomerStore).values(store_id=store_id, customer_id=customer_id))
+            except IntegrityError:
+                # Связь успели создать параллельно
+                pass
+
+    @staticmethod
+    @timed("CustomerService.create_purchase")
     def create_purchase(db: Session, purchase_data: PurchaseCreate) -> PurchaseHistory:
         purchase = PurchaseHistory(**purchase_data.dict())
         db.add(purchase)
         db.flush()  # Получаем ID покупки, но не коммитим (commit будет позже)
         
         # Обновляем статистику клиента
-        customer = db.query(Customer).filter(Customer.id == purchase_data.customer_id).first()
+        customer = db.get(Customer, purchase_data.customer_id)
         if customer:
             customer.total_purchases += purchase_data.amount
             customer.total_visits += 1
             customer.last_visit = datetime.now()
+        CustomerService.link_stores(db, [(purchase_data.store_id, purchase_data.customer_id)])
         
         # Не делаем commit здесь, т.к. покупка будет обновлена позже
         return purchase
 
+    @staticmethod
+    def get_purchase_by_receipt(db: Session, store_id: int, receipt_number: str) -> PurchaseHistory:
+        """Покупка по номеру чека магазина (уникальный индекс store_id, receipt_number)"""
+        return db.query(PurchaseHistory).filter(
+            PurchaseHistory.store_id == store_id,
+            PurchaseHistory.receipt_number == receipt_number
+        ).first()
+
     @staticmethod
     def get_purchase_history(db: Session, customer_id: int, skip: int = 0, limit: int = 100):
         return db.query(PurchaseHistory).filter(
@@ -0,0 +1,125 @@
+from decimal import Decimal
+from typing import Callable, Dict, FrozenSet, Optional, Tuple
+from app.models.discount import DiscountRule, DiscountType
+
+CENT = Decimal("0.01")
+ZERO = Decimal("0")
+
+
+class QuoteContext:
+    """Данные котировки, по которым проверяются предикаты правил"""
+    __slots__ = ("amount", "visits", "usage_counts", "segments")
+
+    def __init__(
+        self,
+        amount: Decimal,
+        visits: int,
+        usage_counts: Dict[int, int],
+        segments: FrozenSet[str] = frozenset()
+    ):
+        self.amount = amount
+        self.visits = visits or 0
+        self.usage_counts = usage_counts
+        self.segments = segments
+
+
+class CompiledRule:
+    """
+    Правило скидки, скомпилированное при загрузке.
+
+    predicates содержит замыкания только для заданных условий, Decimal-константы
+    вычислены заранее, а расчёт суммы выбран по типу скидки один раз.
+    Объект не привязан к сессии SQLAlchemy; изменяется только current_uses.
+    """
+    __slots__ = (
+        "id", "name", "discount_type", "applicable_stores", "applicable_categories",
+        "valid_from", "valid_until", "max_uses_per_customer", "max_total_uses",
+        "current_uses", "predicates", "_compute",
+    )
+
+    def __init__(self, rule: DiscountRule):
+        self.id = rule.id
+        self.name = rule.name
+        self.discount_type = rule.discount_type
+        self.applicable_stores: Optional[FrozenSet[int]] = (
+            frozenset(rule.applicable_stores) if rule.applicable_stores else None
+        )
+        self.applicable_categories: Optional[Tuple[str, ...]] = (
+            tuple(rule.applicable_categories) if rule.applicable_categories else None
+        )
+        self.valid_from = rule.valid_from
+        self.valid_until = rule.valid_until
+        self.max_uses_per_customer = rule.max_uses_per_customer
+        self.max_total_uses = rule.max_total_uses
+        self.current_uses = rule.current_uses or 0
+        self.predicates = _compile_predicates(rule)
+        self._compute = _compile_amount(rule)
+
+    def is_applicable(self, context: QuoteContext) -> bool:
+        for predicate in self.predicates:
+            if not predicate(context):
+                return False
+        return True
+
+    def discount_for(self, amount: Decimal) -> Decimal:
+        return self._compute(amount)
+
+
+def _compile_predicates(rule: DiscountRule) -> Tuple[Callable[[QuoteContext], bool], ...]:
+    predicates = []
+
+    # Минимальная сумма покупки
+    if rule.min_purchase_amount:
+        min_amount = Decimal(str(rule.min_purchase_amount))
+        predicates.append(lambda context: context.amount >= min_amount)
+
+    # Только для новых клиентов
+    if rule.is_new_customer_only:
+        predicates.append(lambda context: context.visits <= 1)
+
+    # Минимальное количество визитов
+    if rule.min_visits_required:
+        min_visits = rule.min_visits_required
+        predicates.append(lambda context: context.visits >= min_visits)
+
+    # Максимальное использование на клиента
+    if rule.max_uses_per_customer:
+        rule_id = rule.id
+        max_uses = rule.max_uses_per_customer
+        predicates.append(lambda context: context.usage_counts.get(rule_id, 0) < max_uses)
+
+    # Сегменты клиентов: достаточно одного общего сегмента
+    if rule.customer_segments:
+        segments = frozenset(rule.customer_segments)
+        predicates.append(lambda context: not segments.isdisjoint(context.segments))
+
+    return tuple(predicates)
+
+
+def _compile_amount(rule: DiscountRule) -> Callable[[Decimal], Decimal]:
+    max_discount = Decimal(str(rule.max_discount_amount)) if rule.max_discount_amount else None
+
+    if rule.discount_type == DiscountType.PERCENTAGE:
+        rate = Decimal(str(rule.value)) / Decimal("100")
+        base = lambda amount: amount * rate
+    elif rule.discount_type == DiscountType.FIXED_AMOUNT:
+        value = Decimal(str(rule.value))
+        base = lambda amount: value
+    else:
+        return lambda amount: ZERO
+
+    def compute(amount: Decimal) -> Decimal:
+        discount = base(amount)
+        # Ограничение максимальной скидки
+        if max_discount is not None and discount > max_discount:
+            discount = max_discount
+        # Скидка не может быть больше суммы покупки
+        if discount > amount:
+            discount = amount
+        return discount.quantize(CENT)
+
+    return compute
+
+
+def compile_rule(rule: DiscountRule) -> CompiledRule:
+    return CompiledRule(rule)
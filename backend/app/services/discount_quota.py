@@ -0,0 +1,151 @@
+import threading
+from typing import Dict, Optional
+from sqlalchemy import select, update
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+from app.core.config import settings
+from app.models.discount import DiscountRule
+from app.services.discount_rule_index import rule_index
+
+# Сколько попыток условного резервирования делаем при конкуренции за строку правила
+RESERVE_ATTEMPTS = 5
+
+
+class RuleQuotaAllocator:
+    """
+    Учёт использований правил скидок без конкуренции за строку discount_rules.
+
+    Для правил с max_total_uses воркер резервирует в БД блок использований
+    условным UPDATE (current_uses + k <= max_total_uses) в отдельной короткой
+    транзакции и дальше раздаёт его из памяти. Чем ближе лимит, тем меньше
+    блок (вплоть до одного использования), поэтому лимит никогда не
+    превышается. current_uses при этом учитывает и зарезервированные, но ещё
+    не использованные блоки; остатки возвращаются в БД при release_all().
+
+    Для правил без лимита использования копятся в памяти и записываются в БД
+    одним UPDATE на каждые DISCOUNT_QUOTA_BLOCK_SIZE применений.
+
+    На SQLite запись и так сериализована, поэтому там счётчик увеличивается
+    условным UPDATE прямо в транзакции покупки.
+    """
+
+    def __init__(self, block_size: int):
+        self._block_size = max(1, block_size)
+        self._lock = threading.Lock()
+        self._reserved: Dict[int, int] = {}  # правило с лимитом -> остаток блока
+        self._pending: Dict[int, int] = {}  # правило без лимита -> незаписанные использования
+        self._bind: Optional[Engine] = None
+
+    def acquire(self, db: Session, rule_id: int) -> bool:
+        """Занять одно использование правила; False — лимит исчерпан"""
+        rule = rule_index.get_rule(db, rule_id)
+        max_total_uses = rule.max_total_uses if rule else self._load_limit(db, rule_id)
+
+        bind = db.get_bind()
+        if bind.dialect.name == "sqlite":
+            # SQLite всё равно сериализует запись: считаем в транзакции вызывающего,
+            # иначе отдельное соединение упрётся в его же блокировку
+            result = db.execute(self._increment(rule_id, 1, limited=bool(max_total_uses)))
+            if result.rowcount:
+                rule_index.note_usage(rule_id)
+            return bool(result.rowcount)
+        self._bind = bind
+
+        if not max_total_uses:
+            with self._lock:
+                pending = self._pending.get(rule_id, 0) + 1
+                self._pending[rule_id] = pending
+            if pending >= self._block_size:
+                self._flush_pending(rule_id)
+            return True
+
+        with self._lock:
+            if self._reserved.get(rule_id, 0) > 0:
+                self._reserved[rule_id] -= 1
+                return True
+
+        granted, current_uses = self._reserve_block(rule_id)
+        if rule is not None and current_uses is not None:
+            rule.current_uses = current_uses
+        if not granted:
+            return False
+
+        with self._lock:
+            self._reserved[rule_id] = self._reserved.get(rule_id, 0) + granted - 1
+        return True
+
+    def release(self, rule_id: int):
+        """Вернуть занятое использование (например, при откате покупки)"""
+        with self._lock:
+            if rule_id in self._reserved:
+                self._reserved[rule_id] += 1
+            elif self._pending.get(rule_id):
+                self._pending[rule_id] -= 1
+
+    def has_local_quota(self, rule_id: int) -> bool:
+        return self._reserved.get(rule_id, 0) > 0
+
+    def release_all(self, bind: Engine = None):
+        """Записать накопленные использования и вернуть остатки блоков (при остановке воркера)"""
+        bind = bind or self._bind
+        if bind is None:
+            return
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            reserved, self._reserved = self._reserved, {}
+
+        with bind.begin() as conn:
+            for rule_id, count in pending.items():
+                if count:
+                    conn.execute(self._increment(rule_id, count))
+            for rule_id, count in reserved.items():
+                if count:
+                    conn.execute(self._increment(rule_id, -count))
+
+    def _flush_pending(self, rule_id: int):
+        with self._lock:
+            count = self._pending.pop(rule_id, 0)
+        if count:
+            with self._bind.begin() as conn:
+                conn.execute(self._increment(rule_id, count))
+
+    def _reserve_block(self, rule_id: int):
+        """Условно зарезервировать блок в отдельной транзакции: (выдано, current_uses)"""
+        current_uses = None
+        for _ in range(RESERVE_ATTEMPTS):
+            with self._bind.begin() as conn:
+                row = conn.execute(
+                    select(DiscountRule.current_uses, DiscountRule.max_total_uses)
+                    .where(DiscountRule.id == rule_id)
+                ).first()
+                if row is None:
+                    return 0, None
+                current_uses = row.current_uses or 0
+                remaining = row.max_total_uses - current_uses
+                if remaining <= 0:
+                    return 0, current_uses
+
+                # Ближе к лимиту — меньше блок, чтобы остаток не застревал в одном воркере
+                granted = max(1, min(self._block_size, remaining // 8))
+                result = conn.execute(self._increment(rule_id, granted, limited=True))
+                if result.rowcount:
+                    return granted, current_uses + granted
+        return 0, current_uses
+
+    @staticmethod
+    def _increment(rule_id: int, count: int, limited: bool = False):
+        statement = update(DiscountRule).where(DiscountRule.id == rule_id)
+        if limited:
+            statement = statement.where(
+                DiscountRule.current_uses + count <= DiscountRule.max_total_uses
+            )
+        return statement.values(
+            current_uses=DiscountRule.current_uses + count
+        ).execution_options(synchronize_session=False)
+
+    @staticmethod
+    def _load_limit(db: Session, rule_id: int) -> Optional[int]:
+        return db.query(DiscountRule.max_total_uses).filter(DiscountRule.id == rule_id).scalar()
+
+
+rule_quota = RuleQuotaAllocator(block_size=settings.DISCOUNT_QUOTA_BLOCK_SIZE)
@@ -0,0 +1,154 @@
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+from sqlalchemy.orm import Session
+from sqlalchemy import or_
+from app.core.config import settings
+from app.models.discount import DiscountRule, DiscountRuleStatus
+from app.services.discount_compiler import CompiledRule, compile_rule
+
+
+class _IndexState:
+    """Неизменяемое состояние индекса для одной версии набора правил"""
+
+    def __init__(self, rules: List[CompiledRule], now: datetime, version: int, loaded_at: float):
+        self.rules = rules
+        self.version = version
+        self.loaded_at = loaded_at
+        self.by_id = {rule.id: rule for rule in rules}
+        self.valid = [rule for rule in rules if is_rule_valid_at(rule, now)]
+        self.next_boundary = _next_boundary(rules, now)
+        self.by_store: Dict[int, List[CompiledRule]] = {}
+        self.categories_by_store: Dict[Optional[int], Dict[str, List[CompiledRule]]] = {}
+
+    def for_store(self, store_id: Optional[int]) -> List[CompiledRule]:
+        if not store_id:
+            return self.valid
+        rules = self.by_store.get(store_id)
+        if rules is None:
+            rules = [
+                rule for rule in self.valid
+                if not rule.applicable_stores or store_id in rule.applicable_stores
+            ]
+            self.by_store[store_id] = rules
+        return rules
+
+    def category_map(self, store_id: Optional[int]) -> Dict[str, List[CompiledRule]]:
+        """Карта категория → категорийные правила магазина"""
+        category_map = self.categories_by_store.get(store_id)
+        if category_map is None:
+            category_map = {}
+            for rule in self.for_store(store_id):
+                for category in rule.applicable_categories or ():
+                    category_map.setdefault(category, []).append(rule)
+            self.categories_by_store[store_id] = category_map
+        return category_map
+
+
+def is_rule_valid_at(rule: CompiledRule, now: datetime) -> bool:
+    """Действует ли правило в момент now (по valid_from/valid_until)"""
+    if rule.valid_from is not None and rule.valid_from > now:
+        return False
+    if rule.valid_until is not None and rule.valid_until < now:
+        return False
+    return True
+
+
+def _next_boundary(rules: List[CompiledRule], now: datetime) -> Optional[datetime]:
+    """Ближайший момент, когда меняется набор действующих правил"""
+    boundaries = []
+    for rule in rules:
+        if rule.valid_from is not None and rule.valid_from > now:
+            boundaries.append(rule.valid_from)
+        if rule.valid_until is not None and rule.valid_until >= now:
+            # valid_until включительно: правило перестаёт действовать сразу после него
+            boundaries.append(rule.valid_until + timedelta(microseconds=1))
+    return min(boundaries) if boundaries else None
+
+
+class DiscountRuleIndex:
+    """
+    Процессный индекс активных правил скидок по магазинам.
+
+    Правила загружаются одним запросом и перестраиваются только при изменении
+    набора правил (invalidate), при переходе границы valid_from/valid_until
+    (без обращения к БД) или по истечении DISCOUNT_RULES_CACHE_TTL, чтобы
+    другие воркеры подхватывали изменения.
+    """
+
+    def __init__(self, ttl_seconds: int):
+        self._ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._state: Optional[_IndexState] = None
+        self._version = 0
+
+    @property
+    def version(self) -> int:
+        state = self._state
+        return state.version if state else self._version
+
+    def invalidate(self):
+        """Сбросить индекс после изменения правил"""
+        with self._lock:
+            self._state = None
+            # Версия меняется сразу, не дожидаясь перестройки индекса
+            self._version += 1
+
+    def get_rules(self, db: Session, store_id: int = None) -> List[CompiledRule]:
+        return self._current_state(db).for_store(store_id)
+
+    def get_category_map(self, db: Session, store_id: int = None) -> Dict[str, List[CompiledRule]]:
+        return self._current_state(db).category_map(store_id)
+
+    def get_rule(self, db: Session, rule_id: int) -> Optional[CompiledRule]:
+        return self._current_state(db).by_id.get(rule_id)
+
+    def note_usage(self, rule_id: int, count: int = 1):
+        """Учесть применение правила в скомпилированном правиле (current_uses)"""
+        state = self._state
+        if state is not None:
+            rule = state.by_id.get(rule_id)
+            if rule is not None:
+                rule.current_uses = (rule.current_uses or 0) + count
+
+    def _current_state(self, db: Session) -> _IndexState:
+        state = self._state
+        now = datetime.now()
+        if state is not None and not self._is_stale(state, now):
+            return state
+
+        with self._lock:
+            state = self._state
+            if state is None or time.monotonic() - state.loaded_at >= self._ttl_seconds:
+                state = self._build(self._load_rules(db), now, time.monotonic())
+            elif state.next_boundary is not None and now >= state.next_boundary:
+                # Граница действия правила: пересчитываем из памяти
+                state = self._build(state.rules, now, state.loaded_at)
+            self._state = state
+            return state
+
+    def _is_stale(self, state: _IndexState, now: datetime) -> bool:
+        if state.next_boundary is not None and now >= state.next_boundary:
+            return True
+        return time.monotonic() - state.loaded_at >= self._ttl_seconds
+
+    def _build(self, rules: List[CompiledRule], now: datetime, loaded_at: float) -> _IndexState:
+        self._version += 1
+        return _IndexState(rules, now, self._version, loaded_at)
+
+    @staticmethod
+    def _load_rules(db: Session) -> List[CompiledRule]:
+        """Загрузка всех активных и ещё не истёкших правил (включая будущие)"""
+        now = datetime.now()
+        rules = db.query(DiscountRule).filter(
+            DiscountRule.status == DiscountRuleStatus.ACTIVE,
+            or_(
+                DiscountRule.valid_until.is_(None),
+                DiscountRule.valid_until >= now
+            )
+        ).all()
+        return [compile_rule(rule) for rule in rules]
+
+
+rule_index = DiscountRuleIndex(ttl_seconds=settings.DISCOUNT_RULES_CACHE_TTL)
@@ -1,12 +1,47 @@
 from sqlalchemy.orm import Session
-from sqlalchemy import and_, or_
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy import or_, update, exists, select
 from datetime import datetime
 from decimal import Decimal
-from typing import List, Dict, Any
-from app.models.discount import DiscountRule, DiscountApplication, DiscountType, DiscountRuleStatus
-from app.models.customer import Customer, CustomerStatus
-from app.schemas.discount import DiscountCalculationRequest, DiscountCalculationResponse
+from typing import List, Dict, FrozenSet, Optional
+import secrets
+from app.core.cache import TTLCache
+from app.core.config import settings
+from app.core.metrics import timed
+from app.core.security import create_signed_token, verify_signed_token
+from app.models.discount import DiscountRule, DiscountApplication, DiscountRuleStatus, DiscountUsageCounter, DiscountRuleStore
+from app.models.customer import Customer
+from app.schemas.discount import DiscountCalculationRequest, DiscountCalculationResponse, DiscountBatchQuoteResult
 from app.services.bonus_service import BonusService
+from app.services.basket_service import BasketService
+from app.services.discount_rule_index import rule_index
+from app.services.discount_compiler import CompiledRule, QuoteContext
+from app.services.discount_quota import rule_quota
+from app.services.segment_index import segment_index, EMPTY_SEGMENTS
+
+# Размер пачки идентификаторов в IN (...) — укладываемся в лимит параметров SQLite
+BATCH_CHUNK_SIZE = 500
+
+
+class _IssuedQuote:
+    """Выданная котировка и состояние, при котором она была рассчитана"""
+    __slots__ = ("request", "rules_version", "total_visits", "segments", "response")
+
+    def __init__(self, request, rules_version, total_visits, segments, response):
+        self.request = request
+        self.rules_version = rules_version
+        self.total_visits = total_visits
+        self.segments = segments
+        self.response = response
+
+
+# Котировки по токенам: id котировки -> _IssuedQuote
+quote_cache = TTLCache(maxsize=settings.QUOTE_CACHE_SIZE, ttl_seconds=settings.QUOTE_TOKEN_TTL)
+
+
+def _chunks(items: list, size: int):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
 
 
 class DiscountService:
@@ -14,12 +49,38 @@ class DiscountService:
     def create_rule(db: Session, rule_data: dict) -> DiscountRule:
         rule = DiscountRule(**rule_data)
         db.add(rule)
+        db.flush()
+        DiscountService._sync_rule_stores(db, rule)
+        db.commit()
+        db.refresh(rule)
+        rule_index.invalidate()
+        return rule
+
+    @staticmethod
+    def update_rule(db: Session, rule_id: int, rule_data: dict) -> DiscountRule:
+        rule = db.query(DiscountRule).filter(DiscountRule.id == rule_id).first()
+        if not rule:
+            return None
+        
+        for key, value in rule_data.items():
+            setattr(rule, key, value)
+        
+        if "applicable_stores" in rule_data:
+            DiscountService._sync_rule_stores(db, rule)
+        
         db.commit()
         db.refresh(rule)
+        rule_index.invalidate()
         return rule
 
     @staticmethod
-    def get_active_rules(db: Session, store_id: int = None) -> List[DiscountRule]:
+    def get_active_rules(db: Session, store_id: int = None) -> List[CompiledRule]:
+        """Действующие правила из процессного индекса (без запроса к БД на горячем пути)"""
+        return rule_index.get_rules(db, store_id)
+
+    @staticmethod
+    def query_active_rules(db: Session, store_id: int = None) -> List[DiscountRule]:
+        """Действующие правила напрямую из БД, в обход индекса"""
         query = db.query(DiscountRule).filter(DiscountRule.status == DiscountRuleStatus.ACTIVE)
         
         now = datetime.now()
@@ -36,16 +97,34 @@ class DiscountService:
         )
         
         if store_id:
-            query = query.filter(
-                or_(
-                    DiscountRule.applicable_stores.is_(None),
-                    DiscountRule.applicable_stores.contains([store_id])
-                )
-            )
+            query = query.filter(DiscountService.store_filter(store_id))
         
         return query.all()
 
     @staticmethod
+    def store_filter(store_id: int):
+        """
+        Условие «правило действует в магазине» по таблице discount_rule_stores:
+        правило привязано к магазину либо не привязано ни к одному (действует везде)
+        """
+        return or_(
+            DiscountRule.id.in_(
+                select(DiscountRuleStore.discount_rule_id).where(DiscountRuleStore.store_id == store_id)
+            ),
+            ~exists().where(DiscountRuleStore.discount_rule_id == DiscountRule.id)
+        )
+
+    @staticmethod
+    def _sync_rule_stores(db: Session, rule: DiscountRule):
+        """Привести discount_rule_stores в соответствие с applicable_stores правила"""
+        db.query(DiscountRuleStore).filter(
+            DiscountRuleStore.discount_rule_id == rule.id
+        ).delete(synchronize_session=False)
+        for store_id in set(rule.applicable_stores or []):
+            db.add(DiscountRuleStore(discount_rule_id=rule.id, store_id=store_id))
+
+    @staticmethod
+    @timed("DiscountService.calculate_discounts")
     def calculate_discounts(
         db: Session,
         request: DiscountCalculationRequest
@@ -55,14 +134,153 @@ class DiscountService:
             raise ValueError("Клиент не найден")
         
         active_rules = DiscountService.get_active_rules(db, request.store_id)
+        usage_counts = {}
+        if any(rule.max_uses_per_customer for rule in active_rules):
+            usage_counts = DiscountService.get_usage_counts(db, customer.id)
+        
+        category_map = {}
+        if request.items:
+            category_map = rule_index.get_category_map(db, request.store_id)
+        
+        segments = segment_index.get(db, customer.id)
+        
+        response = DiscountService._quote(active_rules, customer, request, usage_counts, category_map, segments)
+        response.quote_token = DiscountService._issue_quote_token(request, customer, segments, response)
+        return response
+
+    @staticmethod
+    @timed("DiscountService.redeem_quote")
+    def redeem_quote(
+        db: Session,
+        quote_token: str,
+        request: DiscountCalculationRequest
+    ) -> Optional[DiscountCalculationResponse]:
+        """
+        Котировка по токену из calculate_discounts. None — токен недействителен,
+        либо с момента расчёта изменились запрос, набор правил или состояние
+        клиента (визиты, сегменты); тогда скидки нужно пересчитать.
+        """
+        quote_id = verify_signed_token(quote_token)
+        if quote_id is None:
+            return None
+        quote = quote_cache.pop(quote_id)  # токен одноразовый
+        if quote is None:
+            return None
+        
+        issued = quote.request
+        if (issued.customer_id, issued.store_id, issued.amount, issued.items) != (
+            request.customer_id, request.store_id, request.amount, request.items
+        ):
+            return None
+        
+        # Индекс перестраивается при чтении, если правила изменились или истёк TTL
+        rule_index.get_rules(db, request.store_id)
+        if rule_index.version != quote.rules_version:
+            return None
+        
+        customer = db.get(Customer, request.customer_id)
+        if customer is None or customer.total_visits != quote.total_visits:
+            return None
+        if segment_index.get(db, customer.id) != quote.segments:
+            return None
+        
+        return quote.response
+
+    @staticmethod
+    def _issue_quote_token(
+        request: DiscountCalculationRequest,
+        customer: Customer,
+        segments: FrozenSet[str],
+        response: DiscountCalculationResponse
+    ) -> str:
+        quote_id = secrets.token_urlsafe(16)
+        quote_cache.set(quote_id, _IssuedQuote(
+            request, rule_index.version, customer.total_visits, segments, response
+        ))
+        return create_signed_token(quote_id, settings.QUOTE_TOKEN_TTL)
+
+    @staticmethod
+    def calculate_discounts_batch(
+        db: Session,
+        requests: List[DiscountCalculationRequest]
+    ) -> List[DiscountBatchQuoteResult]:
+        """
+        Расчёт скидок для набора котировок.
+        Клиенты, правила и счётчики использования загружаются один раз на весь пакет.
+        """
+        customer_ids = {request.customer_id for request in requests}
+        customers = {}
+        for chunk in _chunks(list(customer_ids), BATCH_CHUNK_SIZE):
+            for row in db.query(Customer.id, Customer.total_visits).filter(Customer.id.in_(chunk)):
+                customers[row.id] = row
+        
+        rules_by_store = {
+            store_id: DiscountService.get_active_rules(db, store_id)
+            for store_id in {request.store_id for request in requests}
+        }
+        
+        category_maps = {
+            store_id: rule_index.get_category_map(db, store_id)
+            for store_id in {request.store_id for request in requests if request.items}
+        }
+        
+        usage_counts = {}
+        if any(rule.max_uses_per_customer for rules in rules_by_store.values() for rule in rules):
+            usage_counts = DiscountService.get_usage_counts_bulk(db, customers.keys())
+        
+        results = []
+        for index, request in enumerate(requests):
+            customer = customers.get(request.customer_id)
+            if customer is None:
+                results.append(DiscountBatchQuoteResult(index=index, error="Клиент не найден"))
+                continue
+            
+            quote = DiscountService._quote(
+                rules_by_store[request.store_id],
+                customer,
+                request,
+                usage_counts.get(customer.id, {}),
+                category_maps.get(request.store_id, {}),
+                segment_index.get(db, customer.id)
+            )
+            results.append(DiscountBatchQuoteResult(index=index, result=quote))
+        
+        return results
+
+    @staticmethod
+    def _quote(
+        active_rules: List[CompiledRule],
+        customer: Customer,
+        request: DiscountCalculationRequest,
+        usage_counts: Dict[int, int],
+        category_map: Dict[str, List[CompiledRule]],
+        segments: FrozenSet[str] = EMPTY_SEGMENTS
+    ) -> DiscountCalculationResponse:
         applicable_discounts = []
         total_discount = Decimal("0")
+        basket_discount = Decimal("0")
+        context = QuoteContext(request.amount, customer.total_visits, usage_counts, segments)
+        
+        # Подытоги корзины по категориям (только если переданы позиции)
+        if request.items:
+            line_totals, subtotals = BasketService.line_totals(request.items)
+            matched = BasketService.matched_subtotals(subtotals, category_map)
+        else:
+            matched = {}
+        rule_discounts = {}
         
         for rule in active_rules:
-            if not DiscountService._is_rule_applicable(db, rule, customer, request):
+            if not rule.is_applicable(context) or not DiscountService._has_total_quota(rule):
                 continue
             
-            discount_amount = DiscountService._calculate_discount_amount(rule, request.amount)
+            if rule.applicable_categories:
+                # Категорийное правило действует только на подходящие позиции корзины
+                if rule.id not in matched:
+                    continue
+                discount_amount = rule.discount_for(matched[rule.id])
+            else:
+                discount_amount = rule.discount_for(request.amount)
+            
             if discount_amount > 0:
                 applicable_discounts.append({
                     "rule_id": rule.id,
@@ -71,6 +289,10 @@ class DiscountService:
                     "discount_amount": float(discount_amount)
                 })
                 total_discount += discount_amount
+                if rule.applicable_categories:
+                    rule_discounts[rule.id] = discount_amount
+                else:
+                    basket_discount += discount_amount
         
         # Ограничение максимальной скидки
         final_amount = request.amount - total_discount
@@ -78,6 +300,12 @@ class DiscountService:
             final_amount = Decimal("0")
             total_discount = request.amount
         
+        line_discounts = None
+        if request.items:
+            line_discounts = BasketService.allocate(
+                request.items, line_totals, category_map, rule_discounts, matched, basket_discount
+            )
+        
         # Расчёт бонусов
         bonuses_earned = BonusService.calculate_bonuses(final_amount)
         
@@ -85,68 +313,109 @@ class DiscountService:
             applicable_discounts=applicable_discounts,
             total_discount=total_discount,
             final_amount=final_amount,
-            bonuses_earned=bonuses_earned
+            bonuses_earned=bonuses_earned,
+            line_discounts=line_discounts
         )
 
     @staticmethod
-    def _is_rule_applicable(db: Session, rule: DiscountRule, customer: Customer, request: DiscountCalculationRequest) -> bool:
-        # Проверка минимальной суммы покупки
-        if rule.min_purchase_amount and request.amount < rule.min_purchase_amount:
-            return False
-        
-        # Проверка для новых клиентов
-        if rule.is_new_customer_only and customer.total_visits > 1:
-            return False
-        
-        # Проверка минимального количества визитов
-        if rule.min_visits_required and customer.total_visits < rule.min_visits_required:
-            return False
-        
-        # Проверка максимального использования на клиента
-        if rule.max_uses_per_customer:
-            uses_count = db.query(DiscountApplication).filter(
-                and_(
-                    DiscountApplication.discount_rule_id == rule.id,
-                    DiscountApplication.customer_id == customer.id
-                )
-            ).count()
-            if uses_count >= rule.max_uses_per_customer:
-                return False
-        
-        # Проверка максимального общего использования
-        if rule.max_total_uses and rule.current_uses >= rule.max_total_uses:
-            return False
-        
-        return True
+    def get_usage_counts(db: Session, customer_id: int) -> Dict[int, int]:
+        """Все счётчики использования правил клиентом за один запрос"""
+        rows = db.query(DiscountUsageCounter.discount_rule_id, DiscountUsageCounter.uses_count).filter(
+            DiscountUsageCounter.customer_id == customer_id
+        ).all()
+        return {rule_id: uses_count for rule_id, uses_count in rows}
 
     @staticmethod
-    def _calculate_discount_amount(rule: DiscountRule, purchase_amount: Decimal) -> Decimal:
-        if rule.discount_type == DiscountType.PERCENTAGE:
-            discount = purchase_amount * (rule.value / Decimal("100"))
-        elif rule.discount_type == DiscountType.FIXED_AMOUNT:
-            discount = rule.value
-        else:
-            discount = Decimal("0")
+    def get_usage_counts_bulk(db: Session, customer_ids) -> Dict[int, Dict[int, int]]:
+        """Счётчики использования правил для набора клиентов: {customer_id: {rule_id: uses}}"""
+        usage_counts = {}
+        for chunk in _chunks(list(customer_ids), BATCH_CHUNK_SIZE):
+            rows = db.query(
+                DiscountUsageCounter.customer_id,
+                DiscountUsageCounter.discount_rule_id,
+                DiscountUsageCounter.uses_count
+            ).filter(DiscountUsageCounter.customer_id.in_(chunk))
+            for customer_id, rule_id, uses_count in rows:
+                usage_counts.setdefault(customer_id, {})[rule_id] = uses_count
+        return usage_counts
+
+    @staticmethod
+    def _has_total_quota(rule: CompiledRule) -> bool:
+        """Проверка максимального общего использования"""
+        if not rule.max_total_uses:
+            return True
+        return rule.current_uses < rule.max_total_uses or rule_quota.has_local_quota(rule.id)
+
+    @staticmethod
+    @timed("DiscountService.reserve_discounts")
+    def reserve_discounts(
+        db: Session,
+        request: DiscountCalculationRequest,
+        result: DiscountCalculationResponse
+    ) -> DiscountCalculationResponse:
+        """
+        Занять использования правил из расчёта перед проведением покупки.
+        Скидки, чей общий лимит исчерпан, убираются, итог пересчитывается.
+        """
+        reserved = [
+            discount_info for discount_info in result.applicable_discounts
+            if rule_quota.acquire(db, discount_info["rule_id"])
+        ]
+        if len(reserved) == len(result.applicable_discounts):
+            return result
         
-        # Ограничение максимальной скидки
-        if rule.max_discount_amount and discount > rule.max_discount_amount:
-            discount = rule.max_discount_amount
+        # В applicable_discounts суммы float: возвращаем их к копейкам в Decimal
+        amounts = {
+            d["rule_id"]: Decimal(str(d["discount_amount"])).quantize(Decimal("0.01")) for d in reserved
+        }
+        total_discount = sum(amounts.values(), Decimal("0"))
+        final_amount = request.amount - total_discount
+        if final_amount < 0:
+            final_amount = Decimal("0")
+            total_discount = request.amount
         
-        # Скидка не может быть больше суммы покупки
-        if discount > purchase_amount:
-            discount = purchase_amount
+        # Скидки по позициям распределяются заново только по занятым правилам
+        line_discounts = None
+        if request.items:
+            line_totals, subtotals = BasketService.line_totals(request.items)
+            category_map = rule_index.get_category_map(db, request.store_id)
+            matched = BasketService.matched_subtotals(subtotals, category_map)
+            rule_discounts = {rule_id: amount for rule_id, amount in amounts.items() if rule_id in matched}
+            basket_discount = sum(
+                (amount for rule_id, amount in amounts.items() if rule_id not in matched), Decimal("0")
+            )
+            line_discounts = BasketService.allocate(
+                request.items, line_totals, category_map, rule_discounts, matched, basket_discount
+            )
         
-        return discount.quantize(Decimal("0.01"))
+        return DiscountCalculationResponse(
+            applicable_discounts=reserved,
+            total_discount=total_discount,
+            final_amount=final_amount,
+            bonuses_earned=BonusService.calculate_bonuses(final_amount),
+            line_discounts=line_discounts
+        )
 
     @staticmethod
+    @timed("DiscountService.apply_discount")
     def apply_discount(
         db: Session,
         discount_rule_id: int,
         purchase_id: int,
         customer_id: int,
         original_amount: Decimal,
-        discount_amount: Decimal
+        discount_amount: Decimal,
+        reserved: bool = False,
+        commit: bool = True
     ) -> DiscountApplication:
+        """
+        Запись применения скидки.
+        reserved=True — использование уже занято через reserve_discounts.
+        commit=False — только flush, фиксирует транзакцию вызывающий код.
+        """
+        if not reserved and not rule_quota.acquire(db, discount_rule_id):
+            raise ValueError("Лимит использования скидки исчерпан")
+        
         application = DiscountApplication(
             discount_rule_id=discount_rule_id,
             purchase_id=purchase_id,
@@ -156,13 +425,39 @@ class DiscountService:
             final_amount=original_amount - discount_amount
         )
         
-        # Обновляем счётчик использования
-        rule = db.query(DiscountRule).filter(DiscountRule.id == discount_rule_id).first()
-        if rule:
-            rule.current_uses += 1
+        DiscountService._increment_usage_counter(db, customer_id, discount_rule_id)
         
         db.add(application)
-        db.commit()
-        db.refresh(application)
+        if commit:
+            db.commit()
+            db.refresh(application)
+        else:
+            db.flush()
         return application
 
+
+    @staticmethod
+    def _increment_usage_counter(db: Session, customer_id: int, discount_rule_id: int, count: int = 1):
+        """Атомарно увеличить счётчик (customer_id, discount_rule_id), создав его при необходимости"""
+        result = db.execute(
+            update(DiscountUsageCounter)
+            .where(
+                DiscountUsageCounter.customer_id == customer_id,
+                DiscountUsageCounter.discount_rule_id == discount_rule_id
+            )
+            .values(uses_count=DiscountUsageCounter.uses_count + count, last_used_at=datetime.now())
+            .execution_options(synchronize_session=False)
+        )
+        if result.rowcount:
+            return
+        
+        try:
+            with db.begin_nested():
+                db.add(DiscountUsageCounter(
+                    customer_id=customer_id,
+                    discount_rule_id=discount_rule_id,
+                    uses_count=count
+                ))
+        except IntegrityError:
+            # Счётчик успели создать параллельно — повторяем инкремент
+            DiscountService._increment_usage_counter(db, customer_id, discount_rule_id, count)
@@ -0,0 +1,378 @@
+from sqlalchemy.orm import Session
+from sqlalchemy import insert, update, bindparam, case, or_, DateTime, Numeric, Integer
+from pydantic import ValidationError
+from datetime import datetime
+from decimal import Decimal
+from typing import Dict, List, Optional, Tuple
+from app.models.customer import Customer, PurchaseHistory
+from app.models.bonus import BonusBalance, BonusTransaction, BonusTransactionType
+from app.models.discount import DiscountApplication
+from app.models.cashier import Cashier
+from app.schemas.customer import PurchaseIngestItem, PurchaseIngestResult
+from app.schemas.discount import DiscountCalculationRequest
+from app.services.discount_service import DiscountService, BATCH_CHUNK_SIZE, _chunks
+from app.services.discount_rule_index import rule_index
+from app.services.discount_quota import rule_quota
+from app.services.segment_index import segment_index
+from app.services.balance_cache import balance_cache
+from app.services.bonus_service import BonusService
+from app.services.customer_service import CustomerService
+
+
+class _IngestCustomer:
+    """Состояние клиента внутри пакета: визиты для правил и накопленные изменения"""
+    __slots__ = ("id", "total_visits", "purchases_delta", "visits_delta", "last_visit")
+
+    def __init__(self, customer_id: int, total_visits: int):
+        self.id = customer_id
+        self.total_visits = total_visits or 0
+        self.purchases_delta = Decimal("0")
+        self.visits_delta = 0
+        self.last_visit: Optional[datetime] = None
+
+
+class _IngestBalance:
+    """Бонусный баланс клиента внутри пакета"""
+    __slots__ = ("id", "customer_id", "current_balance", "earned", "spent")
+
+    def __init__(self, balance_id: Optional[int], customer_id: int, current_balance: Decimal):
+        self.id = balance_id  # None — баланс ещё не создан в БД
+        self.customer_id = customer_id
+        self.current_balance = current_balance or Decimal("0")
+        self.earned = Decimal("0")
+        self.spent = Decimal("0")
+
+
+class _IngestReceipt:
+    """Проведённый в памяти чек: строка покупки и зависящие от неё записи"""
+    __slots__ = ("line", "item", "purchase", "applications", "transactions")
+
+    def __init__(self, line: int, item: PurchaseIngestItem, purchase: dict):
+        self.line = line
+        self.item = item
+        self.purchase = purchase
+        self.applications: List[dict] = []
+        self.transactions: List[Tuple[_IngestBalance, dict]] = []
+
+
+class IngestService:
+    """
+    Пакетная загрузка чеков офлайн-смен.
+
+    Каждый пакет проводится в одной транзакции: клиенты, балансы и счётчики
+    загружаются одним запросом на пакет, чеки считаются в памяти по порядку
+    (визиты, лимиты и баланс учитывают предыдущие чеки пакета), затем строки
+    PurchaseHistory, DiscountApplication и BonusTransaction вставляются
+    пачками, а итоги клиентов и балансов обновляются приращениями.
+    """
+
+    @staticmethod
+    def ingest_chunk(db: Session, lines: List[Tuple[int, bytes]], cashier: Cashier) -> List[PurchaseIngestResult]:
+        """Провести пакет строк NDJSON: [(номер строки, строка)] → результат по каждой строке"""
+        results: Dict[int, PurchaseIngestResult] = {}
+        receipts = []
+        for line, raw in lines:
+            try:
+                item = PurchaseIngestItem.model_validate_json(raw)
+            except ValidationError as e:
+                results[line] = PurchaseIngestResult(line=line, status="error", error=str(e))
+                continue
+
+            if not cashier.is_superuser and item.store_id != cashier.store_id:
+                results[line] = PurchaseIngestResult(
+                    line=line, receipt_number=item.receipt_number, status="error",
+                    error="You can only process purchases for your store"
+                )
+                continue
+            receipts.append((line, item))
+
+        receipts = IngestService._skip_duplicates(db, receipts, results)
+
+        acquired: List[int] = []
+        try:
+            IngestService._process(db, receipts, results, acquired)
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            # Возвращаем занятые использования правил с общим лимитом
+            for rule_id in acquired:
+                rule_quota.release(rule_id)
+            for line, item in receipts:
+                results[line] = PurchaseIngestResult(
+                    line=line, receipt_number=item.receipt_number, status="error",
+                    error=f"Пакет не проведён: {e}"
+                )
+
+        return [results[line] for line, _ in lines]
+
+    @staticmethod
+    def _skip_duplicates(
+        db: Session,
+        receipts: List[Tuple[int, PurchaseIngestItem]],
+        results: Dict[int, PurchaseIngestResult]
+    ) -> List[Tuple[int, PurchaseIngestItem]]:
+        """Отсеять чеки, уже проведённые ранее или повторённые в пакете"""
+        keys = {(item.store_id, item.receipt_number) for _, item in receipts if item.receipt_number}
+        existing = {}
+        if keys:
+            store_ids = list({store_id for store_id, _ in keys})
+            for chunk in _chunks(list({number for _, number in keys}), BATCH_CHUNK_SIZE):
+                rows = db.query(
+                    PurchaseHistory.id, PurchaseHistory.store_id, PurchaseHistory.receipt_number
+                ).filter(
+                    PurchaseHistory.store_id.in_(store_ids),
+                    PurchaseHistory.receipt_number.in_(chunk)
+                )
+                for purchase_id, store_id, receipt_number in rows:
+                    existing[(store_id, receipt_number)] = purchase_id
+
+        fresh = []
+        seen = set()
+        for line, item in receipts:
+            key = (item.store_id, item.receipt_number)
+            if item.receipt_number and (key in existing or key in seen):
+                results[line] = PurchaseIngestResult(
+                    line=line, receipt_number=item.receipt_number, status="duplicate",
+                    purchase_id=existing.get(key)
+                )
+                continue
+            seen.add(key)
+            fresh.append((line, item))
+        return fresh
+
+    @staticmethod
+    def _process(
+        db: Session,
+        receipts: List[Tuple[int, PurchaseIngestItem]],
+        results: Dict[int, PurchaseIngestResult],
+        acquired: List[int]
+    ):
+        if not receipts:
+            return
+
+        customer_ids = list({item.customer_id for _, item in receipts})
+        customers: Dict[int, _IngestCustomer] = {}
+        balances: Dict[int, _IngestBalance] = {}
+        for chunk in _chunks(customer_ids, BATCH_CHUNK_SIZE):
+            for row in db.query(Customer.id, Customer.total_visits).filter(Customer.id.in_(chunk)):
+                customers[row.id] = _IngestCustomer(row.id, row.total_visits)
+            # Балансы блокируются до конца пакета, чтобы списания не разошлись с кассами
+            for row in db.query(
+                BonusBalance.id, BonusBalance.customer_id, BonusBalance.current_balance
+            ).filter(BonusBalance.customer_id.in_(chunk)).with_for_update():
+                balances[row.customer_id] = _IngestBalance(row.id, row.customer_id, row.current_balance)
+
+        rules_by_store = {
+            store_id: rule_index.get_rules(db, store_id)
+            for store_id in {item.store_id for _, item in receipts}
+        }
+        usage_counts = {}
+        if any(rule.max_uses_per_customer for rules in rules_by_store.values() for rule in rules):
+            usage_counts = DiscountService.get_usage_counts_bulk(db, customers.keys())
+        usage_deltas: Dict[Tuple[int, int], int] = {}
+
+        now = datetime.now()
+        processed: List[_IngestReceipt] = []
+        for line, item in receipts:
+            customer = customers.get(item.customer_id)
+            if customer is None:
+                results[line] = PurchaseIngestResult(
+                    line=line, receipt_number=item.receipt_number, status="error", error="Клиент не найден"
+                )
+                continue
+            purchase_date = item.purchase_date or now
+
+            # 1. Скидки по правилам магазина с учётом предыдущих чеков пакета
+            request = DiscountCalculationRequest.model_construct(
+                customer_id=item.customer_id, store_id=item.store_id, amount=item.amount, items=None
+            )
+            customer_usage = usage_counts.setdefault(customer.id, {})
+            discount_result = DiscountService._quote(
+                rules_by_store[item.store_id], customer, request, customer_usage, {},
+                segment_index.get(db, customer.id)
+            )
+            discount_result = DiscountService.reserve_discounts(db, request, discount_result)
+
+            # 2. Бонусы: как и на кассе, при нехватке чек проводится без них
+            balance = balances.get(customer.id)
+            final_amount = discount_result.final_amount
+            bonuses_used = Decimal("0")
+            receipt = _IngestReceipt(line, item, {
+                "customer_id": item.customer_id,
+                "store_id": item.store_id,
+                "purchase_date": purchase_date,
+                "items_count": item.items_count,
+                "payment_method": item.payment_method,
+                "receipt_number": item.receipt_number,
+                "discount_applied": discount_result.total_discount,
+                "bonuses_earned": discount_result.bonuses_earned,
+            })
+
+            if item.bonuses_to_use > 0 and balance is not None and balance.current_balance >= item.bonuses_to_use:
+                bonuses_used = item.bonuses_to_use
+                final_amount = max(Decimal("0"), final_amount - bonuses_used)
+                receipt.transactions.append((balance, IngestService._transaction(
+                    balance, BonusTransactionType.SPENT, bonuses_used, purchase_date,
+                    f"Использовано при покупке на сумму {item.amount}"
+                )))
+
+            if discount_result.bonuses_earned > 0:
+                if balance is None:
+                    balance = _IngestBalance(None, customer.id, Decimal("0"))
+                    balances[customer.id] = balance
+                receipt.transactions.append((balance, IngestService._transaction(
+                    balance, BonusTransactionType.EARNED, discount_result.bonuses_earned, purchase_date, None
+                )))
+
+            receipt.purchase["amount"] = final_amount
+            receipt.purchase["bonuses_used"] = bonuses_used
+
+            for discount_info in discount_result.applicable_discounts:
+                rule_id = discount_info["rule_id"]
+                acquired.append(rule_id)
+                discount_amount = Decimal(str(discount_info["discount_amount"]))
+                receipt.applications.append({
+                    "discount_rule_id": rule_id,
+                    "customer_id": customer.id,
+                    "applied_at": purchase_date,
+                    "original_amount": item.amount,
+                    "discount_amount": discount_amount,
+                    "final_amount": item.amount - discount_amount,
+                })
+                customer_usage[rule_id] = customer_usage.get(rule_id, 0) + 1
+                usage_deltas[(customer.id, rule_id)] = usage_deltas.get((customer.id, rule_id), 0) + 1
+
+            # 3. Статистика клиента (как в CustomerService.create_purchase)
+            customer.total_visits += 1
+            customer.visits_delta += 1
+            customer.purchases_delta += item.amount
+            if customer.last_visit is None or purchase_date > customer.last_visit:
+                customer.last_visit = purchase_date
+            processed.append(receipt)
+
+        if not processed:
+            return
+
+        IngestService._write(db, processed, customers, balances, usage_deltas, now)
+        for receipt in processed:
+            results[receipt.line] = PurchaseIngestResult(
+                line=receipt.line, receipt_number=receipt.item.receipt_number,
+                status="created", purchase_id=receipt.purchase["id"]
+            )
+
+    @staticmethod
+    def _transaction(
+        balance: _IngestBalance,
+        transaction_type: BonusTransactionType,
+        amount: Decimal,
+        transaction_date: datetime,
+        description: Optional[str]
+    ) -> dict:
+        balance_before = balance.current_balance
+        if transaction_type == BonusTransactionType.SPENT:
+            balance.current_balance -= amount
+            balance.spent += amount
+        else:
+            balance.current_balance += amount
+            balance.earned += amount
+        return {
+            "customer_id": balance.customer_id,
+            "transaction_type": transaction_type,
+            "amount": amount,
+            "balance_before": balance_before,
+            "balance_after": balance.current_balance,
+            "transaction_date": transaction_date,
+            "description": description,
+        }
+
+    @staticmethod
+    def _write(
+        db: Session,
+        processed: List[_IngestReceipt],
+        customers: Dict[int, _IngestCustomer],
+        balances: Dict[int, _IngestBalance],
+        usage_deltas: Dict[Tuple[int, int], int],
+        now: datetime
+    ):
+        """Пакетная запись проведённых чеков"""
+        # Новые балансы (нужны их id для транзакций)
+        new_balances = [balance for balance in balances.values() if balance.id is None]
+        if new_balances:
+            rows = db.execute(
+                insert(BonusBalance).returning(BonusBalance.id, sort_by_parameter_order=True),
+                [{"customer_id": balance.customer_id, "current_balance": Decimal("0"),
+                  "total_earned": Decimal("0"), "total_spent": Decimal("0")} for balance in new_balances]
+            ).scalars().all()
+            for balance, balance_id in zip(new_balances, rows):
+                balance.id = balance_id
+
+        purchase_ids = db.execute(
+            insert(PurchaseHistory).returning(PurchaseHistory.id, sort_by_parameter_order=True),
+            [receipt.purchase for receipt in processed]
+        ).scalars().all()
+
+        applications = []
+        transactions = []
+        for receipt, purchase_id in zip(processed, purchase_ids):
+            receipt.purchase["id"] = purchase_id
+            for application in receipt.applications:
+                application["purchase_id"] = purchase_id
+                applications.append(application)
+            for balance, transaction in receipt.transactions:
+                transaction["balance_id"] = balance.id
+                transaction["purchase_id"] = purchase_id
+                if transaction["description"] is None:
+                    transaction["description"] = f"Начислено за покупку #{purchase_id}"
+                transactions.append(transaction)
+
+        CustomerService.link_stores(
+            db, {(receipt.purchase["store_id"], receipt.purchase["customer_id"]) for receipt in processed}
+        )
+        if applications:
+            db.execute(insert(DiscountApplication), applications)
+        if transactions:
+            db.execute(insert(BonusTransaction), transactions)
+
+        # Итоги клиентов — приращениями, чтобы не затирать параллельные покупки
+        customers_table = Customer.__table__
+        last_visit = bindparam("b_last_visit", type_=DateTime)
+        db.execute(
+            update(customers_table)
+            .where(customers_table.c.id == bindparam("b_id"))
+            .values(
+                total_purchases=customers_table.c.total_purchases + bindparam("b_purchases", type_=Numeric(10, 2)),
+                total_visits=customers_table.c.total_visits + bindparam("b_visits", type_=Integer),
+                last_visit=case(
+                    (or_(customers_table.c.last_visit.is_(None), customers_table.c.last_visit < last_visit), last_visit),
+                    else_=customers_table.c.last_visit
+                )
+            ),
+            [
+                {"b_id": customer.id, "b_purchases": customer.purchases_delta,
+                 "b_visits": customer.visits_delta, "b_last_visit": customer.last_visit}
+                for customer in customers.values() if customer.visits_delta
+            ]
+        )
+
+        changed_balances = [balance for balance in balances.values() if balance.earned or balance.spent]
+        if changed_balances:
+            balances_table = BonusBalance.__table__
+            balance_cache.mark_pending(balance.customer_id for balance in changed_balances)
+            db.execute(
+                update(balances_table)
+                .where(balances_table.c.id == bindparam("b_id"))
+                .values(
+                    current_balance=balances_table.c.current_balance
+                    + bindparam("b_earned", type_=Numeric(10, 2)) - bindparam("b_spent", type_=Numeric(10, 2)),
+                    total_earned=balances_table.c.total_earned + bindparam("b_earned", type_=Numeric(10, 2)),
+                    total_spent=balances_table.c.total_spent + bindparam("b_spent", type_=Numeric(10, 2)),
+                    last_updated=now,
+                    version=balances_table.c.version + 1
+                ),
+                [{"b_id": balance.id, "b_earned": balance.earned, "b_spent": balance.spent}
+                 for balance in changed_balances]
+            )
+            BonusService.stage_cached_balances(db, (balance.id for balance in changed_balances))
+
+        for (customer_id, rule_id), count in usage_deltas.items():
+            DiscountService._increment_usage_counter(db, customer_id, rule_id, count)
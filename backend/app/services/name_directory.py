@@ -0,0 +1,81 @@
+import threading
+import time
+from typing import Dict, Iterable, Optional
+from sqlalchemy.orm import Session
+from app.core.config import settings
+from app.models.cashier import Cashier
+from app.models.store import Store
+
+
+class NameDirectory:
+    """
+    Процессный справочник id → имя для небольших редко меняющихся таблиц
+    (магазины, кассиры), чтобы страницы истории не делали запрос на строку.
+
+    Загружается целиком одним запросом, сбрасывается при изменении записей
+    через сервисы и перечитывается по истечении NAME_DIRECTORY_TTL, чтобы
+    другие воркеры подхватывали изменения. Запрос id, которого нет в
+    справочнике (запись создана в другом воркере), перечитывает его, но не
+    чаще раза в miss_reload_seconds: id удалённых записей не вызывают
+    перечитывания на каждый запрос.
+    """
+
+    def __init__(self, id_column, name_column, ttl_seconds: int, miss_reload_seconds: int):
+        self._id_column = id_column
+        self._name_column = name_column
+        self._ttl_seconds = ttl_seconds
+        self._miss_reload_seconds = miss_reload_seconds
+        self._lock = threading.Lock()
+        self._names: Optional[Dict[int, str]] = None
+        self._loaded_at = 0.0
+
+    def get(self, db: Session, item_id: int) -> Optional[str]:
+        return self.get_many(db, [item_id]).get(item_id)
+
+    def get_many(self, db: Session, item_ids: Iterable[int]) -> Dict[int, str]:
+        item_ids = set(item_ids)
+        names = self._current(db)
+        if not item_ids <= names.keys() and time.monotonic() - self._loaded_at >= self._miss_reload_seconds:
+            names = self._reload_on_miss(db, item_ids)
+        return {item_id: names[item_id] for item_id in item_ids if item_id in names}
+
+    def peek(self, item_id: int) -> Optional[str]:
+        """Имя из уже загруженного справочника, без обращения к БД"""
+        names = self._names
+        return names.get(item_id) if names is not None else None
+
+    def invalidate(self):
+        with self._lock:
+            self._names = None
+
+    def _current(self, db: Session) -> Dict[int, str]:
+        names = self._names
+        if names is not None and time.monotonic() - self._loaded_at < self._ttl_seconds:
+            return names
+
+        with self._lock:
+            if self._names is None or time.monotonic() - self._loaded_at >= self._ttl_seconds:
+                self._reload(db)
+            return self._names
+
+    def _reload_on_miss(self, db: Session, item_ids: set) -> Dict[int, str]:
+        with self._lock:
+            # Другой поток мог уже перечитать справочник, пока мы ждали блокировку
+            names = self._names
+            if names is None or (
+                not item_ids <= names.keys() and time.monotonic() - self._loaded_at >= self._miss_reload_seconds
+            ):
+                self._reload(db)
+            return self._names
+
+    def _reload(self, db: Session):
+        self._names = dict(db.query(self._id_column, self._name_column).all())
+        self._loaded_at = time.monotonic()
+
+
+store_names = NameDirectory(
+    Store.id, Store.name, settings.NAME_DIRECTORY_TTL, settings.NAME_DIRECTORY_MISS_RELOAD_INTERVAL
+)
+cashier_names = NameDirectory(
+    Cashier.id, Cashier.full_name, settings.NAME_DIRECTORY_TTL, settings.NAME_DIRECTORY_MISS_RELOAD_INTERVAL
+)
@@ -0,0 +1,119 @@
+import logging
+import queue
+import threading
+from typing import Iterable, List, Optional
+from sqlalchemy.orm import Session
+from app.core.config import settings
+from app.core.database import SessionLocal
+from app.models.notification import Notification, NotificationStatus
+from app.services.notification_service import NotificationService
+
+logger = logging.getLogger(__name__)
+
+
+class NotificationDispatcher:
+    """
+    Отправка уведомлений из outbox (notifications с outbox=True и статусом
+    PENDING) пулом фоновых потоков. Черновики из POST /api/notifications/ тоже
+    PENDING, но отправляются только через /send — их диспетчер не трогает.
+
+    Запрос лишь записывает уведомление в своей транзакции и после commit
+    передаёт id в очередь (enqueue) — отправка идёт без ожидания со стороны
+    кассы. Кроме того, потоки раз в NOTIFICATION_POLL_INTERVAL забирают
+    оставшиеся записи outbox (после перезапуска или от других процессов).
+    Строки захватываются SELECT ... FOR UPDATE SKIP LOCKED, поэтому несколько
+    процессов не отправляют одно уведомление дважды.
+    """
+
+    def __init__(self, workers: int, poll_interval: float, batch_size: int):
+        self._workers = workers
+        self._poll_interval = poll_interval
+        self._batch_size = batch_size
+        self._queue: "queue.Queue[Optional[int]]" = queue.Queue()
+        self._stop = threading.Event()
+        self._threads: List[threading.Thread] = []
+        self._lock = threading.Lock()
+        self._in_flight = set()
+
+    @property
+    def running(self) -> bool:
+        return bool(self._threads)
+
+    def start(self):
+        if self._threads or self._workers <= 0:
+            return
+        self._stop.clear()
+        for index in range(self._workers):
+            thread = threading.Thread(
+                target=self._run, name=f"notification-dispatcher-{index}", daemon=True
+            )
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, timeout: float = 5.0):
+        self._stop.set()
+        for _ in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def enqueue(self, notification_id: int):
+        """Передать уведомление на отправку (вызывать после commit)"""
+        if self._threads:
+            self._queue.put(notification_id)
+
+    def drain(self, db: Session, notification_ids: Iterable[int] = None) -> int:
+        """Отправить PENDING-уведомления outbox (указанные или очередную пачку); число отправленных"""
+        query = db.query(Notification).filter(
+            Notification.outbox.is_(True), Notification.status == NotificationStatus.PENDING
+        )
+        if notification_ids is not None:
+            query = query.filter(Notification.id.in_(list(notification_ids)))
+        notifications = query.order_by(Notification.id).limit(self._batch_size).with_for_update(
+            skip_locked=True
+        ).all()
+
+        # SQLite не блокирует строки: внутри процесса не берём то, что уже отправляется
+        with self._lock:
+            notifications = [n for n in notifications if n.id not in self._in_flight]
+            claimed = {n.id for n in notifications}
+            self._in_flight |= claimed
+        try:
+            for notification in notifications:
+                NotificationService.deliver(notification)
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            with self._lock:
+                self._in_flight -= claimed
+        return len(notifications)
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                notification_id = self._queue.get(timeout=self._poll_interval)
+            except queue.Empty:
+                notification_id = None
+            if self._stop.is_set():
+                break
+
+            db = SessionLocal()
+            try:
+                if notification_id is not None:
+                    self.drain(db, [notification_id])
+                else:
+                    self.drain(db)
+            except Exception:
+                logger.exception("Ошибка отправки уведомлений")
+            finally:
+                db.close()
+
+
+notification_dispatcher = NotificationDispatcher(
+    workers=settings.NOTIFICATION_WORKERS,
+    poll_interval=settings.NOTIFICATION_POLL_INTERVAL,
+    batch_size=settings.NOTIFICATION_BATCH_SIZE
+)
@@ -6,6 +6,7 @@ from app.schemas.notification import NotificationCreate
 import smtplib
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
+from app.core.metrics import timed
 
 
 class NotificationService:
@@ -23,6 +24,13 @@ class NotificationService:
         if not notification:
             return
         
+        NotificationService.deliver(notification)
+        db.commit()
+
+    @staticmethod
+    @timed("NotificationService.deliver")
+    def deliver(notification: Notification):
+        """Отправить уведомление по его каналу и проставить статус (без commit)"""
         try:
             if notification.notification_type == NotificationType.EMAIL:
                 NotificationService._send_email(notification)
@@ -36,8 +44,6 @@ class NotificationService:
         except Exception as e:
             notification.status = NotificationStatus.FAILED
             notification.error_message = str(e)
-        
-        db.commit()
 
     @staticmethod
     def _send_email(notification: Notification):
@@ -75,20 +81,28 @@ class NotificationService:
         pass
 
     @staticmethod
-    def send_bonus_notification(db: Session, customer_id: int, bonus_amount: float):
-        customer = db.query(Customer).filter(Customer.id == customer_id).first()
+    @timed("NotificationService.send_bonus_notification")
+    def send_bonus_notification(db: Session, customer_id: int, bonus_amount: float, commit: bool = True) -> Notification:
+        """
+        Записать уведомление о начислении бонусов в outbox (статус PENDING).
+        Отправляет его notification_dispatcher вне запроса; commit=False —
+        запись остаётся в транзакции вызывающего кода.
+        """
+        customer = db.get(Customer, customer_id)
         if not customer:
-            return
+            return None
         
         notification = Notification(
             customer_id=customer_id,
             notification_type=NotificationType.SMS,
+            status=NotificationStatus.PENDING,
+            outbox=True,
             subject="Начислены бонусы",
             message=f"Вам начислено {bonus_amount} бонусных баллов! Спасибо за покупку!"
         )
         db.add(notification)
-        db.commit()
-        
-        # Отправляем асинхронно
-        NotificationService.send_notification(db, notification.id)
-
+        if commit:
+            db.commit()
+        else:
+            db.flush()
+        return notification
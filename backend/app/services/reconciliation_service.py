@@ -0,0 +1,214 @@
+import logging
+from datetime import datetime
+from decimal import Decimal
+from typing import Dict, List, Optional, Tuple
+from sqlalchemy import func, case, update
+from sqlalchemy.orm import Session
+from app.core.config import settings
+from app.core.database import SessionLocal
+from app.core.parallel import id_ranges, default_workers, map_ranges
+from app.models.bonus import BonusBalance, BonusTransaction, BonusTransactionType
+from app.services.balance_cache import balance_cache
+from app.services.bonus_service import BALANCE_COLUMNS
+
+logger = logging.getLogger(__name__)
+
+CENT = Decimal("0.01")
+ZERO = Decimal("0")
+# Сколько отрезков customer_id приходится на один процесс (для балансировки нагрузки)
+PARTITIONS_PER_WORKER = 4
+# Сколько расхождений возвращать в отчёте (все пишутся в лог)
+SAMPLE_SIZE = 100
+
+
+class ReconciliationService:
+    """
+    Сверка BonusBalance (current_balance, total_earned, total_spent) с журналом
+    bonus_transactions.
+
+    Ожидаемые значения считаются агрегацией в SQL:
+    total_earned = сумма EARNED, total_spent = сумма SPENT,
+    current_balance = EARNED - SPENT - EXPIRED + ADJUSTMENT.
+    Клиенты проверяются отрезками customer_id без блокировок. Исправляются
+    только найденные расхождения: их строки блокируются на короткую
+    транзакцию, журнал пересчитывается под блокировкой, а UPDATE срабатывает,
+    лишь если баланс не изменился с момента чтения (compare-and-set).
+    """
+
+    @staticmethod
+    def reconcile(
+        db: Session,
+        repair: bool = False,
+        from_customer_id: int = None,
+        chunk_size: int = None,
+        workers: int = 1
+    ) -> dict:
+        chunk_size = chunk_size or settings.BONUS_RECONCILE_CHUNK_SIZE
+        
+        workers = default_workers(workers)
+        # SQLite сериализует запись: параллельные процессы только мешали бы друг другу
+        parallel = workers > 1 and db.get_bind().dialect.name != "sqlite"
+        ranges = id_ranges(
+            db, BonusBalance.customer_id, workers * PARTITIONS_PER_WORKER if parallel else 1,
+            start=from_customer_id
+        )
+        if not ranges:
+            return {"checked": 0, "mismatched": 0, "repaired": 0, "sample": [], "last_customer_id": None}
+        if not parallel:
+            return _reconcile_range(ranges[0][0], ranges[-1][1], repair, chunk_size, db)
+        
+        partials = map_ranges(workers, _reconcile_range, ranges, repair, chunk_size)
+        return {
+            "checked": sum(partial["checked"] for partial in partials),
+            "mismatched": sum(partial["mismatched"] for partial in partials),
+            "repaired": sum(partial["repaired"] for partial in partials),
+            "sample": [item for partial in partials for item in partial["sample"]][:SAMPLE_SIZE],
+            "last_customer_id": ranges[-1][1],
+        }
+
+    @staticmethod
+    def ledger_totals(db: Session, customer_from: int = None, customer_to: int = None, customer_ids: List[int] = None):
+        """Ожидаемые (current_balance, total_earned, total_spent) по журналу: customer_id -> кортеж"""
+        def total(*types):
+            return func.sum(case(
+                (BonusTransaction.transaction_type.in_(types), BonusTransaction.amount),
+                else_=0
+            ))
+        
+        earned = total(BonusTransactionType.EARNED)
+        spent = total(BonusTransactionType.SPENT)
+        expired = total(BonusTransactionType.EXPIRED)
+        adjusted = total(BonusTransactionType.ADJUSTMENT)
+        
+        query = db.query(BonusTransaction.customer_id, earned, spent, expired, adjusted)
+        if customer_ids is not None:
+            query = query.filter(BonusTransaction.customer_id.in_(customer_ids))
+        else:
+            query = query.filter(BonusTransaction.customer_id.between(customer_from, customer_to))
+        
+        totals = {}
+        for customer_id, earned_sum, spent_sum, expired_sum, adjusted_sum in query.group_by(BonusTransaction.customer_id):
+            earned_sum, spent_sum = _money(earned_sum), _money(spent_sum)
+            current = earned_sum - spent_sum - _money(expired_sum) + _money(adjusted_sum)
+            totals[customer_id] = (current, earned_sum, spent_sum)
+        return totals
+
+    @staticmethod
+    def _check_chunk(db: Session, customer_from: int, customer_to: int) -> Tuple[int, List[dict]]:
+        """Проверка клиентов [customer_from, customer_to] без блокировок: (проверено, расхождения)"""
+        balances = db.query(
+            BonusBalance.customer_id, BonusBalance.current_balance,
+            BonusBalance.total_earned, BonusBalance.total_spent
+        ).filter(BonusBalance.customer_id.between(customer_from, customer_to)).all()
+        expected = ReconciliationService.ledger_totals(db, customer_from, customer_to)
+        # Снимок только читался — не держим транзакцию открытой
+        db.rollback()
+        
+        mismatches = []
+        for customer_id, current_balance, total_earned, total_spent in balances:
+            mismatch = _compare(customer_id, (current_balance, total_earned, total_spent), expected)
+            if mismatch:
+                mismatches.append(mismatch)
+        return len(balances), mismatches
+
+    @staticmethod
+    def _repair(db: Session, customer_ids: List[int]) -> int:
+        """Исправление балансов клиентов под короткой блокировкой; число исправленных"""
+        balances = db.query(
+            BonusBalance.id, BonusBalance.customer_id, BonusBalance.current_balance,
+            BonusBalance.total_earned, BonusBalance.total_spent
+        ).filter(BonusBalance.customer_id.in_(customer_ids)).order_by(BonusBalance.id).with_for_update().all()
+        # Журнал пересчитывается после блокировки: операции пишутся вместе с
+        # изменением баланса, поэтому зафиксированные уже видны, а новые ждут
+        expected = ReconciliationService.ledger_totals(db, customer_ids=customer_ids)
+        
+        balances_table = BonusBalance.__table__
+        repaired = 0
+        for balance_id, customer_id, current_balance, total_earned, total_spent in balances:
+            mismatch = _compare(customer_id, (current_balance, total_earned, total_spent), expected)
+            if not mismatch:
+                continue
+            balance_cache.mark_pending([customer_id])
+            result = db.execute(
+                update(balances_table).where(
+                    balances_table.c.id == balance_id,
+                    balances_table.c.current_balance == current_balance,
+                    balances_table.c.total_earned == total_earned,
+                    balances_table.c.total_spent == total_spent
+                ).values(
+                    current_balance=mismatch["expected"]["current_balance"],
+                    total_earned=mismatch["expected"]["total_earned"],
+                    total_spent=mismatch["expected"]["total_spent"],
+                    last_updated=datetime.now(),
+                    version=balances_table.c.version + 1
+                ).returning(*BALANCE_COLUMNS)
+            )
+            row = result.first()
+            if row is not None:
+                balance_cache.stage(db, [row])
+                repaired += 1
+        return repaired
+
+
+def _money(value) -> Decimal:
+    return Decimal(str(value or 0)).quantize(CENT)
+
+
+def _compare(customer_id: int, actual: tuple, expected: Dict[int, tuple]) -> Optional[dict]:
+    """Расхождение баланса с журналом или None"""
+    actual = tuple(_money(value) for value in actual)
+    wanted = expected.get(customer_id, (ZERO, ZERO, ZERO))
+    if actual == wanted:
+        return None
+    fields = ("current_balance", "total_earned", "total_spent")
+    return {
+        "customer_id": customer_id,
+        "actual": dict(zip(fields, actual)),
+        "expected": dict(zip(fields, wanted)),
+    }
+
+
+def _reconcile_range(
+    customer_from: int,
+    customer_to: int,
+    repair: bool,
+    chunk_size: int,
+    db: Optional[Session] = None
+) -> dict:
+    """Сверка клиентов [customer_from, customer_to] отрезками по chunk_size (в т.ч. в отдельном процессе)"""
+    own_session = db is None
+    db = db or SessionLocal()
+    result = {"checked": 0, "mismatched": 0, "repaired": 0, "sample": [], "last_customer_id": None}
+    try:
+        for chunk_from in range(customer_from, customer_to + 1, chunk_size):
+            chunk_to = min(chunk_from + chunk_size - 1, customer_to)
+            checked, mismatches = ReconciliationService._check_chunk(db, chunk_from, chunk_to)
+            for mismatch in mismatches:
+                logger.warning(
+                    "Баланс клиента %s расходится с журналом: %s, ожидалось %s",
+                    mismatch["customer_id"], mismatch["actual"], mismatch["expected"]
+                )
+            
+            repaired = 0
+            if repair and mismatches:
+                try:
+                    repaired = ReconciliationService._repair(db, [m["customer_id"] for m in mismatches])
+                    db.commit()
+                except Exception:
+                    db.rollback()
+                    logger.exception("Сверка балансов прервана на клиентах %s-%s", chunk_from, chunk_to)
+                    raise
+            
+            result["checked"] += checked
+            result["mismatched"] += len(mismatches)
+            result["repaired"] += repaired
+            result["sample"].extend(mismatches[:SAMPLE_SIZE - len(result["sample"])])
+            result["last_customer_id"] = chunk_to
+            logger.info(
+                "Сверка балансов: клиенты до %s, расхождений %s, исправлено %s",
+                chunk_to, len(mismatches), repaired
+            )
+    finally:
+        if own_session:
+            db.close()
+    return result
@@ -0,0 +1,113 @@
+import logging
+import threading
+import time
+from typing import Dict, FrozenSet, Iterable, Optional
+from sqlalchemy.orm import Session
+from app.core.config import settings
+from app.core.database import SessionLocal
+from app.models.analytics import CustomerSegment
+
+logger = logging.getLogger(__name__)
+
+EMPTY_SEGMENTS: FrozenSet[str] = frozenset()
+
+
+class SegmentMembershipIndex:
+    """
+    Процессный индекс принадлежности клиентов к сегментам: customer_id → сегменты.
+
+    Загружается одним запросом (при старте приложения или первом
+    обращении), заменяется целиком после AnalyticsService.segment_customers.
+    По истечении SEGMENT_INDEX_TTL индекс перечитывается фоновым потоком в
+    собственной сессии, чтобы другие воркеры подхватывали новую сегментацию;
+    до конца перечитывания запросы (в том числе касса) получают прежний снимок
+    и не делают запросов к БД. Одинаковые наборы сегментов хранятся в одном
+    экземпляре frozenset.
+    """
+
+    def __init__(self, ttl_seconds: int):
+        self._ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._members: Optional[Dict[int, FrozenSet[str]]] = None
+        self._loaded_at = 0.0
+        # Растёт при каждой замене индекса: фоновое чтение не затирает более свежий replace()
+        self._generation = 0
+        self._refresher: Optional[threading.Thread] = None
+
+    def get(self, db: Session, customer_id: int) -> FrozenSet[str]:
+        return self._current(db).get(customer_id, EMPTY_SEGMENTS)
+
+    def replace(self, memberships: Dict[int, Iterable[str]]):
+        """Подменить индекс свежей сегментацией (без обращения к БД)"""
+        members = self._intern(memberships.items())
+        with self._lock:
+            self._set(members)
+
+    def refresh(self, db: Session):
+        """Перечитать индекс из БД (при старте приложения или из фонового потока)"""
+        with self._lock:
+            generation = self._generation
+        members = self._load(db)
+        with self._lock:
+            if self._generation == generation:
+                self._set(members)
+
+    def invalidate(self):
+        with self._lock:
+            self._members = None
+
+    def _current(self, db: Session) -> Dict[int, FrozenSet[str]]:
+        members = self._members
+        if members is None:
+            # Индекс ещё не загружен: единственный раз читаем его в запросе
+            with self._lock:
+                if self._members is None:
+                    self._set(self._load(db))
+                return self._members
+
+        if time.monotonic() - self._loaded_at >= self._ttl_seconds:
+            self._refresh_in_background()
+        return members
+
+    def _refresh_in_background(self):
+        with self._lock:
+            if self._refresher is not None and self._refresher.is_alive():
+                return
+            self._refresher = threading.Thread(
+                target=self._refresh_own_session, name="segment-index-refresh", daemon=True
+            )
+            self._refresher.start()
+
+    def _refresh_own_session(self):
+        db = SessionLocal()
+        try:
+            self.refresh(db)
+        except Exception:
+            # Остаётся прежний снимок, следующая попытка — при следующем обращении
+            logger.exception("Не удалось перечитать индекс сегментов")
+        finally:
+            db.close()
+
+    def _set(self, members: Dict[int, FrozenSet[str]]):
+        self._members = members
+        self._loaded_at = time.monotonic()
+        self._generation += 1
+
+    def _load(self, db: Session) -> Dict[int, FrozenSet[str]]:
+        rows = db.query(CustomerSegment.customer_id, CustomerSegment.segment_name).all()
+        grouped: Dict[int, set] = {}
+        for customer_id, segment_name in rows:
+            grouped.setdefault(customer_id, set()).add(segment_name)
+        return self._intern(grouped.items())
+
+    @staticmethod
+    def _intern(items) -> Dict[int, FrozenSet[str]]:
+        shared: Dict[FrozenSet[str], FrozenSet[str]] = {}
+        members = {}
+        for customer_id, segments in items:
+            segments = frozenset(segments)
+            members[customer_id] = shared.setdefault(segments, segments)
+        return members
+
+
+segment_index = SegmentMembershipIndex(ttl_seconds=settings.SEGMENT_INDEX_TTL)
@@ -0,0 +1,223 @@
+from sqlalchemy.orm import Session
+from sqlalchemy import func
+from datetime import datetime
+from decimal import Decimal
+from typing import List, Dict, Any, Optional
+from app.core.database import SessionLocal
+from app.core.parallel import id_ranges, default_workers, process_pool
+from app.models.customer import PurchaseHistory
+from app.models.discount import DiscountRule, DiscountRuleStatus
+from app.schemas.discount import DiscountCalculationRequest, DiscountSimulationResponse
+from app.services.discount_service import DiscountService
+from app.services.discount_rule_index import is_rule_valid_at
+from app.services.discount_compiler import CompiledRule, compile_rule
+from app.services.segment_index import segment_index
+
+# Сколько отрезков customer_id приходится на один процесс (для балансировки нагрузки)
+PARTITIONS_PER_WORKER = 4
+YIELD_PER = 10000
+
+
+class _CustomerState:
+    """Состояние клиента на момент покупки при воспроизведении истории"""
+    __slots__ = ("id", "total_visits")
+
+    def __init__(self, customer_id: int, total_visits: int):
+        self.id = customer_id
+        self.total_visits = total_visits
+
+
+class SimulationService:
+    """
+    Бэктест правил скидок: воспроизведение PurchaseHistory против набора
+    правил-кандидатов без записи в БД. Клиенты делятся на диапазоны
+    customer_id и обрабатываются в пуле процессов.
+    """
+
+    @staticmethod
+    def run_backtest(
+        db: Session,
+        rules: List[Dict[str, Any]],
+        start_date: datetime,
+        end_date: datetime,
+        store_ids: Optional[List[int]] = None,
+        workers: Optional[int] = None
+    ) -> DiscountSimulationResponse:
+        workers = default_workers(workers)
+        ranges = id_ranges(db, PurchaseHistory.customer_id, workers * PARTITIONS_PER_WORKER)
+        tasks = [(start, end, rules, start_date, end_date, store_ids) for start, end in ranges]
+
+        if workers <= 1 or len(tasks) <= 1:
+            partials = [_replay_partition(*task) for task in tasks]
+        else:
+            with process_pool(workers) as pool:
+                partials = list(pool.map(_replay_partition, *zip(*tasks)))
+
+        return SimulationService._merge(rules, partials)
+
+    @staticmethod
+    def build_rules(rules: List[Dict[str, Any]]) -> List[CompiledRule]:
+        """Скомпилированные правила-кандидаты; id — порядковый номер в запросе"""
+        compiled = []
+        for index, rule_data in enumerate(rules):
+            rule = DiscountRule(**rule_data)
+            rule.id = index
+            rule.status = DiscountRuleStatus.ACTIVE
+            rule.current_uses = 0
+            compiled.append(compile_rule(rule))
+        return compiled
+
+    @staticmethod
+    def _merge(rules: List[Dict[str, Any]], partials: List[dict]) -> DiscountSimulationResponse:
+        per_rule = [
+            {"rule_index": index, "name": rule["name"], "applications": 0,
+             "total_discount": Decimal("0"), "affected_customers": 0}
+            for index, rule in enumerate(rules)
+        ]
+        purchases = 0
+        revenue = Decimal("0")
+        affected = 0
+        uncapped_customers = set()
+        capped_events: Dict[int, list] = {}
+
+        for partial in partials:
+            purchases += partial["purchases"]
+            revenue += partial["revenue"]
+            affected += partial["affected_customers"]
+            uncapped_customers |= partial["uncapped_in_capped"]
+            for rule_id, stats in partial["rules"].items():
+                per_rule[rule_id]["applications"] += stats["applications"]
+                per_rule[rule_id]["total_discount"] += stats["total_discount"]
+                per_rule[rule_id]["affected_customers"] += stats["affected_customers"]
+            for rule_id, events in partial["capped_events"].items():
+                capped_events.setdefault(rule_id, []).extend(events)
+
+        # max_total_uses: оставляем первые по времени применения среди всех разделов
+        capped_customers = set()
+        for rule_id, events in capped_events.items():
+            events.sort()
+            kept = events[:rules[rule_id]["max_total_uses"]]
+            per_rule[rule_id]["applications"] = len(kept)
+            per_rule[rule_id]["total_discount"] = sum((event[3] for event in kept), Decimal("0"))
+            per_rule[rule_id]["affected_customers"] = len({event[2] for event in kept})
+            capped_customers |= {event[2] for event in kept}
+        affected += len(capped_customers - uncapped_customers)
+
+        return DiscountSimulationResponse(
+            purchases_replayed=purchases,
+            total_revenue=revenue,
+            total_discount=sum((rule["total_discount"] for rule in per_rule), Decimal("0")),
+            affected_customers=affected,
+            rules=per_rule
+        )
+
+
+def _replay_partition(
+    customer_from: int,
+    customer_to: int,
+    rules: List[Dict[str, Any]],
+    start_date: datetime,
+    end_date: datetime,
+    store_ids: Optional[List[int]]
+) -> dict:
+    """Воспроизведение покупок клиентов из диапазона [customer_from, customer_to] (в отдельном процессе)"""
+    compiled = SimulationService.build_rules(rules)
+    capped = {rule.id for rule in compiled if rule.max_total_uses}
+    result = {
+        "purchases": 0,
+        "revenue": Decimal("0"),
+        "affected_customers": 0,
+        "uncapped_in_capped": set(),
+        "rules": {rule.id: {"applications": 0, "total_discount": Decimal("0"), "affected_customers": 0}
+                  for rule in compiled if rule.id not in capped},
+        "capped_events": {rule_id: [] for rule_id in capped},
+    }
+
+    db = SessionLocal()
+    try:
+        # Визиты до начала окна — стартовое значение total_visits
+        visits_before = dict(
+            db.query(PurchaseHistory.customer_id, func.count(PurchaseHistory.id)).filter(
+                PurchaseHistory.customer_id.between(customer_from, customer_to),
+                PurchaseHistory.purchase_date < start_date
+            ).group_by(PurchaseHistory.customer_id).all()
+        )
+
+        query = db.query(
+            PurchaseHistory.customer_id,
+            PurchaseHistory.id,
+            PurchaseHistory.store_id,
+            PurchaseHistory.purchase_date,
+            PurchaseHistory.amount,
+            PurchaseHistory.discount_applied,
+            PurchaseHistory.bonuses_used
+        ).filter(
+            PurchaseHistory.customer_id.between(customer_from, customer_to),
+            PurchaseHistory.purchase_date >= start_date,
+            PurchaseHistory.purchase_date <= end_date
+        )
+        if store_ids:
+            query = query.filter(PurchaseHistory.store_id.in_(store_ids))
+        query = query.order_by(
+            PurchaseHistory.customer_id, PurchaseHistory.purchase_date, PurchaseHistory.id
+        ).yield_per(YIELD_PER)
+
+        customer = None
+        usage_counts: Dict[int, int] = {}
+        customer_rules = set()
+
+        for customer_id, purchase_id, store_id, purchase_date, amount, discount, bonuses in query:
+            if customer is None or customer.id != customer_id:
+                _finish_customer(result, customer, customer_rules, capped)
+                customer = _CustomerState(customer_id, visits_before.get(customer_id, 0))
+                usage_counts = {}
+                customer_rules = set()
+
+            # В истории хранится сумма после скидок и бонусов — восстанавливаем исходную
+            original_amount = amount + (discount or 0) + (bonuses or 0)
+            request = DiscountCalculationRequest.model_construct(
+                customer_id=customer_id, store_id=store_id, amount=original_amount, items=None
+            )
+            active_rules = [
+                rule for rule in compiled
+                if is_rule_valid_at(rule, purchase_date)
+                and (not rule.applicable_stores or store_id in rule.applicable_stores)
+            ]
+            # Сегменты берутся текущие: история сегментации не хранится
+            quote = DiscountService._quote(
+                active_rules, customer, request, usage_counts, {}, segment_index.get(db, customer_id)
+            )
+
+            for discount_info in quote.applicable_discounts:
+                rule_id = discount_info["rule_id"]
+                discount_amount = Decimal(str(discount_info["discount_amount"]))
+                usage_counts[rule_id] = usage_counts.get(rule_id, 0) + 1
+                customer_rules.add(rule_id)
+                if rule_id in capped:
+                    result["capped_events"][rule_id].append(
+                        (purchase_date, purchase_id, customer_id, discount_amount)
+                    )
+                else:
+                    result["rules"][rule_id]["applications"] += 1
+                    result["rules"][rule_id]["total_discount"] += discount_amount
+
+            customer.total_visits += 1
+            result["purchases"] += 1
+            result["revenue"] += original_amount
+
+        _finish_customer(result, customer, customer_rules, capped)
+    finally:
+        db.close()
+
+    return result
+
+
+def _finish_customer(result: dict, customer: Optional[_CustomerState], customer_rules: set, capped: set):
+    uncapped_rules = customer_rules - capped
+    for rule_id in uncapped_rules:
+        result["rules"][rule_id]["affected_customers"] += 1
+    if uncapped_rules:
+        result["affected_customers"] += 1
+        if customer_rules & capped:
+            # Клиент уже учтён; при слиянии не считаем его повторно по лимитированным правилам
+            result["uncapped_in_capped"].add(customer.id)
@@ -1,6 +1,7 @@
 from sqlalchemy.orm import Session
 from app.models.store import Store
 from app.schemas.store import StoreCreate, StoreUpdate
+from app.services.name_directory import store_names
 
 
 class StoreService:
@@ -10,6 +11,7 @@ class StoreService:
         db.add(store)
         db.commit()
         db.refresh(store)
+        store_names.invalidate()
         return store
 
     @staticmethod
@@ -32,5 +34,6 @@ class StoreService:
         
         db.commit()
         db.refresh(store)
+        store_names.invalidate()
         return store
 
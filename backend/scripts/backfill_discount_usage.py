@@ -0,0 +1,49 @@
+"""
+Скрипт для заполнения счётчиков использования скидок (discount_usage_counters)
+по существующим записям discount_applications
+"""
+from sqlalchemy import func, select, insert
+from app.core.database import SessionLocal
+from app.models.discount import DiscountApplication, DiscountUsageCounter
+
+
+def backfill_discount_usage():
+    """Пересчёт счётчиков использования скидок из истории применений (таблицу создаёт миграция)"""
+    db = SessionLocal()
+    
+    try:
+        usage = select(
+            DiscountApplication.customer_id,
+            DiscountApplication.discount_rule_id,
+            func.count(DiscountApplication.id),
+            func.max(DiscountApplication.applied_at)
+        ).group_by(
+            DiscountApplication.customer_id,
+            DiscountApplication.discount_rule_id
+        )
+        
+        # Пересобираем счётчики в одной транзакции
+        db.query(DiscountUsageCounter).delete()
+        db.execute(
+            insert(DiscountUsageCounter).from_select(
+                ["customer_id", "discount_rule_id", "uses_count", "last_used_at"],
+                usage
+            )
+        )
+        db.commit()
+        
+        total = db.query(func.count()).select_from(DiscountUsageCounter).scalar()
+        print(f"[OK] Счётчиков использования скидок: {total}")
+        
+    except Exception as e:
+        db.rollback()
+        print(f"Ошибка: {e}")
+        import traceback
+        traceback.print_exc()
+        raise
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    backfill_discount_usage()
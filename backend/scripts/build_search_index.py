@@ -0,0 +1,29 @@
+"""
+Построение поискового индекса клиентов (после миграции или для восстановления)
+
+    python -m scripts.build_search_index
+"""
+from app.core.database import SessionLocal
+from app.services.customer_search import CustomerSearchService
+
+
+def build_search_index():
+    """Перестроить customer_search_terms для всех клиентов"""
+    db = SessionLocal()
+    
+    try:
+        indexed = CustomerSearchService.rebuild(db)
+        print(f"[OK] Проиндексировано клиентов: {indexed}")
+        
+    except Exception as e:
+        print(f"Ошибка: {e}")
+        import traceback
+        traceback.print_exc()
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    build_search_index()
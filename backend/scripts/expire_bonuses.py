@@ -0,0 +1,42 @@
+"""
+Скрипт сгорания бонусных баллов (запускается по расписанию, например ночью)
+
+    python -m scripts.expire_bonuses [--from-customer ID] [--workers N]
+"""
+import argparse
+import logging
+from app.core.database import SessionLocal
+from app.core.parallel import RangesFailed
+from app.services.bonus_service import BonusService
+
+
+def expire_bonuses(from_customer_id: int = None, workers: int = 1):
+    """Списание баллов старше BONUS_LIFETIME_DAYS"""
+    db = SessionLocal()
+    
+    try:
+        result = BonusService.expire_bonuses(db, from_customer_id=from_customer_id, workers=workers)
+        print(f"[OK] Баллы сгорели у {result['customers']} клиентов, всего: {result['expired']}")
+        
+    except RangesFailed as e:
+        print(f"Ошибка: {e}")
+        resume_from = e.last_completed + 1 if e.last_completed is not None else from_customer_id
+        print(f"Запуск можно продолжить с --from-customer {resume_from}" if resume_from else "Запустите заново")
+        raise
+    except Exception as e:
+        print(f"Ошибка: {e}")
+        print("Запуск можно продолжить с --from-customer, см. последний обработанный отрезок в логе")
+        import traceback
+        traceback.print_exc()
+        raise
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    parser = argparse.ArgumentParser(description="Сгорание бонусных баллов")
+    parser.add_argument("--from-customer", type=int, default=None, help="продолжить с этого customer_id")
+    parser.add_argument("--workers", type=int, default=1, help="число процессов (только не SQLite)")
+    args = parser.parse_args()
+    expire_bonuses(args.from_customer, args.workers)
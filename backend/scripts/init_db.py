@@ -146,7 +146,7 @@ def create_purchase_history(db: Session, customers, stores):
                 amount=amount,
                 items_count=random.randint(1, 10),
                 payment_method=random.choice(["cash", "card", "online"]),
-                receipt_number=f"RCP-{random.randint(1000, 9999)}",
+                receipt_number=f"RCP-{customer.id:05d}-{i + 1:03d}",
             )
             
             purchase = CustomerService.create_purchase(db, purchase_data)
@@ -232,11 +232,15 @@ def init_db(clear_existing=False):
         if clear_existing:
             print("Очистка существующих данных...")
             # Удаляем данные в правильном порядке (из-за внешних ключей)
+            db.query(DiscountUsageCounter).delete()
+            db.query(DiscountRuleStore).delete()
             db.query(DiscountApplication).delete()
             db.query(BonusTransaction).delete()
             db.query(PurchaseHistory).delete()
+            db.query(CustomerStore).delete()
             db.query(BonusBalance).delete()
             db.query(CustomerSegment).delete()
+            db.query(CustomerSearchTerm).delete()
             db.query(Customer).delete()
             db.query(DiscountRule).delete()
             db.query(Store).delete()
@@ -0,0 +1,30 @@
+"""
+Отдельный процесс отправки уведомлений из outbox
+(для запуска API с NOTIFICATION_WORKERS=0)
+"""
+import time
+from app.services.notification_dispatcher import NotificationDispatcher
+from app.core.config import settings
+
+
+def run_notification_worker():
+    """Запуск пула отправки уведомлений до остановки процесса"""
+    dispatcher = NotificationDispatcher(
+        workers=max(1, settings.NOTIFICATION_WORKERS),
+        poll_interval=settings.NOTIFICATION_POLL_INTERVAL,
+        batch_size=settings.NOTIFICATION_BATCH_SIZE
+    )
+    dispatcher.start()
+    print(f"[OK] Отправка уведомлений запущена, потоков: {max(1, settings.NOTIFICATION_WORKERS)}")
+    
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        dispatcher.stop()
+
+
+if __name__ == "__main__":
+    run_notification_worker()
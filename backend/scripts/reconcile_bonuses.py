@@ -0,0 +1,50 @@
+"""
+Сверка бонусных балансов с журналом операций
+
+    python -m scripts.reconcile_bonuses [--repair] [--from-customer ID] [--workers N]
+"""
+import argparse
+import logging
+from app.core.database import SessionLocal
+from app.core.parallel import RangesFailed
+from app.services.reconciliation_service import ReconciliationService
+
+
+def reconcile_bonuses(repair: bool = False, from_customer_id: int = None, workers: int = 1):
+    """Поиск (и с repair — исправление) расхождений BonusBalance с bonus_transactions"""
+    db = SessionLocal()
+    
+    try:
+        result = ReconciliationService.reconcile(
+            db, repair=repair, from_customer_id=from_customer_id, workers=workers
+        )
+        for mismatch in result["sample"]:
+            print(f"  клиент {mismatch['customer_id']}: {mismatch['actual']} -> {mismatch['expected']}")
+        print(
+            f"[OK] Проверено балансов: {result['checked']}, расхождений: {result['mismatched']}, "
+            f"исправлено: {result['repaired']}"
+        )
+        
+    except RangesFailed as e:
+        print(f"Ошибка: {e}")
+        resume_from = e.last_completed + 1 if e.last_completed is not None else from_customer_id
+        print(f"Запуск можно продолжить с --from-customer {resume_from}" if resume_from else "Запустите заново")
+        raise
+    except Exception as e:
+        print(f"Ошибка: {e}")
+        print("Запуск можно продолжить с --from-customer, см. последний обработанный отрезок в логе")
+        import traceback
+        traceback.print_exc()
+        raise
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    parser = argparse.ArgumentParser(description="Сверка бонусных балансов с журналом операций")
+    parser.add_argument("--repair", action="store_true", help="исправить найденные расхождения")
+    parser.add_argument("--from-customer", type=int, default=None, help="продолжить с этого customer_id")
+    parser.add_argument("--workers", type=int, default=1, help="число процессов (только не SQLite)")
+    args = parser.parse_args()
+    reconcile_bonuses(args.repair, args.from_customer, args.workers)
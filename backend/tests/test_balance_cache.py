@@ -0,0 +1,23 @@
+from datetime import datetime
+from decimal import Decimal
+
+from app.models import BonusBalance, Customer
+from app.services.balance_cache import balance_cache
+from app.services.bonus_service import BonusService
+
+
+def test_expiry_puts_new_balance_into_cache(db, monkeypatch):
+    monkeypatch.setattr(balance_cache, "_store", None)
+    customer = Customer(phone="+79000000000", first_name="Тест")
+    db.add(customer)
+    db.commit()
+    BonusService.add_bonuses(db, customer.id, Decimal("100"))
+    assert balance_cache.get(customer.id)["current_balance"] == "100.00"
+
+    BonusService.expire_bonuses(db, as_of=datetime(2100, 1, 1))
+
+    cached = balance_cache.get(customer.id)
+    balance = db.query(BonusBalance).filter(BonusBalance.customer_id == customer.id).one()
+    assert cached is not None
+    assert Decimal(cached["current_balance"]) == balance.current_balance == Decimal("0")
+    assert cached["version"] == balance.version
@@ -0,0 +1,50 @@
+from decimal import Decimal
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from app.core.database import Base
+from app.models import BonusBalance, BonusTransaction, Customer
+from app.models.bonus import BonusTransactionType
+from app.services.bonus_service import BonusService
+
+
+@pytest.fixture
+def db():
+    engine = create_engine(
+        "sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool
+    )
+    Base.metadata.create_all(bind=engine)
+    session = sessionmaker(bind=engine)()
+    yield session
+    session.close()
+    engine.dispose()
+
+
+def test_cursor_pages_rows_of_the_same_second(db):
+    customer = Customer(phone="+79000000000", first_name="Тест")
+    db.add(customer)
+    db.commit()
+    balance = BonusBalance(customer_id=customer.id)
+    db.add(balance)
+    db.commit()
+    # Дата не задана — строки получают время вставки, все в пределах одной секунды
+    for amount in range(5):
+        db.add(BonusTransaction(
+            balance_id=balance.id, customer_id=customer.id, transaction_type=BonusTransactionType.EARNED,
+            amount=Decimal(amount), balance_before=Decimal(0), balance_after=Decimal(amount)
+        ))
+    db.commit()
+
+    expected = [t.id for t in BonusService.get_transactions(db, customer.id)]
+    seen, cursor = [], None
+    for _ in range(len(expected) + 1):
+        page = BonusService.get_transactions(db, customer.id, limit=2, cursor=cursor)
+        seen += [t.id for t in page]
+        cursor = BonusService.next_cursor(page, 2)
+        if cursor is None:
+            break
+    assert seen == expected
+    assert len(set(seen)) == 5
@@ -0,0 +1,62 @@
+from decimal import Decimal
+
+from sqlalchemy import update
+
+from app.models import Customer
+from app.models.discount import DiscountRule, DiscountType
+from app.schemas.discount import DiscountCalculationRequest, DiscountLineItem
+from app.services.discount_rule_index import rule_index
+from app.services.discount_service import DiscountService
+
+
+def _quote_and_reserve(db, rules, items):
+    """Котировка со всеми правилами, затем лимит правил с max_total_uses исчерпывается до резервирования"""
+    customer = Customer(phone="+79000000000", first_name="Тест")
+    db.add(customer)
+    db.add_all(rules)
+    db.commit()
+    rule_index.invalidate()
+
+    request = DiscountCalculationRequest(
+        customer_id=customer.id, store_id=1, amount=sum(item.price for item in items), items=items
+    )
+    quote = DiscountService.calculate_discounts(db, request)
+    db.execute(
+        update(DiscountRule).where(DiscountRule.max_total_uses.isnot(None))
+        .values(current_uses=DiscountRule.max_total_uses)
+    )
+    return quote, DiscountService.reserve_discounts(db, request, quote)
+
+
+def test_reserve_keeps_line_discounts_of_reserved_rules(db):
+    open_rule = DiscountRule(name="10%", discount_type=DiscountType.PERCENTAGE, value=Decimal("10"))
+    exhausted = DiscountRule(
+        name="5%", discount_type=DiscountType.PERCENTAGE, value=Decimal("5"), max_total_uses=1
+    )
+    items = [DiscountLineItem(price=Decimal("100")), DiscountLineItem(price=Decimal("200"))]
+
+    quote, reserved = _quote_and_reserve(db, [open_rule, exhausted], items)
+
+    assert quote.line_discounts == [Decimal("15.00"), Decimal("30.00")]
+    assert [d["rule_id"] for d in reserved.applicable_discounts] == [open_rule.id]
+    assert reserved.total_discount == Decimal("30.00")
+    assert reserved.line_discounts == [Decimal("10.00"), Decimal("20.00")]
+
+
+def test_reserve_reallocates_lines_when_category_rule_is_dropped(db):
+    basket_rule = DiscountRule(name="10%", discount_type=DiscountType.PERCENTAGE, value=Decimal("10"))
+    category_rule = DiscountRule(
+        name="50% a", discount_type=DiscountType.PERCENTAGE, value=Decimal("50"),
+        applicable_categories=["a"], max_total_uses=1
+    )
+    items = [
+        DiscountLineItem(category="a", price=Decimal("100")),
+        DiscountLineItem(category="b", price=Decimal("100")),
+    ]
+
+    quote, reserved = _quote_and_reserve(db, [basket_rule, category_rule], items)
+
+    assert quote.line_discounts == [Decimal("60.00"), Decimal("10.00")]
+    assert [d["rule_id"] for d in reserved.applicable_discounts] == [basket_rule.id]
+    assert reserved.total_discount == Decimal("20.00")
+    assert reserved.line_discounts == [Decimal("10.00"), Decimal("10.00")]
@@ -0,0 +1,19 @@
+from app.core.metrics import StageClock, pos_stage_seconds
+
+
+def _stage_outcomes(store_id):
+    return {
+        (stage, outcome)
+        for stage, label_store, outcome in pos_stage_seconds._series
+        if label_store == store_id
+    }
+
+
+def test_stage_clock_records_stages_with_final_outcome():
+    clock = StageClock("test-error")
+    clock.stage("discount_calc")
+    clock.stage("commit")
+    assert _stage_outcomes("test-error") == set()
+
+    clock.finish("error")
+    assert _stage_outcomes("test-error") == {("discount_calc", "error"), ("commit", "error")}
@@ -0,0 +1,36 @@
+from sqlalchemy import event
+
+from app.models import Store
+from app.services.name_directory import NameDirectory
+
+
+def test_get_many_reloads_on_missing_id(db):
+    db.add(Store(name="Первый"))
+    db.commit()
+    directory = NameDirectory(Store.id, Store.name, ttl_seconds=3600, miss_reload_seconds=0)
+    assert directory.get_many(db, [1]) == {1: "Первый"}
+
+    # Магазин создан в обход сервиса (другой воркер): справочник не сброшен
+    db.add(Store(name="Второй"))
+    db.commit()
+    assert directory.get_many(db, [1, 2]) == {1: "Первый", 2: "Второй"}
+    assert directory.get(db, 3) is None
+
+
+def test_missing_id_reloads_at_most_once_per_interval(db):
+    db.add(Store(name="Первый"))
+    db.commit()
+    directory = NameDirectory(Store.id, Store.name, ttl_seconds=3600, miss_reload_seconds=60)
+
+    queries = []
+    listener = lambda *args: queries.append(args[2])
+    event.listen(db.get_bind(), "before_cursor_execute", listener)
+    try:
+        # Удалённый id: ни первая загрузка, ни повторные запросы не перечитывают справочник
+        for _ in range(3):
+            assert directory.get_many(db, [1, 99]) == {1: "Первый"}
+    finally:
+        event.remove(db.get_bind(), "before_cursor_execute", listener)
+    assert len(queries) == 1
+    assert directory.peek(1) == "Первый"
+    assert directory.peek(99) is None
@@ -0,0 +1,25 @@
+from app.models import Customer
+from app.models.notification import Notification, NotificationStatus, NotificationType
+from app.services.notification_dispatcher import NotificationDispatcher
+from app.services.notification_service import NotificationService
+
+
+def test_drain_sends_outbox_and_keeps_drafts(db):
+    customer = Customer(phone="+79000000000", first_name="Тест")
+    db.add(customer)
+    db.commit()
+    draft = Notification(
+        customer_id=customer.id, notification_type=NotificationType.SMS, message="Черновик"
+    )
+    db.add(draft)
+    db.commit()
+    outbox = NotificationService.send_bonus_notification(db, customer.id, 10)
+
+    dispatcher = NotificationDispatcher(workers=0, poll_interval=1, batch_size=100)
+    assert dispatcher.drain(db) == 1
+    assert dispatcher.drain(db, [draft.id]) == 0
+
+    db.refresh(draft)
+    db.refresh(outbox)
+    assert outbox.status == NotificationStatus.SENT
+    assert draft.status == NotificationStatus.PENDING
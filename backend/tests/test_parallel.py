@@ -0,0 +1,21 @@
+import pytest
+
+from app.core.parallel import RangesFailed, map_ranges
+
+
+def _fail_on(start, end, failing_start):
+    if start == failing_start:
+        raise ValueError("сбой отрезка")
+    return end
+
+
+def test_map_ranges_keeps_range_order():
+    ranges = [(1, 10), (11, 20), (21, 30)]
+    assert map_ranges(2, _fail_on, ranges, None) == [10, 20, 30]
+
+
+def test_map_ranges_reports_last_contiguous_range():
+    ranges = [(1, 10), (11, 20), (21, 30)]
+    with pytest.raises(RangesFailed) as failure:
+        map_ranges(2, _fail_on, ranges, 11)
+    assert failure.value.last_completed == 10
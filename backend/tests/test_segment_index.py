@@ -0,0 +1,35 @@
+import time
+
+from sqlalchemy import event
+from sqlalchemy.orm import sessionmaker
+
+import app.services.segment_index as segment_index_module
+from app.models import Customer, CustomerSegment
+from app.services.segment_index import SegmentMembershipIndex
+
+
+def test_stale_index_is_served_and_refreshed_in_background(db, monkeypatch):
+    customer = Customer(phone="+79000000000", first_name="Тест")
+    db.add(customer)
+    db.commit()
+    customer_id = customer.id
+    index = SegmentMembershipIndex(ttl_seconds=60)
+    index.replace({customer_id: {"new"}})
+
+    db.add(CustomerSegment(customer_id=customer_id, segment_name="vip"))
+    db.commit()
+    monkeypatch.setattr(segment_index_module, "SessionLocal", sessionmaker(bind=db.get_bind()))
+    index._loaded_at = time.monotonic() - 61
+
+    queries = []
+    listener = lambda *args: queries.append(args[2])
+    event.listen(db.get_bind(), "before_cursor_execute", listener)
+    try:
+        # Запрос получает прежний снимок и не обращается к БД
+        assert index.get(db, customer_id) == frozenset({"new"})
+        index._refresher.join(5)
+    finally:
+        event.remove(db.get_bind(), "before_cursor_execute", listener)
+
+    assert len(queries) == 1  # только чтение фонового потока
+    assert index.get(db, customer_id) == frozenset({"vip"})
@@ -96,7 +96,8 @@ export interface PaginatedResponse<T> {
 }
 
 export interface CustomerHistoryEntry {
-  id: number
+  id: string
+  history_id: number
   changed_at: string
   changed_by?: string
   change_type: string